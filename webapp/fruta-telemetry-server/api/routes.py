@@ -1,17 +1,26 @@
 from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
-import time
+import hmac
 import json
+import time
 from services import blob as sb
-import requests
 import os
-from datetime import datetime
-from email.utils import parsedate_to_datetime
-import re
 from flask import current_app
 import traceback
 
 # new telemetry store imports
-from services.telemetry_store import init_db, insert_message, get_messages
+from services import telemetry_store
+from services.telemetry_store import init_db, insert_message, insert_many, query_messages, query_analyses, query_metrics, query_detections
+from services.json_stream import iter_json_records
+from services import events as events_hub
+from services import detection
+from services import detection_post
+from services import auto_analyze
+from services import image_cache
+from services import ingest
+from services import retention
+from services import mqtt_ingest
+from services import upload
+from services import analyze_batch
 
 api = Blueprint('api', __name__)
 
@@ -22,12 +31,31 @@ init_db()
 def load_latest():
     """
     Return list of blobs (newest first) as JSON under key 'items'.
-    Accepts optional query params: containerUrl, sas
+    Accepts optional query params: containerUrl, sas, prefix (blob name prefix, e.g. device id),
+    limit and cursor (pass back 'next_cursor' from the previous page).
+    order=name returns raw storage pages in blob-name order instead (cursor is the storage marker).
     """
     container_url = request.args.get('containerUrl')
     sas_token = request.args.get('sas') or current_app.config.get('SAS_TOKEN')
+    prefix = request.args.get('prefix') or None
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit')
+    order = request.args.get('order', 'newest')
     try:
-        items = sb.list_blobs(container_url=container_url, sas_token=sas_token)
+        limit = max(1, min(int(limit), 5000)) if limit else None
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        next_cursor = None
+        if order == 'name':
+            items, next_cursor = sb.list_blobs_by_name(container_url=container_url, sas_token=sas_token,
+                                                       prefix=prefix, limit=limit or 1000, marker=cursor)
+        elif limit or cursor or prefix:
+            items, next_cursor = sb.list_blobs_page(container_url=container_url, sas_token=sas_token,
+                                                    prefix=prefix, limit=limit or 1000, cursor=cursor)
+        else:
+            # items come back from the listing index already sorted newest first
+            items = sb.list_blobs(container_url=container_url, sas_token=sas_token)
         # debug: log count and sample names to help diagnose empty lists
         try:
             current_app.logger.info("load_latest: found %d items", len(items) if items is not None else 0)
@@ -35,31 +63,9 @@ def load_latest():
                 current_app.logger.info("load_latest: first items: %s", [i.get('name') for i in items[:5]])
         except Exception:
             pass
-        # Normalize ordering: attempt to sort by lastModified (RFC1123) then by filename timestamp (YYYYMMDD-HHMMSS)
-        def _item_ts(it):
-            lm = it.get('lastModified')
-            if lm:
-                try:
-                    return parsedate_to_datetime(lm).timestamp()
-                except Exception:
-                    pass
-            # try to extract timestamp from filename like ...-YYYYMMDD-HHMMSS.jpg
-            name = it.get('name') or ''
-            m = re.search(r'(\d{8}-\d{6})', name)
-            if m:
-                try:
-                    return datetime.strptime(m.group(1), '%Y%m%d-%H%M%S').timestamp()
-                except Exception:
-                    pass
-            return 0
-
-        try:
-            items.sort(key=_item_ts, reverse=True)
-        except Exception:
-            # fallback: reverse list if sort fails for any reason
-            items = list(reversed(items))
-
-        return jsonify({'items': items}), 200
+        return jsonify({'items': items, 'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -103,209 +109,193 @@ def analyze():
     if not blob_url and not blob_name:
         return jsonify({'error': 'blobName or blobUrl is required'}), 400
 
-    # resolve blob_name -> blob_url if needed
-    if blob_name and not blob_url:
-        try:
-            info = sb.fetch_blob_data(container_url=container_url, blob_name=blob_name, sas_token=sas_token)
-            blob_url = info.get('blob_url') if info else None
-        except Exception as e:
-            current_app.logger.exception("analyze: failed to resolve blob url for %s: %s", blob_name, e)
-            # fall through with blob_url = None
-
-    # if we couldn't resolve to a usable URL, return empty detection result (200)
-    if not blob_url:
-        current_app.logger.info("analyze: no blob URL available for %s, returning empty detection", blob_name)
-        return jsonify({
-            'detections': [],
-            'mango_matches': [],
-            'mango_likelihood': 0.0,
-            'blobName': blob_name,
-            'blobUrl': None,
-            'prediction': None
-        }), 200
-
-    # fetch image bytes (graceful fallback: return empty detection instead of 500)
     try:
-        resp = requests.get(blob_url, timeout=20)
-        resp.raise_for_status()
-        img_bytes = resp.content
-        content_type = resp.headers.get('Content-Type') or 'image/jpeg'
-    except requests.HTTPError as e:
-        current_app.logger.exception("analyze: HTTP error fetching image %s", blob_url)
-        return jsonify({
-            'detections': [],
-            'mango_matches': [],
-            'mango_likelihood': 0.0,
-            'blobName': blob_name,
-            'blobUrl': blob_url,
-            'prediction': None,
-            'error': f'failed to fetch image: {e}'
-        }), 200
+        result, _ = analyze_batch.analyze_one(blob_name, blob_url, None, container_url, sas_token, current_app.config)
+    except detection.DetectionError as e:
+        return jsonify(e.body), e.status
+    return jsonify(result), 200
+
+@api.route('/api/analyze/batch', methods=['POST'])
+def analyze_many():
+    """
+    Accepts JSON { "items": [...] } where each item is a blob name, a blob URL or
+    { "blobName"|"blobUrl", "etag"? }. Images are downloaded concurrently and detector calls
+    share a bounded, rate-paced pool; results stream back as NDJSON lines in completion order,
+    each the /api/analyze body plus the item's "index" and "status", followed by a summary line.
+    """
+    payload = request.get_json(silent=True) or {}
+    container_url = payload.get('containerUrl') or request.args.get('containerUrl')
+    sas_token = payload.get('sas') or request.args.get('sas') or current_app.config.get('SAS_TOKEN')
+    try:
+        items = analyze_batch.parse_items(payload.get('items', payload.get('blobNames')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    config = current_app.config
+
+    def generate():
+        started = time.monotonic()
+        failed = 0
+        for line in analyze_batch.iter_batch(items, container_url, sas_token, config):
+            failed += line['status'] != 200
+            yield json.dumps(line) + '\n'
+        yield json.dumps({'done': True, 'count': len(items), 'failed': failed,
+                          'elapsed': round(time.monotonic() - started, 3)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/api/upload', methods=['POST', 'PUT'])
+@api.route('/api/upload/<path:blob_name>', methods=['PUT'])
+def upload_image(blob_name=None):
+    """
+    Direct device upload: the raw JPEG/PNG body (Content-Length or chunked) is written through
+    to the container as it arrives, then announced on /events and recorded as an
+    "image_uploaded" telemetry row. Without a name in the path one is generated from the
+    device id (?deviceId= or X-Device-Id). An existing
+    blob is only replaced with ?overwrite=1 (409 otherwise). Requires UPLOAD_TOKEN.
+    Returns 201 with the blob's name, url, etag, lastModified and size.
+    """
+    error = _token_error(upload.TOKEN, 'UPLOAD_TOKEN')
+    if error:
+        return error
+    device_id = request.args.get('deviceId') or request.headers.get('X-Device-Id')
+    overwrite = request.args.get('overwrite', '0').lower() in ('1', 'true', 'yes')
+    try:
+        result = upload.store_upload(current_app._get_current_object(), blob_name or upload.default_name(device_id),
+                                     request.stream, device_id=device_id,
+                                     content_length=request.content_length, overwrite=overwrite)
+    except upload.UploadError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
-        current_app.logger.exception("analyze: failed to fetch image %s", e)
-        return jsonify({
-            'detections': [],
-            'mango_matches': [],
-            'mango_likelihood': 0.0,
-            'blobName': blob_name,
-            'blobUrl': blob_url,
-            'prediction': None,
-            'error': 'failed to fetch image'
-        }), 200
-
-    # API key
-    api_key = os.getenv('API_NINJAS_KEY') or current_app.config.get('API_NINJAS_KEY')
-    if not api_key:
-        return jsonify({'error': 'API_NINJAS_KEY not configured on server'}), 500
-
-    # call API Ninjas object detection
-    api_url = 'https://api.api-ninjas.com/v1/objectdetection'
-    files = {'image': ('image', img_bytes, content_type)}
-    headers = {'X-Api-Key': api_key}
+        current_app.logger.exception("upload: failed to store %s", blob_name)
+        return jsonify({'error': f'upload failed: {e}'}), 502
+    return jsonify(result), 201
+
+# bearer token for administrative writes (e.g. POST /api/settings); unset disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN') or None
+
+
+def _token_error(expected, env_name):
+    """
+    None if the request carries "Authorization: Bearer <expected>", else the error response.
+    An endpoint whose token is not configured is disabled (403).
+    """
+    if not expected:
+        return jsonify({'error': f'disabled: set {env_name} to enable this endpoint'}), 403
+    supplied = request.headers.get('Authorization') or ''
+    if not hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {expected}'.encode('utf-8')):
+        return jsonify({'error': 'unauthorized'}), 401
+    return None
+
 
+@api.route('/api/settings', methods=['GET', 'POST'])
+def settings():
+    """
+    Runtime settings. GET returns { apiKeyPresent, fruitKeywords }. POST (Authorization:
+    Bearer <ADMIN_TOKEN>) accepts JSON { "apiNinjasKey": "...", "fruitKeywords": [...] or "a,b,c" };
+    a posted key takes precedence over the API_NINJAS_KEY env var (an empty one reverts to it),
+    and changing the keywords recompiles the shared fruit matcher used by every analyze path.
+    Changes apply to this process only and are lost on restart.
+    """
+    config = current_app.config
+    if request.method == 'POST':
+        error = _token_error(ADMIN_TOKEN, 'ADMIN_TOKEN')
+        if error:
+            return error
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'JSON object required'}), 400
+        if 'apiNinjasKey' in payload:
+            config['API_NINJAS_KEY'] = (payload.get('apiNinjasKey') or '').strip() or None
+        if 'fruitKeywords' in payload:
+            value = payload.get('fruitKeywords')
+            if not isinstance(value, (str, list)):
+                return jsonify({'error': 'fruitKeywords must be a list or comma-separated string'}), 400
+            keywords = detection_post.parse_keywords(value)
+            if not keywords:
+                return jsonify({'error': 'fruitKeywords must not be empty'}), 400
+            config['FRUIT_KEYWORDS'] = ','.join(sorted(keywords))
+            detection_post.set_keywords(keywords)
+    return jsonify({'apiKeyPresent': bool(detection.api_key(config)),
+                    'fruitKeywords': sorted(detection_post.get_matcher(config).keywords)})
+
+# thumbnails are keyed by ETag, so clients can keep them for a long time
+THUMB_MAX_AGE = int(os.getenv('IMAGE_THUMB_MAX_AGE', '86400'))
+
+@api.route('/api/thumbnail', methods=['GET'])
+def thumbnail():
+    """
+    Small JPEG preview of an image blob: ?name=<blob-name>[&size=96|160|320][&etag=<etag>].
+    Passing the ETag from /api/load_latest skips the storage lookup. Previews and the
+    originals they are made from are kept in the on-disk image cache. Without Pillow the
+    original image is returned.
+    """
+    name = request.args.get('name')
+    if not name:
+        return jsonify({'error': 'name required'}), 400
     try:
-        # simple retry for rate-limit responses
-        max_attempts = 2
-        attempt = 0
-        raw = []
-        while attempt < max_attempts:
-            attempt += 1
-            r = requests.post(api_url, headers=headers, files=files, timeout=30)
-            current_app.logger.info("analyze: called API Ninjas %s (attempt=%d status=%s)", api_url, attempt, r.status_code)
-            if r.status_code == 429:
-                retry_after = r.headers.get('Retry-After')
-                current_app.logger.warning("analyze: rate limited by API Ninjas, Retry-After=%s", retry_after)
-                if attempt < max_attempts:
-                    try:
-                        delay = int(retry_after) if retry_after else 1
-                    except Exception:
-                        delay = 1
-                    time.sleep(delay)
-                    continue
-                else:
-                    return jsonify({'error': 'object detection rate limited', 'status': 429, 'retry_after': retry_after}), 502
-            r.raise_for_status()
-            raw = r.json() if r.text else []
-            break
-
-        # Normalize various provider shapes: support 'name' or 'label' and ensure confidence is a float
-        detections = []
-        if isinstance(raw, list):
-            for item in raw:
-                label = item.get('name') or item.get('label') or item.get('labelName') or ''
-                conf = item.get('confidence') if 'confidence' in item else item.get('score') or item.get('confidenceScore') or 0.0
-                try:
-                    conf = float(conf)
-                except Exception:
-                    conf = 0.0
-                nd = dict(item)
-                nd['name'] = label
-                nd['confidence'] = conf
-                detections.append(nd)
+        size = int(request.args.get('size', image_cache.DEFAULT_THUMB_SIZE))
+    except ValueError:
+        return jsonify({'error': 'size must be an integer'}), 400
+    # snap to a fixed set of sizes so the cache holds a bounded number of variants
+    size = min(image_cache.THUMB_SIZES, key=lambda s: abs(s - size))
+    container_url = request.args.get('containerUrl')
+    sas_token = request.args.get('sas') or current_app.config.get('SAS_TOKEN')
+    fetch_original = lambda: sb.fetch_blob_content(container_url=container_url, blob_name=name, sas_token=sas_token)
+
+    etag = request.args.get('etag')
+    try:
+        if not etag:
+            info = sb.fetch_blob_data(container_url=container_url, blob_name=name, sas_token=sas_token)
+            etag = info.get('etag') if info else None
+        if not etag:
+            # unknown version: nothing safe to cache under
+            original = fetch_original()
+            data = image_cache.make_thumbnail(original, size) or original
+            return Response(data, mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+
+        thumb_etag = '"{}-t{}"'.format(etag.strip('"'), size)
+        if sb.etag_matches(request.headers.get('If-None-Match'), thumb_etag):
+            return Response(status=304, headers={'ETag': thumb_etag})
+        cache = image_cache.get_cache()
+        original_key = image_cache.key_for_image(name, etag)
+        if image_cache.Image is None:
+            data = cache.get_or_fetch(original_key, fetch_original)
         else:
-            detections = raw or []
-        current_app.logger.info("analyze: API Ninjas responded status=%s detections=%d", r.status_code, len(detections) if isinstance(detections, list) else 0)
-        current_app.logger.debug("analyze: raw detections sample: %s", raw if isinstance(raw, list) else str(raw)[:200])
-    except requests.HTTPError as e:
-        body = None
-        try:
-            body = r.text
-        except Exception:
-            pass
-        return jsonify({'error': 'object detection API error', 'details': str(e), 'response': body}), 502
+            data = cache.get_or_fetch(
+                image_cache.key_for_thumbnail(name, etag, size),
+                lambda: image_cache.make_thumbnail(cache.get_or_fetch(original_key, fetch_original), size))
     except Exception as e:
-        current_app.logger.exception("analyze: object detection request failed: %s", e)
-        return jsonify({'error': f'object detection request failed: {e}'}), 502
-
-    # compute mango likelihood (highest confidence among labels containing 'mango' or 'fruit')
-    # treat a small list of common fruit names as matches (mango_likelihood preserves API)
-    # configurable comma-separated list via env/API config (falls back to sensible defaults)
-    kw_env = os.getenv('FRUIT_KEYWORDS') or current_app.config.get('FRUIT_KEYWORDS')
-    if kw_env:
-        FRUIT_KEYWORDS = {k.strip().lower() for k in kw_env.split(',') if k.strip()}
-    else:
-        FRUIT_KEYWORDS = {
-            'mango', 'fruit', 'apple', 'banana', 'orange', 'papaya', 'pear',
-            'peach', 'avocado', 'guava', 'plum', 'apricot', 'nectarine', 'tangerine'
-        }
-    mango_matches = []
-    mango_conf = 0.0
-    for d in detections:
-        name = (d.get('name') or '').lower()
-        conf = float(d.get('confidence') or 0.0)
-        for kw in FRUIT_KEYWORDS:
-            if kw in name:
-                mango_matches.append(d)
-                if conf > mango_conf:
-                    mango_conf = conf
-                break
-
-    return jsonify({
-        'detections': detections,
-        'mango_matches': mango_matches,
-        'mango_likelihood': mango_conf,
-        'blobName': blob_name,
-        'blobUrl': blob_url
-        ,
-        'prediction': { 'mango_likelihood': mango_conf }
-    }), 200
+        current_app.logger.exception("thumbnail: failed for %s: %s", name, e)
+        return jsonify({'error': 'failed to load image'}), 502
+    return Response(data, mimetype='image/jpeg', headers={
+        'ETag': thumb_etag, 'Cache-Control': f'private, max-age={THUMB_MAX_AGE}'})
 
 @api.route('/events')
 def events():
+    """
+    SSE stream of change events from the shared ChangeHub:
+    { type: 'list', refresh: true } on connect / resync, { type: 'blobs', items: [...] } for new blobs,
+    { type: 'telemetry', rows: [...] } for new telemetry rows.
+    """
+    hub = events_hub.get_hub(current_app._get_current_object())
+    sub = hub.subscribe()
+
     def event_stream():
-        current_app.logger.info("SSE client connected: events")
-        last_sig = None
-        poll_sec = 5
-        keepalive_interval = 10
-        last_keepalive = time.time()
+        current_app.logger.info("SSE client connected: events (subscribers=%d)", hub.subscriber_count())
         try:
             while True:
-                try:
-                    container_url = current_app.config.get('AZURE_CONTAINER_URL') or current_app.config.get('CONTAINER_URL')
-                    sas_token = current_app.config.get('SAS_TOKEN')
-                    items = sb.list_blobs(container_url=container_url, sas_token=sas_token)
-                    if items:
-                        top = items[0]
-                        sig = f"{top.get('etag')}-{top.get('lastModified')}-{top.get('name')}"
-                    else:
-                        sig = ''
-                except Exception:
-                    current_app.logger.exception("events: error listing blobs")
-                    sig = last_sig
-                    items = []
-
-                # emit change event if signature changed
-                if sig != last_sig:
-                    last_sig = sig
-                    payload = json.dumps({"type": "list", "refresh": True, "timestamp": int(time.time()), "count": len(items)})
-                    current_app.logger.info("events: emitting list refresh; count=%d sig=%s", len(items), sig)
-                    yield f"data: {payload}\n\n"
-                    last_keepalive = time.time()
-                else:
+                event = sub.get(timeout=events_hub.KEEPALIVE_SEC)
+                if event is None:
                     # periodic keepalive (comment) to keep proxies/clients alive
-                    if time.time() - last_keepalive >= keepalive_interval:
-                        yield ": keepalive\n\n"
-                        last_keepalive = time.time()
-
-                # small-sleep loop to detect interrupts quickly
-                slept = 0.0
-                step = 0.25
-                while slept < poll_sec:
-                    try:
-                        time.sleep(step)
-                    except GeneratorExit:
-                        current_app.logger.info("events: client disconnected (GeneratorExit)")
-                        return
-                    except BaseException as e:
-                        current_app.logger.info("events: interrupted: %s", e)
-                        return
-                    slept += step
+                    yield ": keepalive\n\n"
+                else:
+                    yield events_hub.format_sse(event)
         except GeneratorExit:
-            current_app.logger.info("events: generator closed")
-            return
-        except BaseException:
-            current_app.logger.exception("events: unexpected error in stream")
+            current_app.logger.info("events: client disconnected")
             return
+        finally:
+            hub.unsubscribe(sub)
 
     headers = {
         "Cache-Control": "no-cache",
@@ -327,7 +317,7 @@ def debug_list_blobs():
     """
     Temporary debug endpoint — returns the list_blobs result or full error.
     Call: GET /api/debug/list_blobs
-    Accepts optional query params: container (or containerUrl), sas
+    Accepts optional query params: container (or containerUrl), sas, fresh=1
     """
     try:
         # accept either 'container' or 'containerUrl' for convenience
@@ -336,9 +326,10 @@ def debug_list_blobs():
         if not hasattr(sb, 'list_blobs'):
             return jsonify({'ok': False, 'error': 'sb.list_blobs not found'}), 500
 
-        # preferred call signature: container_url, sas_token
+        # preferred call signature: container_url, sas_token (fresh=1 bypasses the listing index TTL)
         try:
-            items = sb.list_blobs(container_url=container_url, sas_token=sas_token)
+            max_age = 0 if request.args.get('fresh') in ('1', 'true') else None
+            items = sb.list_blobs(container_url=container_url, sas_token=sas_token, max_age=max_age)
         except TypeError:
             # fallback: some versions accept different params or none
             try:
@@ -386,8 +377,263 @@ def telemetry_ingest():
         return (str(e), 500)
     return ('', 204)
 
+# max records accepted by one bulk request (all records of a request share one transaction)
+BULK_MAX_RECORDS = int(os.getenv('TELEMETRY_BULK_MAX', '10000'))
+# rejected records listed individually in a bulk response; further rejects are only counted
+BULK_MAX_ERRORS = int(os.getenv('TELEMETRY_BULK_MAX_ERRORS', '100'))
+
+@api.route('/api/telemetry/bulk', methods=['POST'])
+def telemetry_ingest_bulk():
+    """
+    Ingest many telemetry records in one request: a JSON array or NDJSON (one object per line).
+    The body is parsed incrementally; valid records are committed in a single transaction.
+    Returns { accepted, rejected, errors: [{ index, error }] } where index is the record position;
+    only the first TELEMETRY_BULK_MAX_ERRORS rejects are listed.
+    """
+    accepted, errors = [], []
+    rejected = 0
+    for index, obj, err in iter_json_records(request.stream):
+        if err is None and (not isinstance(obj, dict) or not obj):
+            err = 'record must be a non-empty JSON object'
+        if err is not None:
+            rejected += 1
+            if len(errors) < BULK_MAX_ERRORS:
+                errors.append({'index': index, 'error': err})
+            continue
+        if len(accepted) >= BULK_MAX_RECORDS:
+            return jsonify({'error': f'too many records (max {BULK_MAX_RECORDS} per request)'}), 413
+        accepted.append(obj)
+    if not accepted and not rejected:
+        return jsonify({'error': 'empty'}), 400
+    try:
+        insert_many(accepted)
+    except Exception as e:
+        current_app.logger.exception("telemetry_ingest_bulk: failed insert of %d records", len(accepted))
+        return jsonify({'error': str(e), 'accepted': 0, 'rejected': len(accepted) + rejected}), 500
+    return jsonify({'accepted': len(accepted), 'rejected': rejected, 'errors': errors}), 200
+
 @api.route('/api/messages', methods=['GET'])
 def messages_list():
-    limit = int(request.args.get('limit', 100))
-    msgs = get_messages(limit=limit)
-    return jsonify(msgs)
\ No newline at end of file
+    """
+    Return stored telemetry rows (newest first) as a JSON list.
+    Optional query params: limit, device, eventType, since, until (ISO-8601 or epoch seconds, UTC),
+    cursor (from the X-Next-Cursor header of the previous page), payload=0 to omit the raw JSON payload,
+    archive=1 to continue into archived partitions once the hot rows are exhausted, since_id to return
+    only rows newer than that id (the X-Latest-Id header of an earlier response). When more than
+    `limit` rows are newer, the oldest `limit` of them are returned with X-Truncated: 1 and
+    X-Latest-Id set to the newest id returned, so polling again with it continues without a gap.
+
+    Responses carry an ETag derived from the store's in-memory watermark, so a poll with a
+    matching If-None-Match is answered 304 without reading the database.
+    """
+    # read before querying: a row committed meanwhile changes the tag and the next poll fetches it
+    latest, deletes = telemetry_store.messages_version()
+    etag = f'm{latest}.{deletes}'
+    if request.if_none_match.contains_weak(etag):
+        return _messages_response(Response(status=304), etag, latest)
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        since_id = request.args.get('since_id')
+        since_id = int(since_id) if since_id not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'limit and since_id must be integers'}), 400
+    if since_id is not None and since_id >= latest:
+        return _messages_response(jsonify([]), etag, latest)
+    include_payload = request.args.get('payload', '1').lower() not in ('0', 'false', 'no')
+    include_archive = request.args.get('archive', '0').lower() in ('1', 'true', 'yes')
+    filters = dict(
+        device=request.args.get('device'),
+        event_type=request.args.get('eventType'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        include_payload=include_payload)
+    try:
+        cursor = request.args.get('cursor')
+        if since_id is not None:
+            # one extra row tells whether the delta is complete
+            msgs, next_cursor = query_messages(limit=limit + 1, cursor=cursor, after_id=since_id, **filters)
+            if len(msgs) > limit:
+                msgs = msgs[1:]
+                resp = jsonify(msgs)
+                resp.headers['X-Truncated'] = '1'
+                resp.headers['X-Latest-Id'] = str(msgs[0]['id'])
+                # no ETag: it would match the store version and hide the rest of the delta
+                resp.headers['Cache-Control'] = 'no-cache'
+                return resp
+        else:
+            msgs, next_cursor = query_messages(limit=limit, cursor=cursor, **filters)
+        if include_archive and since_id is None and len(msgs) < limit:
+            # archived rows are all older than the hot ones: continue after the last row served
+            if msgs:
+                cursor = telemetry_store.encode_cursor(msgs[-1]['received_at'], msgs[-1]['id'])
+            older, next_cursor = retention.query_archive(limit=limit - len(msgs), cursor=cursor, **filters)
+            msgs.extend(older)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    resp = jsonify(msgs)
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    return _messages_response(resp, etag, latest)
+
+
+def _messages_response(resp, etag, latest):
+    resp.set_etag(etag, weak=True)
+    resp.headers['X-Latest-Id'] = str(latest)
+    # always revalidate; the 304 path is cheap
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+@api.route('/api/metrics', methods=['GET'])
+def metrics_series():
+    """
+    Downsampled per-device (or fleet-wide, without device) series from the telemetry rollups.
+    Query params: device, metric (repeatable: freeHeap, wifiStrength, imageSize, status),
+    since, until (ISO-8601 or epoch seconds, UTC; default last 24h), resolution (1m, 1h, 1d
+    or auto), max_points (auto resolution target, default 500).
+    """
+    try:
+        max_points = max(1, min(int(request.args.get('max_points', 500)), 5000))
+        resolution, series = query_metrics(
+            device=request.args.get('device'),
+            metrics=request.args.getlist('metric') or None,
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            resolution=request.args.get('resolution'),
+            max_points=max_points)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'device': request.args.get('device'), 'resolution': resolution, 'series': series})
+
+
+@api.route('/api/analyses', methods=['GET'])
+def analyses_list():
+    """
+    Return stored detection results (newest first), linked to the telemetry row naming each image.
+    Optional query params: blob (repeatable), min_likelihood, limit, detections=0 to omit raw detections.
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        min_likelihood = request.args.get('min_likelihood')
+        min_likelihood = float(min_likelihood) if min_likelihood not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'limit and min_likelihood must be numbers'}), 400
+    include_detections = request.args.get('detections', '1').lower() not in ('0', 'false', 'no')
+    rows = query_analyses(
+        blob_names=request.args.getlist('blob') or None,
+        min_likelihood=min_likelihood,
+        limit=limit,
+        include_detections=include_detections)
+    return jsonify(rows)
+
+
+@api.route('/api/detections', methods=['GET'])
+def detections_search():
+    """
+    Captures with a stored detection of a label, e.g. ?label=mango&min_confidence=0.7&device=X&since=...
+    Returns { items: [...] } newest capture first: per blob the best matching detection (confidence,
+    bbox), the number of matches and the deviceId / message_id / captured_at of its telemetry row.
+    Optional: until, limit.
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        min_confidence = request.args.get('min_confidence')
+        min_confidence = float(min_confidence) if min_confidence not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'limit and min_confidence must be numbers'}), 400
+    try:
+        items = query_detections(
+            label=request.args.get('label'),
+            min_confidence=min_confidence,
+            device=request.args.get('device'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': items})
+
+
+@api.route('/api/analyses/status', methods=['GET'])
+def analyses_status():
+    """Counters of the background auto-analysis pipeline (enabled with AUTO_ANALYZE=1)."""
+    analyzer = auto_analyze.get_analyzer(current_app._get_current_object())
+    if analyzer is None:
+        return jsonify({'running': False})
+    return jsonify(analyzer.status())
+
+
+@api.route('/api/ingest/start', methods=['POST'])
+def ingest_start():
+    """Start the background capture-blob ingestion worker (no-op if already running)."""
+    error = _token_error(ADMIN_TOKEN, 'ADMIN_TOKEN')
+    if error:
+        return error
+    ingestor = ingest.get_ingestor(current_app._get_current_object())
+    started = ingestor.start()
+    return jsonify(dict(ingestor.status(), started=started))
+
+
+@api.route('/api/ingest/stop', methods=['POST'])
+def ingest_stop():
+    """Stop the worker after its current batch; progress is checkpointed."""
+    error = _token_error(ADMIN_TOKEN, 'ADMIN_TOKEN')
+    if error:
+        return error
+    ingestor = ingest.get_ingestor(current_app._get_current_object())
+    stopped = ingestor.stop()
+    return jsonify(dict(ingestor.status(), stopped=stopped))
+
+
+@api.route('/api/ingest/status', methods=['GET'])
+def ingest_status():
+    return jsonify(ingest.get_ingestor(current_app._get_current_object()).status())
+
+
+@api.route('/api/retention', methods=['GET'])
+def retention_status():
+    return jsonify(retention.get_manager().status())
+
+
+@api.route('/api/retention/run', methods=['POST'])
+def retention_run():
+    """Run one retention pass now (archive + delete expired rows, then vacuum)."""
+    error = _token_error(ADMIN_TOKEN, 'ADMIN_TOKEN')
+    if error:
+        return error
+    try:
+        result = retention.get_manager().run_once()
+    except Exception as e:
+        current_app.logger.exception("retention: manual pass failed")
+        return jsonify({'error': str(e)}), 500
+    return jsonify(result)
+
+
+@api.route('/api/mqtt/start', methods=['POST'])
+def mqtt_start():
+    """Connect the MQTT telemetry subscriber (no-op if already running)."""
+    error = _token_error(ADMIN_TOKEN, 'ADMIN_TOKEN')
+    if error:
+        return error
+    subscriber = mqtt_ingest.get_ingestor(current_app._get_current_object())
+    try:
+        started = subscriber.start()
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(subscriber.status(), started=started))
+
+
+@api.route('/api/mqtt/stop', methods=['POST'])
+def mqtt_stop():
+    """Disconnect from the broker; messages already received are still committed."""
+    error = _token_error(ADMIN_TOKEN, 'ADMIN_TOKEN')
+    if error:
+        return error
+    subscriber = mqtt_ingest.get_ingestor(current_app._get_current_object())
+    stopped = subscriber.stop()
+    return jsonify(dict(subscriber.status(), stopped=stopped))
+
+
+@api.route('/api/mqtt/status', methods=['GET'])
+def mqtt_status():
+    return jsonify(mqtt_ingest.get_ingestor(current_app._get_current_object()).status())
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, Response, url_for
+from flask import Flask, render_template, request, Response, url_for, stream_with_context
 from dotenv import load_dotenv
 import os
 import io
@@ -11,7 +11,7 @@ load_dotenv()
 # import the API blueprint
 from api import routes as api_routes
 # import your blob service
-from services.blob import BlobService
+from services.blob import get_service
 
 app = Flask(__name__)
 
@@ -26,29 +26,58 @@ app.config['API_NINJAS_KEY'] = os.getenv('API_NINJAS_KEY')
 # Register API blueprint
 app.register_blueprint(api_routes.api)
 
+# Optional background detection on new captures (see services/auto_analyze.py)
+if os.getenv('AUTO_ANALYZE', '0').lower() in ('1', 'true', 'yes'):
+    from services import auto_analyze
+    auto_analyze.start(app)
+
+# Optional in-process ingestion of IoT Hub capture blobs (see services/ingest.py)
+if os.getenv('INGEST_AUTOSTART', '0').lower() in ('1', 'true', 'yes'):
+    from services import ingest
+    ingest.get_ingestor(app).start()
+
+# Optional MQTT telemetry subscriber (see services/mqtt_ingest.py); needs paho-mqtt
+if os.getenv('MQTT_HOST'):
+    from services import mqtt_ingest
+    mqtt_ingest.get_ingestor(app).start()
+
+# Raw telemetry retention / archival (see services/retention.py); off unless a TTL is set
+if float(os.getenv('TELEMETRY_RETENTION_DAYS', '0') or 0) > 0:
+    from services import retention
+    retention.get_manager().start()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# browsers may reuse a proxied image this long before revalidating with If-None-Match
+BLOB_PROXY_MAX_AGE = int(os.getenv('BLOB_PROXY_MAX_AGE', '3600'))
+
 @app.route('/api/fetch_blob_content')
 def fetch_blob_content():
     # query param: ?name=<blob-name>
+    # streams the blob in fixed-size chunks; honors Range and If-None-Match
     name = request.args.get('name')
     if not name:
         return {"error": "name required"}, 400
 
     try:
-        svc = BlobService()
-        content = svc.fetch_blob_content(name)  # returns bytes
-        if content is None:
+        stream = get_service().open_blob(name, range_header=request.headers.get('Range'),
+                                         if_none_match=request.headers.get('If-None-Match'))
+        if stream is None:
             return {"error": "not found"}, 404
 
-        # guess content type by extension as a fallback
-        ctype, _ = mimetypes.guess_type(name)
-        if not ctype:
-            ctype = 'application/octet-stream'
-
-        return Response(content, mimetype=ctype)
+        headers = dict(stream.headers)
+        # guess content type by extension when storage only knows it as bytes
+        ctype = headers.pop('Content-Type', None)
+        if not ctype or ctype == 'application/octet-stream':
+            ctype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        headers['Accept-Ranges'] = 'bytes'
+        headers['Cache-Control'] = f'private, max-age={BLOB_PROXY_MAX_AGE}'
+        if stream.status in (304, 416):
+            return Response(status=stream.status, headers=headers)
+        return Response(stream_with_context(stream), status=stream.status, headers=headers,
+                        mimetype=ctype, direct_passthrough=True)
     except Exception as ex:
         logging.exception("fetch_blob_content failed for %s", name)
         return {"error": "internal server error"}, 500
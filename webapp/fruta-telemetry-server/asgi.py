@@ -0,0 +1,312 @@
+"""
+ASGI entry point (async serving mode):
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+/events and POST /api/analyze run as coroutines on the event loop: SSE clients wait on
+the shared ChangeHub without holding a thread, and analyze downloads the image and calls
+the detector over a pooled async HTTP client. Every other route is served by the Flask
+app (same blueprint, same contract) through asgiref's WSGI adapter.
+
+Requires the packages in requirements-asgi.txt.
+"""
+import os
+import json
+import asyncio
+import logging
+import mimetypes
+from urllib.parse import parse_qsl
+
+try:
+    import httpx
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError as e:  # pragma: no cover - optional dependencies
+    raise ImportError("ASGI mode needs httpx and asgiref: pip install -r requirements-asgi.txt") from e
+
+from app import app as flask_app
+from services import analyze_batch
+from services import blob as sb
+from services import detection
+from services import detection_post
+from services import detection_cache
+from services import detector_backends
+from services import events as events_hub
+from services import http_client
+from services import image_cache
+from services import telemetry_store
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('ASYNC_HTTP_MAX_KEEPALIVE', '20'))
+MAX_ANALYZE_BODY = 64 * 1024
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    # if behind nginx, this disables its response buffering for SSE
+    (b'x-accel-buffering', b'no'),
+]
+
+
+class AsyncApp:
+    """Routes the async-native endpoints; delegates the rest to the WSGI app."""
+
+    def __init__(self, wsgi_app):
+        self.flask_app = wsgi_app
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.http = None
+        # detection cache key -> future of the in-flight upstream call (single-flight)
+        self._inflight = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            path, method = scope.get('path'), scope.get('method')
+            if path == '/events' and method == 'GET':
+                return await self.events(scope, receive, send)
+            if path == '/api/analyze' and method == 'POST':
+                return await self.analyze(scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def client(self):
+        """Process-wide pooled async HTTP client (created lazily if lifespan is not used)."""
+        if self.http is None:
+            limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE)
+            self.http = httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0, connect=10.0))
+        return self.http
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.client()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.http is not None:
+                    await self.http.aclose()
+                    self.http = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # -- /events -----------------------------------------------------------
+
+    async def events(self, scope, receive, send):
+        hub = events_hub.get_hub(self.flask_app)
+        sub = hub.subscribe(sub=events_hub.AsyncSubscription(asyncio.get_running_loop()))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            while True:
+                getter = asyncio.ensure_future(sub.get(timeout=events_hub.KEEPALIVE_SEC))
+                await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    getter.cancel()
+                    return
+                event = getter.result()
+                # periodic keepalive (comment) to keep proxies/clients alive
+                chunk = ': keepalive\n\n' if event is None else events_hub.format_sse(event)
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        finally:
+            hub.unsubscribe(sub)
+            disconnected.cancel()
+
+    # -- /api/analyze ------------------------------------------------------
+
+    async def analyze(self, scope, receive, send):
+        """Async twin of api.routes.analyze with the same request/response contract."""
+        try:
+            body = await _read_body(receive, MAX_ANALYZE_BODY)
+        except ValueError as e:
+            return await _send_json(send, 413, {'error': str(e)})
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        status, result = await self.analyze_payload(payload, _query_args(scope))
+        await _send_json(send, status, result)
+
+    async def analyze_payload(self, payload, args):
+        config = self.flask_app.config
+        blob_name = payload.get('blobName') or payload.get('name')
+        blob_url = payload.get('blobUrl')
+        container_url = payload.get('containerUrl') or args.get('containerUrl')
+        sas_token = payload.get('sas') or args.get('sas') or config.get('SAS_TOKEN')
+
+        if not blob_url and not blob_name:
+            return 400, {'error': 'blobName or blobUrl is required'}
+
+        # resolve blob_name -> blob_url (no storage round-trip needed for the URL itself)
+        if blob_name and not blob_url:
+            try:
+                blob_url = sb.get_service(container_url=container_url, sas_token=sas_token).blob_url(blob_name)
+            except Exception:
+                logger.exception("analyze: failed to resolve blob url for %s", blob_name)
+        if not blob_url:
+            return 200, detection.empty_result(blob_name, None)
+
+        try:
+            detections, etag = await self.cached_detect(blob_name, blob_url)
+        except detection.DetectionError as e:
+            return e.status, e.body
+        result = detection.build_result(blob_name, blob_url, detections, detection_post.get_matcher(config))
+        # same persistence as the WSGI route; the store's read and queue put stay off the loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, analyze_batch.persist_analysis, blob_name or telemetry_store.blob_name_from_url(blob_url),
+            etag, result['mango_likelihood'], detections)
+        return 200, result
+
+    async def cached_detect(self, blob_name, blob_url):
+        """
+        (detections, ETag) for blob_url via the shared DetectionCache (blob name + ETag key,
+        or content hash when the ETag is unknown). Concurrent requests for one key await a
+        single call. Cache lookups (SQLite) and writes run on the default executor.
+        """
+        loop = asyncio.get_running_loop()
+        cache = detection_cache.get_cache()
+        backend = detector_backends.get_backend()
+        etag = None
+        if blob_name:
+            try:
+                head = await self.client().head(blob_url, timeout=10)
+                if head.status_code == 200:
+                    etag = head.headers.get('ETag')
+            except Exception:
+                logger.debug("analyze: HEAD failed for %s", blob_url, exc_info=True)
+        img = None
+        if etag:
+            key = backend.cache_key(detection_cache.key_for_blob(blob_name, etag))
+        else:
+            img = await self.fetch_image(blob_url, blob_name)
+            key = backend.cache_key(detection_cache.key_for_content(img[0]))
+            etag = img[2]
+        fut = self._inflight.get(key)
+        if fut is None:
+            cached = await loop.run_in_executor(None, cache.get, key)
+            if cached is not None:
+                return cached, etag
+            # another request may have started the call while the lookup ran
+            fut = self._inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut), etag
+        fut = self._inflight[key] = loop.create_future()
+        try:
+            if img is None:
+                img = await self.fetch_image_cached(blob_url, blob_name, etag)
+            detections = await self.call_detector(img[0], img[1])
+            await loop.run_in_executor(None, cache.put, key, detections)
+            fut.set_result(detections)
+            return detections, etag
+        except BaseException as e:
+            fut.set_exception(e)
+            # mark retrieved so an exception nobody else awaited is not logged as lost
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def fetch_image_cached(self, blob_url, blob_name, etag):
+        """fetch_image through the shared on-disk image cache (blob name + ETag key); disk I/O runs off the loop."""
+        loop = asyncio.get_running_loop()
+        cache = image_cache.get_cache()
+        key = image_cache.key_for_image(blob_name, etag)
+        data = await loop.run_in_executor(None, cache.get, key)
+        if data is not None:
+            return data, mimetypes.guess_type(blob_name)[0] or 'image/jpeg', etag
+        img = await self.fetch_image(blob_url, blob_name)
+        await loop.run_in_executor(None, cache.put, key, img[0])
+        return img
+
+    async def fetch_image(self, blob_url, blob_name=None):
+        try:
+            resp = await self.client().get(blob_url, timeout=20)
+            resp.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.warning("analyze: HTTP error fetching image %s: %s", blob_url, e)
+            raise detection.DetectionError(200, detection.empty_result(blob_name, blob_url, f'failed to fetch image: {e}'))
+        except Exception:
+            logger.exception("analyze: failed to fetch image %s", blob_url)
+            raise detection.DetectionError(200, detection.empty_result(blob_name, blob_url, 'failed to fetch image'))
+        return resp.content, resp.headers.get('Content-Type') or 'image/jpeg', resp.headers.get('ETag')
+
+    async def call_detector(self, img_bytes, content_type):
+        backend = detector_backends.get_backend()
+        if not isinstance(backend, detector_backends.ApiNinjasBackend):
+            # local model: inference runs (batched) on the backend's thread
+            return await asyncio.get_running_loop().run_in_executor(
+                None, backend.detect, img_bytes, content_type, self.flask_app.config)
+        api_key = detection.api_key(self.flask_app.config)
+        if not api_key:
+            raise detection.DetectionError(500, {'error': 'API_NINJAS_KEY not configured on server'})
+        files = {'image': ('image', img_bytes, content_type)}
+        headers = {'X-Api-Key': api_key}
+        r = None
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                r = await self.client().post(detection.API_NINJAS_URL, headers=headers, files=files,
+                                             timeout=http_client.timeout('detect')[1])
+                logger.info("analyze: called API Ninjas (attempt=%d status=%s)", attempt, r.status_code)
+                if r.status_code == 429:
+                    retry_after = r.headers.get('Retry-After')
+                    # same backoff policy as the sync client (services/http_client.py)
+                    delay = http_client.backoff_delay(attempt, retry_after)
+                    if attempt <= http_client.MAX_RETRIES and delay <= http_client.BACKOFF_MAX:
+                        # yields the loop instead of sleeping a worker thread
+                        await asyncio.sleep(delay)
+                        continue
+                    raise detection.DetectionError(502, {'error': 'object detection rate limited', 'status': 429, 'retry_after': retry_after})
+                r.raise_for_status()
+                raw = r.json() if r.text else []
+                break
+        except detection.DetectionError:
+            raise
+        except httpx.HTTPStatusError as e:
+            raise detection.DetectionError(502, {'error': 'object detection API error', 'details': str(e), 'response': r.text if r is not None else None})
+        except Exception as e:
+            logger.exception("analyze: object detection request failed")
+            raise detection.DetectionError(502, {'error': f'object detection request failed: {e}'})
+        return detection.normalize_detections(raw)
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _read_body(receive, limit):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise ValueError('request body too large')
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _query_args(scope):
+    return dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+
+
+async def _send_json(send, status, obj):
+    body = json.dumps(obj).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = AsyncApp(flask_app)
@@ -1,21 +1,91 @@
 import os
 import sys
 import json
-import base64
 import argparse
-from datetime import timezone
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from azure.storage.blob import BlobServiceClient, ContainerClient
 import requests
 
+# shared decoders live in the server package (services/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.capture_decode import ChunkStream, iter_decoded
+
 TELEMETRY_INGEST_URL = os.environ.get('TELEMETRY_INGEST_URL', 'http://localhost:5000/api/telemetry')
+TELEMETRY_BULK_URL = os.environ.get('TELEMETRY_BULK_URL', TELEMETRY_INGEST_URL.rstrip('/') + '/bulk')
+TELEMETRY_BATCH_SIZE = int(os.environ.get('TELEMETRY_BATCH_SIZE', '500'))
+
+class IngestError(Exception):
+    """Records could not be delivered to the server; the blob they came from is not done."""
 
 def post_to_server(payload):
+    """POST one record; returns False (after a warning) if the server did not accept it."""
     try:
         r = requests.post(TELEMETRY_INGEST_URL, json=payload, timeout=5)
         if r.status_code >= 400:
             print("Warning: server ingestion returned", r.status_code, r.text)
+            return False
     except Exception as e:
         print("Warning: failed to POST to server:", e)
+        return False
+    return True
+
+class TelemetryBatcher:
+    """
+    Collects decoded payloads and sends them as NDJSON to the bulk ingestion endpoint.
+    Falls back to one POST per record if the server has no bulk endpoint (404).
+    A batch the server did not take raises IngestError from add()/flush().
+    """
+
+    def __init__(self, bulk_url=TELEMETRY_BULK_URL, batch_size=TELEMETRY_BATCH_SIZE):
+        self.bulk_url = bulk_url
+        self.batch_size = max(1, batch_size)
+        self.pending = []
+        self.session = requests.Session()
+        self.bulk_supported = True
+
+    def add(self, payload):
+        self.pending.append(payload)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def discard(self):
+        """Drop records not sent yet (their blob failed and will be re-read)."""
+        self.pending = []
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        if not self.bulk_supported:
+            self._post_each(batch)
+            return
+        body = ''.join(json.dumps(p) + '\n' for p in batch).encode('utf-8')
+        try:
+            r = self.session.post(self.bulk_url, data=body, headers={'Content-Type': 'application/x-ndjson'}, timeout=30)
+        except Exception as e:
+            raise IngestError(f"failed to POST batch to server: {e}")
+        if r.status_code == 404:
+            print("Warning: bulk endpoint not available, falling back to per-record POSTs")
+            self.bulk_supported = False
+            self._post_each(batch)
+            return
+        if r.status_code >= 400:
+            raise IngestError(f"bulk ingestion returned {r.status_code}: {r.text}")
+        try:
+            summary = r.json()
+        except Exception:
+            summary = {}
+        if summary.get('rejected'):
+            # malformed records are rejected for good; resending the blob would not help
+            print("Warning: server rejected", summary.get('rejected'), "of", len(batch), "records:", summary.get('errors'))
+
+    def _post_each(self, batch):
+        failed = sum(not post_to_server(payload) for payload in batch)
+        if failed:
+            raise IngestError(f"{failed} of {len(batch)} records were not accepted by the server")
 
 def get_container_client(args):
     # Priority: --container-sas-url, AZURE_STORAGE_CONNECTION_STRING, --account + --key
@@ -31,63 +101,185 @@ def get_container_client(args):
         return svc.get_container_client(args.container)
     raise RuntimeError("No auth provided. Use --container-sas-url or set AZURE_STORAGE_CONNECTION_STRING or provide --account/--key")
 
-def parse_json_lines(text):
-    objs = []
-    text = text.strip()
-    if not text:
-        return objs
-    # Try whole-text JSON first
+def describe_records(decoded_records, label='Record'):
+    """
+    Turn (index, envelope, decoded, error) records into report events, lazily: yields
+    ('line', text) to print and ('payload', obj) to ingest, one record at a time.
+    """
+    for i, obj, decoded, error in decoded_records:
+        yield 'line', f"\n--- {label} {i+1} ---"
+        if error:
+            yield 'line', "Parse error: " + error
+            continue
+        if isinstance(obj, dict):
+            keys = ", ".join(sorted(obj.keys()))
+            yield 'line', "Top-level keys: " + keys
+        if decoded is None:
+            yield 'line', "No 'Body' field to decode; printing object:"
+            yield 'line', json.dumps(obj, indent=2, default=str)
+            continue
+        if 'error' in decoded:
+            yield 'line', "Decode error: " + decoded['error']
+            continue
+        if 'payload' in decoded:
+            yield 'line', "Decoded payload (parsed JSON):"
+            yield 'line', json.dumps(decoded['payload'], indent=2)
+            if isinstance(decoded['payload'], dict):
+                yield 'payload', decoded['payload']
+        else:
+            yield 'line', "Decoded text:"
+            yield 'line', str(decoded.get('text'))
+
+def open_blob_records(container_client, name):
+    """Stream a blob's envelopes, decoding Bodies as they are consumed (JSON or Avro capture)."""
+    return iter_decoded(ChunkStream(container_client.download_blob(name).chunks()))
+
+def process_blob(container_client, name):
+    """
+    Download and decode one blob (runs on a worker thread). Report events are spooled to a
+    temp file (kept in memory while small) so large captures do not pile up in RAM while
+    they wait for their turn to be committed. Returns the rewound spool file.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+')
     try:
-        parsed = json.loads(text)
-        # If it's a list, return elements; else single object
-        if isinstance(parsed, list):
-            return parsed
-        return [parsed]
+        for event in describe_records(open_blob_records(container_client, name), label=f"Blob {name} Record"):
+            spool.write(json.dumps(event) + '\n')
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+def replay(spool):
+    with spool:
+        for line in spool:
+            yield json.loads(line)
+
+def blob_key(b):
+    """Checkpoint order: (last_modified as UTC ISO, name)."""
+    lm = b.last_modified
+    return (lm.astimezone(timezone.utc).isoformat() if lm else '', b.name)
+
+def read_state(path):
+    """
+    State: 'last_processed'/'last_name' is the watermark every blob at or before it is done;
+    'done' maps name -> last_processed for blobs finished out of order past the watermark.
+    """
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
     except Exception:
-        # fallback: parse line-delimited JSON
-        for line in text.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                objs.append(json.loads(line))
-            except Exception:
-                # ignore unparsable lines
-                pass
-    return objs
-
-def decode_body_field(obj):
-    if not isinstance(obj, dict):
-        return None
-    # IoT Hub envelope often uses "Body" with base64
-    if 'Body' in obj:
+        state = {}
+    last_ts = state.get('last_processed') or ''
+    # state files written before 'last_name' existed covered every blob up to that timestamp
+    last_name = state.get('last_name', '\uffff' if last_ts else '')
+    return (last_ts, last_name), dict(state.get('done') or {})
+
+def write_state(path, watermark, done):
+    try:
+        # ensure parent directory exists (atomic write)
+        parent = os.path.dirname(path) or '.'
+        os.makedirs(parent, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'last_processed': watermark[0], 'last_name': watermark[1], 'done': done}, f)
+        os.replace(tmp, path)
+    except Exception as e:
+        print("Warning: failed to write state:", e, file=sys.stderr)
+
+def listing_prefixes(prefixes, date_path, since_iso, now=None):
+    """
+    Name prefixes to list. With a strftime date_path (e.g. '%Y/%m/%d/' for IoT Hub capture
+    paths) only the days from the checkpoint to today are listed instead of the whole container.
+    """
+    prefixes = prefixes or ['']
+    if not date_path:
+        return prefixes
+    now = now or datetime.now(timezone.utc)
+    if not since_iso:
+        return prefixes
+    # a capture file's path date can precede its last_modified by up to a window: start a day early
+    day = datetime.fromisoformat(since_iso).astimezone(timezone.utc).date() - timedelta(days=1)
+    out = []
+    while day <= now.date():
+        out.extend(p + day.strftime(date_path) for p in prefixes)
+        day += timedelta(days=1)
+    return out
+
+def process_new_blobs(container_client, batcher, state_file, workers=4, prefixes=None, date_path=None, verbose=False):
+    """
+    Process blobs past the checkpoint, oldest first. Downloads/decodes run on a bounded pool;
+    results are ingested and checkpointed in listing order, and the watermark never moves past
+    a failed blob, so it is retried on the next poll.
+    """
+    watermark, done = read_state(state_file)
+    blobs = []
+    for prefix in listing_prefixes(prefixes, date_path, watermark[0]):
+        blobs.extend(container_client.list_blobs(name_starts_with=prefix or None))
+    candidates = sorted((b for b in blobs if blob_key(b) > watermark), key=blob_key)
+    position = {b.name: i for i, b in enumerate(candidates)}
+    to_process = [b for b in candidates if b.name not in done]
+    if not to_process:
+        if verbose: print("No new blobs to process.")
+        return 0
+    if verbose: print(f"{len(to_process)} new blobs; processing with {workers} workers")
+
+    failed = 0
+
+    def commit(b, future):
+        """Print, ingest and checkpoint one finished blob (called in listing order)."""
+        nonlocal failed, watermark
+        if verbose: print("Processing blob:", b.name)
         try:
-            raw = base64.b64decode(obj['Body'])
+            spool = future.result()
         except Exception as e:
-            return {"error": f"base64 decode failed: {e}"}
-        # try utf-8 decode and JSON parse
-        try:
-            text = raw.decode('utf-8')
-        except Exception:
-            text = raw.decode('latin1', errors='replace')
-        try:
-            payload = json.loads(text)
-            return {"text": text, "payload": payload}
-        except Exception:
-            return {"text": text}
-    # sometimes envelope has lowercase body
-    if 'body' in obj:
+            failed += 1
+            print(f"Failed to process blob {b.name}:", e, file=sys.stderr)
+            return
+        events = replay(spool)
         try:
-            raw = base64.b64decode(obj['body'])
-            text = raw.decode('utf-8')
-            try:
-                payload = json.loads(text)
-                return {"text": text, "payload": payload}
-            except Exception:
-                return {"text": text}
-        except Exception as e:
-            return {"error": f"base64 decode failed: {e}"}
-    return None
+            for kind, value in events:
+                if kind == 'line':
+                    print(value)
+                else:
+                    batcher.add(value)
+            # send this blob's records before checkpointing it
+            batcher.flush()
+        except IngestError as e:
+            # not (fully) delivered: keep the blob out of the checkpoint so it is re-sent
+            batcher.discard()
+            failed += 1
+            print(f"Failed to ingest blob {b.name}:", e, file=sys.stderr)
+            return
+        finally:
+            events.close()
+        key = blob_key(b)
+        if failed:
+            # an earlier blob failed: keep the watermark before it, remember this one by name
+            done[b.name] = key[0]
+        else:
+            watermark = key
+            # roll forward over blobs already finished out of order on an earlier poll
+            for nxt in candidates[position[b.name] + 1:]:
+                if nxt.name not in done:
+                    break
+                watermark = blob_key(nxt)
+            for name, ts in list(done.items()):
+                if (ts, name) <= watermark:
+                    del done[name]
+        write_state(state_file, watermark, done)
+
+    # at most `window` blobs are decoded but not yet committed, bounding memory
+    window = max(1, workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = []
+        for b in to_process:
+            pending.append((b, pool.submit(process_blob, container_client, b.name)))
+            if len(pending) >= window:
+                commit(*pending.pop(0))
+        for b, future in pending:
+            commit(b, future)
+    return len(to_process) - failed
 
 def main():
     p = argparse.ArgumentParser(description="Fetch newest blob from container and decode IoT Hub base64 Body field.")
@@ -100,6 +292,9 @@ def main():
     p.add_argument('--watch', action='store_true', help='Poll container for new blobs and process them continuously')
     p.add_argument('--interval', type=int, default=20, help='Poll interval in seconds when --watch is used (default 20)')
     p.add_argument('--state-file', default='.fetch_state.json', help='Path to state file that stores last-processed timestamp')
+    p.add_argument('--workers', type=int, default=4, help='Parallel blob download/decode workers in --watch mode (default 4)')
+    p.add_argument('--prefix', action='append', help='Only list blobs under this name prefix (repeatable, e.g. one per IoT Hub partition)')
+    p.add_argument('--date-path', help="strftime path appended to each prefix (e.g. '%%Y/%%m/%%d/' for IoT Hub capture) so watch mode only lists days since the checkpoint")
     args = p.parse_args()
 
     try:
@@ -108,107 +303,27 @@ def main():
         print("Auth error:", e, file=sys.stderr)
         sys.exit(2)
 
-    def read_state(path):
-        try:
-            with open(path, 'r') as f:
-                return json.load(f).get('last_processed')
-        except Exception:
-            return None
-
-    def write_state(path, iso_ts):
-        try:
-            # ensure parent directory exists (atomic write)
-            parent = os.path.dirname(path) or '.'
-            os.makedirs(parent, exist_ok=True)
-            tmp = path + '.tmp'
-            with open(tmp, 'w') as f:
-                json.dump({'last_processed': iso_ts}, f)
-            os.replace(tmp, path)
-        except Exception as e:
-            print("Warning: failed to write state:", e, file=sys.stderr)
-
-    def process_new_blobs():
-        blobs = list(container_client.list_blobs())
-        if not blobs:
-            if args.verbose: print("No blobs found.")
-            return
-        # sort by last_modified ascending
-        blobs.sort(key=lambda b: b.last_modified or b.creation_time)
-        last_ts = read_state(args.state_file)
-        to_process = []
-        for b in blobs:
-            lm = b.last_modified
-            if not lm:
-                to_process.append(b)
-                continue
-            iso = lm.astimezone(timezone.utc).isoformat()
-            if not last_ts or iso > last_ts:
-                to_process.append(b)
-        if not to_process:
-            if args.verbose: print("No new blobs to process.")
-            return
-        for b in to_process:
-            if args.verbose: print("Processing blob:", b.name)
-            try:
-                downloader = container_client.download_blob(b.name)
-                raw_bytes = downloader.readall()
-            except Exception as e:
-                print("Failed to download blob:", e, file=sys.stderr)
-                continue
-            try:
-                text = raw_bytes.decode('utf-8')
-            except Exception:
-                text = raw_bytes.decode('latin1', errors='replace')
-            objs = parse_json_lines(text)
-            for i, obj in enumerate(objs):
-                print(f"\n--- Blob {b.name} Record {i+1} ---")
-                if isinstance(obj, dict):
-                    keys = ", ".join(sorted(obj.keys()))
-                    print("Top-level keys:", keys)
-                decoded = decode_body_field(obj)
-                if decoded is None:
-                    print("No 'Body' field to decode; printing object:")
-                    print(json.dumps(obj, indent=2))
-                    continue
-                if 'error' in decoded:
-                    print("Decode error:", decoded['error'])
-                    continue
-                if 'payload' in decoded:
-                    print("Decoded payload (parsed JSON):")
-                    print(json.dumps(decoded['payload'], indent=2))
-                    # forward parsed payload to server ingestion endpoint
-                    post_to_server(decoded['payload'])
-                else:
-                    print("Decoded text:")
-                    print(decoded.get('text'))
-                    # try forwarding text-as-json if possible
-                    try:
-                        candidate = json.loads(decoded.get('text') or "{}")
-                        post_to_server(candidate)
-                    except Exception:
-                        pass
-            # update state to this blob's last_modified (UTC ISO)
-            lm = b.last_modified
-            if lm:
-                write_state(args.state_file, lm.astimezone(timezone.utc).isoformat())
+    batcher = TelemetryBatcher()
 
     if args.watch:
-        print("Starting watch mode. Poll interval:", args.interval, "sec; state file:", args.state_file)
+        print("Starting watch mode. Poll interval:", args.interval, "sec; workers:", args.workers, "; state file:", args.state_file)
         try:
             while True:
                 try:
-                    process_new_blobs()
+                    process_new_blobs(container_client, batcher, args.state_file, workers=args.workers,
+                                      prefixes=args.prefix, date_path=args.date_path, verbose=args.verbose)
                 except Exception as e:
                     print("Processing loop error:", e, file=sys.stderr)
-                time_to_sleep = args.interval
-                import time as _t; _t.sleep(time_to_sleep)
+                time.sleep(args.interval)
         except KeyboardInterrupt:
             print("Watch stopped by user.")
         return
 
-    # existing single-run behavior (unchanged)
+    # existing single-run behavior
     # list blobs and pick newest by last_modified
-    blobs = list(container_client.list_blobs())
+    blobs = []
+    for prefix in args.prefix or ['']:
+        blobs.extend(container_client.list_blobs(name_starts_with=prefix or None))
     if not blobs:
         print("No blobs found in container.")
         return
@@ -218,49 +333,32 @@ def main():
     lm = newest.last_modified
     print(f"Newest blob: {name}  last_modified: {lm.astimezone(timezone.utc).isoformat() if lm else 'unknown'}")
 
-    # download blob
+    # stream and decode the blob record by record (JSON, JSON lines or Avro capture)
     try:
-        downloader = container_client.download_blob(name)
-        raw_bytes = downloader.readall()
+        records = open_blob_records(container_client, name)
     except Exception as e:
         print("Failed to download blob:", e, file=sys.stderr)
         sys.exit(3)
 
-    # try to interpret as text
-    try:
-        text = raw_bytes.decode('utf-8')
-    except Exception:
-        text = raw_bytes.decode('latin1', errors='replace')
-
-    # parse potentially multiple JSON objects
-    objs = parse_json_lines(text)
-    if not objs:
-        print("Blob content is not valid JSON or JSON-lines. Raw content printed below:\n")
-        print(text)
-        return
-
-    for i, obj in enumerate(objs):
-        print(f"\n--- Record {i+1} ---")
-        # show top-level metadata keys if present
-        if isinstance(obj, dict):
-            keys = ", ".join(sorted(obj.keys()))
-            print("Top-level keys:", keys)
-        decoded = decode_body_field(obj)
-        if decoded is None:
-            print("No 'Body' field to decode; printing object:")
-            print(json.dumps(obj, indent=2))
-            continue
-        if 'error' in decoded:
-            print("Decode error:", decoded['error'])
-            continue
-        if 'payload' in decoded:
-            print("Decoded payload (parsed JSON):")
-            print(json.dumps(decoded['payload'], indent=2))
-            # forward parsed payload to server ingestion endpoint
-            post_to_server(decoded['payload'])
+    count = 0
+    for kind, value in describe_records(records):
+        if kind == 'line':
+            print(value)
+            count += 1
         else:
-            print("Decoded text:")
-            print(decoded.get('text'))
+            # queue parsed payload for bulk ingestion
+            try:
+                batcher.add(value)
+            except IngestError as e:
+                print("Failed to ingest records:", e, file=sys.stderr)
+                sys.exit(4)
+    if not count:
+        print("Blob is empty.")
+    try:
+        batcher.flush()
+    except IngestError as e:
+        print("Failed to ingest records:", e, file=sys.stderr)
+        sys.exit(4)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
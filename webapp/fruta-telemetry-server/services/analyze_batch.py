@@ -0,0 +1,179 @@
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from services import blob as sb
+from services import detection
+from services import detection_post
+from services import detection_cache
+from services import detector_backends
+from services import image_cache
+from services import telemetry_store
+from services.auto_analyze import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# images resolved / downloaded at once per batch request
+WORKERS = int(os.getenv("ANALYZE_BATCH_WORKERS", "8"))
+# detector calls in flight across all batch requests, and their pacing (0 = unpaced)
+DETECT_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_DETECT_CONCURRENCY", "4"))
+RATE_PER_MIN = float(os.getenv("ANALYZE_BATCH_RATE_PER_MIN", "60"))
+MAX_ATTEMPTS = int(os.getenv("ANALYZE_BATCH_MAX_ATTEMPTS", "3"))
+MAX_ITEMS = int(os.getenv("ANALYZE_BATCH_MAX", "500"))
+
+
+class DetectorGate:
+    """
+    Bounded concurrency plus shared pacing for detector calls. A 429 pauses every caller
+    for Retry-After and the call is retried, up to max_attempts.
+    """
+
+    def __init__(self, concurrency=None, rate_per_min=None, max_attempts=None):
+        self._slots = threading.BoundedSemaphore(max(1, concurrency or DETECT_CONCURRENCY))
+        self.limiter = RateLimiter(RATE_PER_MIN if rate_per_min is None else rate_per_min)
+        self.max_attempts = max_attempts or MAX_ATTEMPTS
+
+    def call(self, fn, *args):
+        attempt = 1
+        while True:
+            with self._slots:
+                self.limiter.acquire()
+                try:
+                    return fn(*args)
+                except detection.DetectionError as e:
+                    if not _rate_limited(e) or attempt >= self.max_attempts:
+                        raise
+                    self.limiter.pause(detection.retry_delay(e.body.get('retry_after'), default=30))
+            attempt += 1
+
+
+def _rate_limited(error):
+    return isinstance(error.body, dict) and error.body.get('status') == 429
+
+
+def analyze_one(blob_name=None, blob_url=None, etag=None, container_url=None, sas_token=None,
+                config=None, gate=None):
+    """
+    Detection result for one image (the /api/analyze response body) and the blob ETag it
+    was computed for. Results come from the detection cache when the blob version is
+    known; otherwise the image is downloaded (through the image cache) and sent to the
+    detector, via `gate` when given. The result is stored in the analyses and detections
+    tables unless that blob version's row already holds it (see persist_analysis).
+    Raises DetectionError like detection.call_detector.
+    """
+    if blob_name and not blob_url:
+        try:
+            info = sb.fetch_blob_data(container_url=container_url, blob_name=blob_name, sas_token=sas_token)
+            blob_url = info.get('blob_url') if info else None
+            etag = etag or (info.get('etag') if info else None)
+        except Exception as e:
+            logger.exception("analyze: failed to resolve blob url for %s: %s", blob_name, e)
+    if not blob_url:
+        logger.info("analyze: no blob URL available for %s, returning empty detection", blob_name)
+        return detection.empty_result(blob_name, None), None
+
+    backend = detector_backends.get_backend()
+    if gate is None or not backend.rate_limited:
+        detect = lambda img, content_type: backend.detect(img, content_type, config)
+    else:
+        detect = lambda img, content_type: gate.call(backend.detect, img, content_type, config)
+    cache = detection_cache.get_cache()
+    if etag:
+        # known blob version: a cache hit needs neither the download nor the upstream call
+        def compute():
+            img_bytes, content_type, _ = image_cache.fetch_image(blob_url, blob_name, etag)
+            return detect(img_bytes, content_type)
+        detections = cache.get_or_compute(backend.cache_key(detection_cache.key_for_blob(blob_name, etag)), compute)
+    else:
+        # unknown version (e.g. blobUrl given): key by content hash to skip the upstream call
+        img_bytes, content_type, etag = detection.fetch_image(blob_url, blob_name)
+        detections = cache.get_or_compute(backend.cache_key(detection_cache.key_for_content(img_bytes)),
+                                          lambda: detect(img_bytes, content_type))
+    result = detection.build_result(blob_name, blob_url, detections, detection_post.get_matcher(config))
+    persist_analysis(blob_name or telemetry_store.blob_name_from_url(blob_url), etag,
+                     result['mango_likelihood'], detections)
+    return result, etag
+
+
+def persist_analysis(blob_name, etag, mango_likelihood, detections):
+    """
+    Store a detection result for (blob_name, etag) when the row is missing or holds a
+    different result (e.g. a cache hit computed by another process or an earlier backend).
+    Best effort: a storage failure is logged, not raised. Returns True when queued.
+    """
+    if not blob_name:
+        return False
+    try:
+        if telemetry_store.analysis_current(blob_name, etag, mango_likelihood, detections):
+            return False
+        telemetry_store.record_analysis(blob_name, etag, mango_likelihood, detections)
+        return True
+    except Exception:
+        logger.exception("analyze: failed to store the analysis of %s", blob_name)
+        return False
+
+
+def parse_items(items):
+    """Normalize request items (blob names, URLs or {blobName|name, blobUrl, etag} objects)."""
+    if not isinstance(items, list):
+        raise ValueError('items must be a list')
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f'at most {MAX_ITEMS} items per batch')
+    parsed = []
+    for index, item in enumerate(items):
+        if isinstance(item, str) and item.startswith(('http://', 'https://')):
+            parsed.append({'blobUrl': item})
+        elif isinstance(item, str) and item:
+            parsed.append({'blobName': item})
+        elif isinstance(item, dict) and (item.get('blobName') or item.get('name') or item.get('blobUrl')):
+            parsed.append({'blobName': item.get('blobName') or item.get('name'),
+                           'blobUrl': item.get('blobUrl'), 'etag': item.get('etag')})
+        else:
+            raise ValueError(f'item {index}: expected a blob name, URL or object with blobName/blobUrl')
+    return parsed
+
+
+def _analyze_item(index, item, container_url, sas_token, config, gate):
+    blob_name = item.get('blobName')
+    try:
+        result, _ = analyze_one(blob_name, item.get('blobUrl'), item.get('etag'),
+                                   container_url, sas_token, config, gate)
+    except detection.DetectionError as e:
+        body = e.body if isinstance(e.body, dict) else {'error': str(e.body)}
+        return dict(body, index=index, blobName=blob_name, status=e.status)
+    except Exception as e:
+        logger.exception("analyze batch: failed on %s", blob_name or item.get('blobUrl'))
+        return {'index': index, 'blobName': blob_name, 'status': 500, 'error': str(e)}
+    return dict(result, index=index, status=200)
+
+
+def iter_batch(items, container_url=None, sas_token=None, config=None, workers=None, gate=None):
+    """
+    Analyze parsed items concurrently and yield one result per item, in completion order;
+    each carries its request `index` and an HTTP-like `status`. Closing the generator (e.g.
+    the client went away) cancels items not yet started.
+    """
+    gate = gate or get_gate()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers or WORKERS, len(items) or 1)),
+                                  thread_name_prefix="analyze-batch")
+    try:
+        futures = [executor.submit(_analyze_item, i, item, container_url, sas_token, config, gate)
+                   for i, item in enumerate(items)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def get_gate() -> DetectorGate:
+    """Process-wide gate: concurrent batch requests share one upstream quota."""
+    global _gate
+    with _gate_lock:
+        if _gate is None:
+            _gate = DetectorGate()
+        return _gate
@@ -0,0 +1,279 @@
+import os
+import time
+import queue
+import threading
+import logging
+
+from services import blob as sb
+from services import detection
+from services import detection_post
+from services import detection_cache
+from services import detector_backends
+from services import events as events_hub
+from services import image_cache
+from services import telemetry_store
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("AUTO_ANALYZE_WORKERS", "2"))
+# upstream pacing shared by all workers (API Ninjas quota)
+RATE_PER_MIN = float(os.getenv("AUTO_ANALYZE_RATE_PER_MIN", "30"))
+QUEUE_SIZE = int(os.getenv("AUTO_ANALYZE_QUEUE_SIZE", "1000"))
+MAX_ATTEMPTS = int(os.getenv("AUTO_ANALYZE_MAX_ATTEMPTS", "3"))
+# newest blobs enqueued when the pipeline starts (0 = only new uploads)
+BACKFILL = int(os.getenv("AUTO_ANALYZE_BACKFILL", "0"))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class RateLimiter:
+    """Token bucket shared by workers; pause() holds everyone back after a 429."""
+
+    def __init__(self, rate_per_min, burst=1):
+        self.interval = 60.0 / rate_per_min if rate_per_min > 0 else 0.0
+        self.burst = max(1, burst)
+        self._next = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        """Block until a call may be made; returns False if stop_event was set meanwhile."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._paused_until, self._next - self.interval * (self.burst - 1))
+            self._next = max(self._next, start) + self.interval
+            wait = start - now
+        if wait <= 0:
+            return True
+        if stop_event is not None:
+            return not stop_event.wait(wait)
+        time.sleep(wait)
+        return True
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AutoAnalyzer:
+    """
+    Background detection pipeline for new captures.
+
+    Subscribes to the ChangeHub for new blobs and for telemetry rows naming an image
+    (imageFileName / blobUrl) and queues them; list refresh events carry no items, so new
+    blobs are then found by diffing the listing against the last one seen. Detection runs
+    on a bounded worker pool paced by a shared RateLimiter. Results go to the detection
+    cache (so /api/analyze returns them instantly) and to the analyses table, linked to
+    telemetry rows by blob name.
+    """
+
+    def __init__(self, hub, config, workers=None, rate_per_min=None, queue_size=None):
+        self.hub = hub
+        self.config = config
+        self.workers = WORKERS if workers is None else workers
+        self.limiter = RateLimiter(RATE_PER_MIN if rate_per_min is None else rate_per_min)
+        self._queue = queue.Queue(maxsize=queue_size or QUEUE_SIZE)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._sub = None
+        self._seen = None  # name -> (etag, lastModified) of the last listing seen
+        self.stats = {'queued': 0, 'analyzed': 0, 'cached': 0, 'failed': 0, 'dropped': 0, 'rate_limited': 0}
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._sub = self.hub.subscribe()
+        self._threads.append(threading.Thread(target=self._consume_events, name="auto-analyze-events", daemon=True))
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f"auto-analyze-{i}", daemon=True))
+        for t in self._threads:
+            t.start()
+        if BACKFILL:
+            self.enqueue_listing(BACKFILL)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._sub is not None:
+            self.hub.unsubscribe(self._sub)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def status(self):
+        with self._lock:
+            pending = len(self._pending)
+            stats = dict(self.stats)
+        return dict(stats, running=bool(self._threads), pending=pending, workers=self.workers)
+
+    def _count(self, key):
+        # stats are updated from the event thread, the workers and retry timers
+        with self._lock:
+            self.stats[key] += 1
+
+    # -- sources -----------------------------------------------------------
+
+    def enqueue(self, blob_name, blob_url=None, etag=None):
+        """Queue one image; duplicates of a queued/running blob are ignored. Returns True if queued."""
+        if not blob_name or not blob_name.lower().endswith(IMAGE_EXTENSIONS):
+            return False
+        with self._lock:
+            if blob_name in self._pending:
+                return False
+            self._pending.add(blob_name)
+        try:
+            self._queue.put_nowait((blob_name, blob_url, etag, 1))
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(blob_name)
+            self._count('dropped')
+            logger.warning("auto-analyze: queue full, dropping %s", blob_name)
+            return False
+        self._count('queued')
+        return True
+
+    def pending(self, blob_name):
+        """True while blob_name is queued or being analyzed."""
+        with self._lock:
+            return blob_name in self._pending
+
+    def enqueue_listing(self, limit):
+        container_url, sas_token = self._storage()
+        for it in sb.list_blobs(container_url=container_url, sas_token=sas_token)[:limit]:
+            self.enqueue(it.get('name'), it.get('url'), it.get('etag'))
+
+    def _consume_events(self):
+        while not self._stop.is_set():
+            event = self._sub.get(timeout=1.0)
+            if not event:
+                continue
+            try:
+                if event.get('type') == 'blobs':
+                    items = event.get('items') or []
+                    self._remember(items)
+                    for it in items:
+                        self.enqueue(it.get('name'), it.get('url'), it.get('etag'))
+                elif event.get('type') == 'list':
+                    # the hub sends a bare refresh instead of items when many blobs changed,
+                    # some were removed or this subscriber fell behind
+                    for it in self._listing_changes():
+                        self.enqueue(it.get('name'), it.get('url'), it.get('etag'))
+                elif event.get('type') == 'telemetry':
+                    for row in event.get('rows') or []:
+                        name = row.get('imageFileName') or telemetry_store.blob_name_from_url(row.get('blobUrl'))
+                        self.enqueue(name)
+            except Exception:
+                logger.exception("auto-analyze: failed to handle event")
+
+    def _remember(self, items):
+        if self._seen is not None:
+            for it in items:
+                self._seen[it.get('name')] = (it.get('etag'), it.get('lastModified'))
+
+    def _listing_changes(self):
+        """New or changed blobs since the last listing seen (none on the first call, which sets the baseline)."""
+        container_url, sas_token = self._storage()
+        items = sb.list_blobs(container_url=container_url, sas_token=sas_token)
+        current = {it.get('name'): (it.get('etag'), it.get('lastModified')) for it in items}
+        previous, self._seen = self._seen, current
+        if previous is None:
+            return []
+        return [it for it in items if previous.get(it.get('name')) != current[it.get('name')]]
+
+    # -- workers -----------------------------------------------------------
+
+    def _storage(self):
+        container_url = self.config.get('AZURE_CONTAINER_URL') or self.config.get('CONTAINER_URL')
+        return container_url, self.config.get('SAS_TOKEN')
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            blob_name = job[0]
+            try:
+                self._process(*job)
+            except Exception:
+                self._count('failed')
+                logger.exception("auto-analyze: failed on %s", blob_name)
+            finally:
+                with self._lock:
+                    self._pending.discard(blob_name)
+
+    def _process(self, blob_name, blob_url, etag, attempt):
+        if not blob_url or not etag:
+            container_url, sas_token = self._storage()
+            info = sb.fetch_blob_data(container_url=container_url, blob_name=blob_name, sas_token=sas_token) or {}
+            blob_url = blob_url or info.get('blob_url')
+            etag = etag or info.get('etag')
+        if not blob_url:
+            self._count('failed')
+            return
+        cache = detection_cache.get_cache()
+        backend = detector_backends.get_backend()
+        key = backend.cache_key(detection_cache.key_for_blob(blob_name, etag)) if etag else None
+        detections = cache.get(key) if key else None
+        if detections is not None:
+            self._count('cached')
+        else:
+            # local models are not paced; they batch concurrent images instead
+            if backend.rate_limited and not self.limiter.acquire(self._stop):
+                return
+            try:
+                img_bytes, content_type, got_etag = image_cache.fetch_image(blob_url, blob_name, etag)
+                etag = etag or got_etag
+                key = key or backend.cache_key(
+                    detection_cache.key_for_blob(blob_name, etag) if etag else detection_cache.key_for_content(img_bytes))
+                detections = cache.get_or_compute(key, lambda: backend.detect(img_bytes, content_type, self.config))
+            except detection.DetectionError as e:
+                if isinstance(e.body, dict) and e.body.get('status') == 429:
+                    self._count('rate_limited')
+                    self.limiter.pause(detection.retry_delay(e.body.get('retry_after'), default=30))
+                    if attempt < MAX_ATTEMPTS:
+                        # requeue behind newer work; the pending mark is released by _work
+                        self._retry_later(blob_name, blob_url, etag, attempt + 1)
+                        return
+                self._count('failed')
+                logger.warning("auto-analyze: detection failed for %s: %s", blob_name, e)
+                return
+            self._count('analyzed')
+        from services import analyze_batch  # imports this module (RateLimiter)
+        _, likelihood = detection.match_fruit(detections, detection_post.get_matcher(self.config))
+        # cache hits only write when the row is missing or differs
+        analyze_batch.persist_analysis(blob_name, etag, likelihood, detections)
+
+    def _retry_later(self, blob_name, blob_url, etag, attempt):
+        def requeue():
+            with self._lock:
+                if blob_name in self._pending:
+                    return
+                self._pending.add(blob_name)
+            try:
+                self._queue.put_nowait((blob_name, blob_url, etag, attempt))
+            except queue.Full:
+                with self._lock:
+                    self._pending.discard(blob_name)
+                self._count('dropped')
+        timer = threading.Timer(1.0, requeue)
+        timer.daemon = True
+        timer.start()
+
+
+def get_analyzer(app):
+    return app.extensions.get('fruta_auto_analyze')
+
+
+def start(app):
+    """Create and start the app's AutoAnalyzer (idempotent)."""
+    analyzer = get_analyzer(app)
+    if analyzer is None:
+        analyzer = AutoAnalyzer(events_hub.get_hub(app), app.config)
+        app.extensions['fruta_auto_analyze'] = analyzer
+    analyzer.start()
+    return analyzer
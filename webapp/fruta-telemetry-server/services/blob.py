@@ -1,15 +1,41 @@
-from azure.storage.blob import BlobServiceClient
-from urllib.parse import urlparse, urljoin
+from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from urllib.parse import urlparse, urljoin, quote
 from xml.etree import ElementTree as ET
 from datetime import datetime, timezone
 from email.utils import parsedate_to_datetime, format_datetime
+import base64
+import bisect
+import json
+import threading
+import atexit
+import uuid
+from collections import OrderedDict
+import time
 import os
-import requests
 import re
 import logging
 
+from services import http_client
+
 logger = logging.getLogger(__name__)
 
+# listing index tuning (see BlobListingIndex)
+INDEX_TTL_SEC = float(os.getenv("BLOB_INDEX_TTL", "5"))
+INDEX_FULL_REFRESH_SEC = float(os.getenv("BLOB_INDEX_FULL_REFRESH", "300"))
+LIST_PAGE_SIZE = int(os.getenv("BLOB_LIST_PAGE_SIZE", "1000"))
+INDEX_PREFIXES = [p.strip() for p in os.getenv("BLOB_INDEX_PREFIXES", "").split(",") if p.strip()] or [""]
+# max listing indexes kept per process (one per container/prefix combination)
+INDEX_MAX = int(os.getenv("BLOB_INDEX_MAX", "64"))
+# chunk size used when streaming blob content to clients (bounds memory per request)
+STREAM_CHUNK_SIZE = int(os.getenv("BLOB_STREAM_CHUNK", str(256 * 1024)))
+# block size for streamed uploads: memory per upload is one block; bodies that fit in one
+# block are written with a single Put Blob instead of Put Block + Put Block List
+UPLOAD_BLOCK_SIZE = int(os.getenv("BLOB_UPLOAD_BLOCK_SIZE", str(256 * 1024)))
+# max BlobService clients kept per process (one per container_url/SAS combination)
+SERVICE_MAX = int(os.getenv("BLOB_SERVICE_MAX", "32"))
+
 def _append_sas(url, sas_token):
     """Append SAS token to url using '?' or '&' as appropriate."""
     if not sas_token:
@@ -78,51 +104,78 @@ class BlobService:
         self._sdk = None
         if self.conn_str:
             try:
-                self._sdk = BlobServiceClient.from_connection_string(self.conn_str)
+                # downloads are fetched in STREAM_CHUNK_SIZE pieces so streaming stays bounded
+                self._sdk = BlobServiceClient.from_connection_string(
+                    self.conn_str, max_single_get_size=STREAM_CHUNK_SIZE, max_chunk_get_size=STREAM_CHUNK_SIZE)
             except Exception:
                 self._sdk = None
 
-    def list_blobs(self):
-        items = []
+    def close(self):
+        """Release the SDK client's transport (REST calls use the shared http_client pool)."""
+        if self._sdk is not None:
+            try:
+                self._sdk.close()
+            except Exception:
+                logger.debug("BlobService: failed to close SDK client", exc_info=True)
+
+    def _container_name(self):
+        container_name = self.container_env
+        if not container_name and self.container_url:
+            # path like /container
+            u = urlparse(self.container_url)
+            container_name = u.path.strip('/').split('/')[-1]
+        return container_name
+
+    def list_pages(self, prefix=None, marker=None, page_size=None):
+        """
+        Yield (page_marker, items, next_marker) for each listing page, in blob-name order.
+        page_marker is the continuation marker that re-lists that page; next_marker is None
+        after the last page. Uses the SDK when configured, else REST comp=list.
+        """
+        page_size = page_size or LIST_PAGE_SIZE
         # SDK path
         if self._sdk:
             try:
-                container_name = self.container_env
-                if not container_name:
-                    # try to get from container_url if available
-                    if self.container_url:
-                        u = urlparse(self.container_url)
-                        # path like /container
-                        container_name = u.path.strip('/').split('/')[-1]
+                container_name = self._container_name()
                 if not container_name:
                     raise RuntimeError("container name not configured (AZURE_STORAGE_CONTAINER_NAME or container_url required)")
-
                 cl = self._sdk.get_container_client(container_name)
-                for blob in cl.list_blobs():
-                    blob_client = self._sdk.get_blob_client(container=container_name, blob=blob.name)
-                    items.append({
+                base = cl.url.rstrip('/')
+                pager = cl.list_blobs(name_starts_with=prefix or None, results_per_page=page_size).by_page(continuation_token=marker)
+                page_marker = marker
+                for page in pager:
+                    # build URLs by string concat: get_blob_client per blob is comparatively expensive
+                    items = [{
                         'name': blob.name,
                         'lastModified': _format_rfc1123(getattr(blob, 'last_modified', None)),
                         'etag': getattr(blob, 'etag', None),
-                        'url': blob_client.url
-                    })
-                # sort by timestamp (newest first)
-                items.sort(key=_blob_ts, reverse=True)
-                return items
+                        'url': f"{base}/{quote(blob.name)}"
+                    } for blob in page]
+                    yield page_marker, items, pager.continuation_token
+                    page_marker = pager.continuation_token
+                return
             except Exception:
+                if not self.container_url:
+                    raise
                 # fallthrough to REST attempt if SDK listing fails
-                pass
+                logger.warning("list_pages: SDK listing failed, falling back to REST", exc_info=True)
 
         # REST path using container_url + ?restype=container&comp=list (requires SAS or public container)
         if not self.container_url:
-            return []  # nothing we can do
-        try:
-            u = self.container_url.rstrip('/')
-            list_url = f"{u}?restype=container&comp=list"
+            return  # nothing we can do
+        u = self.container_url.rstrip('/')
+        page_marker = marker
+        while True:
+            list_url = f"{u}?restype=container&comp=list&maxresults={int(page_size)}"
+            if prefix:
+                list_url += f"&prefix={quote(prefix, safe='')}"
+            if page_marker:
+                list_url += f"&marker={quote(page_marker, safe='')}"
             list_url = _append_sas(list_url, self.sas_token)
-            r = requests.get(list_url, timeout=15)
+            r = http_client.get(list_url, endpoint='blob_list')
             r.raise_for_status()
             xml = ET.fromstring(r.content)
+            items = []
             for blob in xml.findall('.//Blob'):
                 name_el = blob.find('Name')
                 props = blob.find('Properties')
@@ -132,10 +185,36 @@ class BlobService:
                 blob_url = f"{u}/{name}"
                 blob_url = _append_sas(blob_url, self.sas_token)
                 items.append({'name': name, 'lastModified': last_mod, 'etag': etag, 'url': blob_url})
-            items.sort(key=_blob_ts, reverse=True)
-            return items
+            next_marker = xml.findtext('NextMarker') or None
+            yield page_marker, items, next_marker
+            if not next_marker:
+                return
+            page_marker = next_marker
+
+    def list_blobs(self):
+        """Full (uncached) listing, newest first. Prefer the module-level list_blobs, which is indexed."""
+        items = []
+        try:
+            for _, page, _ in self.list_pages():
+                items.extend(page)
         except Exception:
             return []
+        # sort by timestamp (newest first)
+        items.sort(key=_blob_ts, reverse=True)
+        return items
+
+    def blob_url(self, blob_name):
+        """
+        URL for blob_name built without any storage round-trip (same URL fetch_blob_data
+        returns: the SDK account URL in SDK mode, container_url + SAS otherwise).
+        """
+        if self._sdk:
+            container_name = self._container_name()
+            if container_name:
+                return f"{self._sdk.url.rstrip('/')}/{container_name}/{quote(blob_name)}"
+        if not self.container_url:
+            return None
+        return _append_sas(f"{self.container_url.rstrip('/')}/{blob_name}", self.sas_token)
 
     def fetch_blob_data(self, blob_name):
         """
@@ -174,7 +253,7 @@ class BlobService:
         blob_url = _append_sas(blob_url, self.sas_token)
         # try a HEAD to get properties if permitted
         try:
-            r = requests.head(blob_url, timeout=10)
+            r = http_client.head(blob_url, endpoint='blob_head')
             if r.status_code in (200, 206):
                 last_mod = r.headers.get('Last-Modified') or r.headers.get('last-modified')
                 etag = r.headers.get('ETag') or r.headers.get('etag')
@@ -209,19 +288,462 @@ class BlobService:
             raise RuntimeError("container_url or connection string required to fetch blob content")
         blob_url = f"{self.container_url.rstrip('/')}/{blob_name}"
         blob_url = _append_sas(blob_url, self.sas_token)
-        r = requests.get(blob_url, timeout=30)
+        r = http_client.get(blob_url, endpoint='blob_get')
         r.raise_for_status()
         return r.content
 
+    def open_blob(self, blob_name, range_header=None, if_none_match=None):
+        """
+        Open blob_name for streaming. Returns a BlobStream (status 200, 206 for a satisfiable
+        Range, 304 when if_none_match matches the current ETag, 416 for a bad range), or None
+        if the blob does not exist. The body is read lazily in STREAM_CHUNK_SIZE pieces.
+        """
+        if not blob_name:
+            raise ValueError("blob_name required")
+
+        # SDK path
+        if self._sdk:
+            try:
+                blob_client = self._sdk.get_blob_client(container=self._container_name(), blob=blob_name)
+                props = blob_client.get_blob_properties()
+            except ResourceNotFoundError:
+                return None
+            except Exception:
+                props = None
+                if not self.container_url:
+                    raise
+                logger.warning("open_blob: SDK properties failed, falling back to REST", exc_info=True)
+            if props is not None:
+                headers = {
+                    'ETag': props.etag,
+                    'Last-Modified': _format_rfc1123(props.last_modified),
+                    'Content-Type': getattr(props.content_settings, 'content_type', None),
+                }
+                if etag_matches(if_none_match, props.etag):
+                    return BlobStream(304, headers)
+                size = props.size
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    return BlobStream(416, {'Content-Range': f"bytes */{size}"})
+                status, offset, length = 200, 0, size
+                if byte_range:
+                    start, end = byte_range
+                    status, offset, length = 206, start, end - start + 1
+                    headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+                headers['Content-Length'] = str(length)
+                if length == 0:
+                    return BlobStream(status, headers)
+                downloader = blob_client.download_blob(offset=offset, length=length, etag=props.etag,
+                                                       match_condition=MatchConditions.IfNotModified)
+                return BlobStream(status, headers, downloader.chunks())
+
+        # REST path: Range / If-None-Match are forwarded and storage answers them
+        if not self.container_url:
+            raise RuntimeError("container_url or connection string required to fetch blob content")
+        blob_url = _append_sas(f"{self.container_url.rstrip('/')}/{blob_name}", self.sas_token)
+        req_headers = {}
+        if range_header:
+            req_headers['Range'] = range_header
+        if if_none_match:
+            req_headers['If-None-Match'] = if_none_match
+        r = http_client.get(blob_url, endpoint='blob_get', headers=req_headers, stream=True)
+        if r.status_code == 404:
+            r.close()
+            return None
+        if r.status_code not in (200, 206, 304, 416):
+            r.close()
+            r.raise_for_status()
+            raise RuntimeError(f"unexpected status {r.status_code} fetching {blob_name}")
+        headers = {k: r.headers.get(k) for k in STREAM_HEADERS}
+        if r.status_code in (304, 416):
+            r.close()
+            return BlobStream(r.status_code, headers)
+        return BlobStream(r.status_code, headers, r.iter_content(STREAM_CHUNK_SIZE), r.close)
+
+    def upload_stream(self, blob_name, chunks, content_type=None, block_size=None, overwrite=False):
+        """
+        Write an iterable of byte chunks to blob_name as it is read. Chunks are regrouped
+        into block_size blocks and each block is staged as soon as it is full, so at most
+        one block is held in memory; the block list is committed at the end. Unless
+        overwrite is set the write is conditional (If-None-Match: *) and an existing blob
+        raises FileExistsError. Returns the listing item for the new blob plus its 'size'.
+        """
+        if not blob_name:
+            raise ValueError("blob_name required")
+        block_size = block_size or UPLOAD_BLOCK_SIZE
+        blocks = _iter_blocks(chunks, block_size)
+        first = next(blocks, b'')
+        second = next(blocks, None)
+        if self._sdk:
+            container_name = self._container_name()
+            if not container_name:
+                raise RuntimeError("container name not configured")
+            blob_client = self._sdk.get_blob_client(container=container_name, blob=blob_name)
+            settings = ContentSettings(content_type=content_type) if content_type else None
+            condition = {} if overwrite else {'etag': '*', 'match_condition': MatchConditions.IfMissing}
+            try:
+                if second is None:
+                    props = blob_client.upload_blob(first, overwrite=overwrite, content_settings=settings)
+                    size = len(first)
+                else:
+                    ids, size = [], 0
+                    for block in _chain_blocks(first, second, blocks):
+                        ids.append(_block_id(ids))
+                        blob_client.stage_block(ids[-1], block, length=len(block))
+                        size += len(block)
+                    props = blob_client.commit_block_list(ids, content_settings=settings, **condition)
+            except (ResourceExistsError, ResourceModifiedError) as e:
+                raise FileExistsError(blob_name) from e
+            return {'name': blob_name, 'lastModified': _format_rfc1123(props.get('last_modified')),
+                    'etag': props.get('etag'), 'url': blob_client.url, 'size': size}
+
+        # REST path: Put Blob / Put Block + Put Block List with the container SAS
+        if not self.container_url:
+            raise RuntimeError("container_url or connection string required to upload")
+        url = f"{self.container_url.rstrip('/')}/{blob_name}"
+        headers = {'x-ms-blob-content-type': content_type} if content_type else {}
+        if not overwrite:
+            headers['If-None-Match'] = '*'
+        if second is None:
+            r = http_client.put(_append_sas(url, self.sas_token), endpoint='blob_put', data=first,
+                                headers=dict(headers, **{'x-ms-blob-type': 'BlockBlob'}))
+            size = len(first)
+        else:
+            ids, size = [], 0
+            for block in _chain_blocks(first, second, blocks):
+                ids.append(_block_id(ids))
+                block_url = f"{url}?comp=block&blockid={quote(_b64(ids[-1]), safe='')}"
+                r = http_client.put(_append_sas(block_url, self.sas_token), endpoint='blob_put', data=block)
+                r.raise_for_status()
+                size += len(block)
+            body = '<?xml version="1.0" encoding="utf-8"?><BlockList>' + \
+                ''.join(f"<Latest>{_b64(i)}</Latest>" for i in ids) + '</BlockList>'
+            r = http_client.put(_append_sas(f"{url}?comp=blocklist", self.sas_token), endpoint='blob_put',
+                                data=body.encode('utf-8'), headers=headers)
+        if r.status_code in (409, 412):
+            raise FileExistsError(blob_name)
+        r.raise_for_status()
+        return {'name': blob_name, 'lastModified': r.headers.get('Last-Modified'),
+                'etag': r.headers.get('ETag'), 'url': _append_sas(url, self.sas_token), 'size': size}
+
+
+def _iter_blocks(chunks, block_size):
+    """Regroup byte chunks of any size into block_size blocks (the last one may be short)."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= block_size:
+            yield bytes(buf[:block_size])
+            del buf[:block_size]
+    if buf:
+        yield bytes(buf)
+
+
+def _chain_blocks(first, second, rest):
+    yield first
+    yield second
+    yield from rest
+
+
+def _block_id(ids):
+    # ids of one blob must have equal length; the random part keeps concurrent uploads apart
+    token = ids[0][:16] if ids else uuid.uuid4().hex[:16]
+    return f"{token}-{len(ids):06d}"
+
+
+def _b64(block_id):
+    return base64.b64encode(block_id.encode('ascii')).decode('ascii')
+
+
+# response headers passed through from storage when streaming a blob
+STREAM_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'ETag', 'Last-Modified')
+
+
+class BlobStream:
+    """Status, pass-through headers and a lazy chunk iterator for one blob download."""
+
+    def __init__(self, status, headers, chunks=None, close=None):
+        self.status = status
+        self.headers = {k: v for k, v in headers.items() if v}
+        self._chunks = chunks
+        self._close = close
+
+    def __iter__(self):
+        try:
+            for chunk in self._chunks or ():
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._close is not None:
+            close, self._close = self._close, None
+            close()
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range 'bytes=' Range header against a blob of `size` bytes. Returns
+    (start, end) inclusive, or None to serve the whole blob (no header, or a multi-range /
+    non-bytes header, which servers may ignore). Raises ValueError if unsatisfiable.
+    """
+    m = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip(), re.IGNORECASE)
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    first, last = m.groups()
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value matches etag (weak comparison, '*' allowed)."""
+    if not if_none_match or not etag:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    strip = lambda t: t[2:] if t.startswith('W/') else t
+    return '*' in tags or strip(etag) in {strip(t) for t in tags}
+
+
+def _index_key(it):
+    # newest first; name breaks ties so the order is stable
+    return (-_blob_ts(it), it.get('name') or '')
+
+
+class BlobListingIndex:
+    """
+    Shared, incrementally refreshed listing of one container (newest first).
+
+    A full listing runs on first use and every `full_refresh` seconds (this also drops
+    deleted blobs). In between, at most once per `ttl`, each configured prefix is
+    re-listed starting from the marker of the last page seen for it, so only the tail
+    of the name space plus any new pages are fetched and merged in. Blobs that sort
+    before that tail (e.g. a new name prefix) are picked up by the next full listing;
+    set BLOB_INDEX_PREFIXES (comma-separated, e.g. one per device) to track several tails.
+    """
+
+    def __init__(self, ttl=None, full_refresh=None, page_size=None, prefixes=None):
+        self.ttl = INDEX_TTL_SEC if ttl is None else ttl
+        self.full_refresh = INDEX_FULL_REFRESH_SEC if full_refresh is None else full_refresh
+        self.page_size = page_size or LIST_PAGE_SIZE
+        self.prefixes = list(prefixes or INDEX_PREFIXES)
+        self._by_name = {}
+        self._sorted = []
+        self._keys = []
+        self._tails = {}
+        self._last_refresh = 0.0
+        self._last_full = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _ensure_fresh(self, svc, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        if not self._loaded or time.monotonic() - self._last_refresh >= max_age:
+            # one refresher at a time; other callers reuse the current snapshot if there is one
+            if self._refresh_lock.acquire(blocking=not self._loaded):
+                try:
+                    if not self._loaded or time.monotonic() - self._last_refresh >= max_age:
+                        self.refresh(svc)
+                finally:
+                    self._refresh_lock.release()
+
+    def items(self, svc, max_age=None):
+        """Return a snapshot list (newest first), refreshing first if older than max_age/ttl."""
+        self._ensure_fresh(svc, max_age)
+        with self._lock:
+            return list(self._sorted)
+
+    def page(self, svc, limit, cursor=None, max_age=None):
+        """
+        Return (items, next_cursor): up to `limit` blobs newest first, starting after `cursor`
+        (a token from a previous page). Keyset paging over the sorted snapshot, so a page
+        costs a bisect plus a slice regardless of how many blobs the container holds.
+        """
+        self._ensure_fresh(svc, max_age)
+        after = decode_list_cursor(cursor) if cursor else None
+        with self._lock:
+            start = bisect.bisect_right(self._keys, after) if after is not None else 0
+            items = self._sorted[start:start + limit]
+            more = start + limit < len(self._sorted)
+        next_cursor = encode_list_cursor(items[-1]) if items and more else None
+        return items, next_cursor
+
+    def refresh(self, svc, full=False):
+        now = time.monotonic()
+        full = full or not self._loaded or now - self._last_full >= self.full_refresh
+        try:
+            if full:
+                self._refresh_full(svc)
+                self._last_full = now
+            else:
+                self._refresh_tails(svc)
+            self._loaded = True
+        except Exception:
+            logger.exception("BlobListingIndex: %s refresh failed; keeping previous snapshot", 'full' if full else 'incremental')
+        self._last_refresh = time.monotonic()
+
+    def _refresh_full(self, svc):
+        by_name, tails = {}, {}
+        for prefix in self.prefixes:
+            for page_marker, page, _ in svc.list_pages(prefix=prefix, page_size=self.page_size):
+                for it in page:
+                    by_name[it['name']] = it
+                tails[prefix] = page_marker
+        ordered = sorted(by_name.values(), key=_index_key)
+        with self._lock:
+            self._by_name = by_name
+            self._sorted = ordered
+            self._keys = [_index_key(it) for it in ordered]
+            self._tails = tails
+
+    def _refresh_tails(self, svc):
+        for prefix in self.prefixes:
+            tail = self._tails.get(prefix)
+            for page_marker, page, _ in svc.list_pages(prefix=prefix, marker=tail, page_size=self.page_size):
+                self.merge(page)
+                tail = page_marker
+            self._tails[prefix] = tail
+
+    def merge(self, items):
+        """Insert new or changed blobs, keeping the snapshot sorted (no full re-sort)."""
+        with self._lock:
+            for it in items:
+                name = it.get('name')
+                old = self._by_name.get(name)
+                if old is not None:
+                    if old.get('etag') == it.get('etag') and old.get('lastModified') == it.get('lastModified'):
+                        continue
+                    i = bisect.bisect_left(self._keys, _index_key(old))
+                    if i < len(self._sorted) and self._sorted[i].get('name') == name:
+                        del self._sorted[i]
+                        del self._keys[i]
+                key = _index_key(it)
+                i = bisect.bisect_left(self._keys, key)
+                self._keys.insert(i, key)
+                self._sorted.insert(i, it)
+                self._by_name[name] = it
+
+
+def encode_list_cursor(it):
+    raw = json.dumps([_blob_ts(it), it.get('name') or '']).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_list_cursor(cursor):
+    """Inverse of encode_list_cursor, as an index sort key; raises ValueError if malformed."""
+    try:
+        ts, name = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (-float(ts), str(name))
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_listing_index(svc, prefix=None):
+    """
+    Return the process-wide listing index for the container `svc` points at. With `prefix`,
+    the index only lists names starting with it (pushed down to the SDK/REST listing).
+    """
+    key = (svc.conn_str if svc._sdk else None, svc._container_name(), svc.container_url, svc.sas_token, prefix or None)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = BlobListingIndex(prefixes=[prefix] if prefix else None)
+            while len(_indexes) > INDEX_MAX:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
+
+
+_services = OrderedDict()
+_services_lock = threading.Lock()
+
+
+def get_service(container_url=None, sas_token=None):
+    """
+    Process-wide BlobService for (container_url, sas_token), built once and shared by all
+    request threads (env config is read and the SDK client created on first use only).
+    """
+    key = (container_url or None, sas_token or None)
+    with _services_lock:
+        svc = _services.get(key)
+        if svc is None:
+            svc = _services[key] = BlobService(container_url=container_url, sas_token=sas_token)
+            while len(_services) > SERVICE_MAX:
+                # not closed: request threads may still be using it; its transport is
+                # released when the last reference goes away
+                _services.popitem(last=False)
+        else:
+            _services.move_to_end(key)
+    return svc
+
+
+def close_services():
+    """Close and forget all registered services (shutdown, or after storage config changes)."""
+    with _services_lock:
+        services = list(_services.values())
+        _services.clear()
+    for svc in services:
+        svc.close()
+
+
+atexit.register(close_services)
+
+
 # Module-level convenience wrappers used by the app
-def list_blobs(container_url=None, sas_token=None):
-    svc = BlobService(container_url=container_url, sas_token=sas_token)
-    return svc.list_blobs()
+def list_blobs(container_url=None, sas_token=None, max_age=None):
+    """Newest-first listing served from the shared index (refreshed at most once per BLOB_INDEX_TTL)."""
+    svc = get_service(container_url=container_url, sas_token=sas_token)
+    if not svc._sdk and not svc.container_url:
+        return []
+    return get_listing_index(svc).items(svc, max_age=max_age)
+
+def list_blobs_page(container_url=None, sas_token=None, prefix=None, limit=100, cursor=None):
+    """One newest-first page from the shared index: returns (items, next_cursor)."""
+    svc = get_service(container_url=container_url, sas_token=sas_token)
+    if not svc._sdk and not svc.container_url:
+        return [], None
+    return get_listing_index(svc, prefix=prefix).page(svc, limit, cursor=cursor)
+
+def list_blobs_by_name(container_url=None, sas_token=None, prefix=None, limit=100, marker=None):
+    """
+    One raw listing page in blob-name order, straight from storage (marker = Azure continuation
+    marker). Returns (items, next_marker); items within the page are sorted newest first.
+    """
+    svc = get_service(container_url=container_url, sas_token=sas_token)
+    if not svc._sdk and not svc.container_url:
+        return [], None
+    for _, items, next_marker in svc.list_pages(prefix=prefix, marker=marker, page_size=limit):
+        items.sort(key=_blob_ts, reverse=True)
+        return items, next_marker
+    return [], None
 
 def fetch_blob_data(container_url=None, blob_name=None, sas_token=None):
-    svc = BlobService(container_url=container_url, sas_token=sas_token)
+    svc = get_service(container_url=container_url, sas_token=sas_token)
     return svc.fetch_blob_data(blob_name)
 
 def fetch_blob_content(container_url=None, blob_name=None, sas_token=None):
-    svc = BlobService(container_url=container_url, sas_token=sas_token)
-    return svc.fetch_blob_content(blob_name)
\ No newline at end of file
+    svc = get_service(container_url=container_url, sas_token=sas_token)
+    return svc.fetch_blob_content(blob_name)
+
+def open_blob(container_url=None, blob_name=None, sas_token=None, range_header=None, if_none_match=None):
+    svc = get_service(container_url=container_url, sas_token=sas_token)
+    return svc.open_blob(blob_name, range_header=range_header, if_none_match=if_none_match)
+
+def upload_stream(container_url=None, blob_name=None, chunks=(), sas_token=None, content_type=None, overwrite=False):
+    svc = get_service(container_url=container_url, sas_token=sas_token)
+    return svc.upload_stream(blob_name, chunks, content_type=content_type, overwrite=overwrite)
@@ -0,0 +1,124 @@
+import json
+import base64
+import binascii
+from typing import Iterator, Tuple, Any, Optional, Iterable
+
+from services.json_stream import iter_json_records, CHUNK_SIZE
+
+try:
+    import fastavro
+except ImportError:  # optional: pip install -r requirements-avro.txt
+    fastavro = None
+
+# Streaming decoder for IoT Hub capture / routing blobs (JSON or Avro envelopes)
+
+AVRO_MAGIC = b'Obj\x01'
+
+
+class ChunkStream:
+    """Minimal binary file-like object over an iterable of byte chunks (e.g. download_blob().chunks())."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buf = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0:
+            data, self._buf = self._buf, b''
+        else:
+            data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+
+class _Prefixed:
+    """Replays bytes already read (for format sniffing) ahead of the rest of a stream."""
+
+    def __init__(self, head: bytes, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._head:
+            return self._stream.read(size)
+        if size < 0:
+            data, self._head = self._head + self._stream.read(), b''
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+
+def iter_envelopes(stream, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, Any, Optional[str]]]:
+    """
+    Yield (index, envelope, error) for each message in a capture blob read from the binary
+    `stream`, one at a time. Avro container files (IoT Hub capture default) are detected by
+    their magic bytes; anything else is parsed as a JSON array, JSON lines or concatenated
+    (pretty-printed) JSON objects. Memory is bounded by the chunk size plus one record.
+    """
+    head = b''
+    while len(head) < len(AVRO_MAGIC):
+        data = stream.read(len(AVRO_MAGIC) - len(head))
+        if not data:
+            break
+        head += data
+    stream = _Prefixed(head, stream)
+    if head == AVRO_MAGIC:
+        if fastavro is None:
+            yield 0, None, 'avro capture file: install fastavro (requirements-avro.txt) to decode it'
+            return
+        index = 0
+        try:
+            for record in fastavro.reader(stream):
+                yield index, record, None
+                index += 1
+        except Exception as e:
+            yield index, None, f'invalid avro: {e}'
+        return
+    yield from iter_json_records(stream, chunk_size=chunk_size, multiline=True)
+
+
+def _body_text(raw: bytes) -> str:
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin1', errors='replace')
+
+
+def decode_body(envelope) -> Optional[dict]:
+    """
+    Decode an envelope's Body: returns {'text', 'payload'?}, {'error'} or None when there
+    is no Body. Handles base64 strings (JSON capture / routing), raw bytes (Avro) and bodies
+    IoT Hub already stored as JSON (messages sent with contentType application/json).
+    """
+    if not isinstance(envelope, dict):
+        return None
+    body = envelope.get('Body', envelope.get('body'))
+    if body is None:
+        return None
+    if isinstance(body, (dict, list)):
+        return {'text': json.dumps(body), 'payload': body}
+    if isinstance(body, str):
+        try:
+            body = base64.b64decode(body)
+        except (binascii.Error, ValueError) as e:
+            return {'error': f'base64 decode failed: {e}'}
+    text = _body_text(bytes(body))
+    try:
+        return {'text': text, 'payload': json.loads(text)}
+    except ValueError:
+        return {'text': text}
+
+
+def iter_decoded(stream, chunk_size: int = CHUNK_SIZE):
+    """Yield (index, envelope, decoded_or_None, error) per message; bodies are decoded as consumed."""
+    for index, envelope, error in iter_envelopes(stream, chunk_size=chunk_size):
+        if error:
+            yield index, None, None, error
+        else:
+            yield index, envelope, decode_body(envelope), None
@@ -0,0 +1,125 @@
+import os
+import logging
+import requests
+
+from services import http_client
+from services import detection_post
+from services.detection_post import DEFAULT_FRUIT_KEYWORDS, fruit_keywords  # noqa: F401 (re-exported)
+
+# Object detection helpers shared by the Flask and ASGI analyze handlers
+
+logger = logging.getLogger(__name__)
+
+API_NINJAS_URL = 'https://api.api-ninjas.com/v1/objectdetection'
+
+
+def api_key(config=None):
+    """API Ninjas key: app config first (it can be changed at runtime via /api/settings), then env."""
+    return (config or {}).get('API_NINJAS_KEY') or os.getenv('API_NINJAS_KEY')
+
+
+def normalize_detections(raw):
+    """Normalize various provider shapes: support 'name' or 'label' and ensure confidence is a float."""
+    return detection_post.normalize(raw)
+
+
+def match_fruit(detections, keywords):
+    """Return (matches, likelihood): detections whose label contains a keyword and their highest confidence."""
+    matcher = keywords if isinstance(keywords, detection_post.KeywordMatcher) else detection_post.KeywordMatcher(keywords)
+    return matcher.summarize(detections)
+
+
+def build_result(blob_name, blob_url, detections, keywords):
+    """/api/analyze response body; keywords is a KeywordMatcher (or a keyword set)."""
+    mango_matches, mango_conf = match_fruit(detections, keywords)
+    return {
+        'detections': detections,
+        'mango_matches': mango_matches,
+        'mango_likelihood': mango_conf,
+        'blobName': blob_name,
+        'blobUrl': blob_url,
+        'prediction': {'mango_likelihood': mango_conf}
+    }
+
+
+def empty_result(blob_name, blob_url, error=None):
+    """Result returned (with HTTP 200) when there is no image to analyze."""
+    result = {
+        'detections': [],
+        'mango_matches': [],
+        'mango_likelihood': 0.0,
+        'blobName': blob_name,
+        'blobUrl': blob_url,
+        'prediction': None
+    }
+    if error:
+        result['error'] = error
+    return result
+
+
+def retry_delay(retry_after, default=1):
+    """Seconds from a Retry-After value (delta-seconds or HTTP date), or default."""
+    delay = http_client.parse_retry_after(retry_after)
+    return default if delay is None else delay
+
+
+class DetectionError(Exception):
+    """Analyze failure carrying the HTTP status and JSON body the API returns for it."""
+
+    def __init__(self, status, body):
+        super().__init__(body.get('error') if isinstance(body, dict) else str(body))
+        self.status = status
+        self.body = body
+
+
+def fetch_image(blob_url, blob_name=None):
+    """
+    Download image bytes; returns (bytes, content_type, etag). A failed download raises
+    DetectionError with an empty detection result (HTTP 200), matching the analyze contract.
+    """
+    try:
+        resp = http_client.get(blob_url, endpoint='image')
+        resp.raise_for_status()
+    except requests.HTTPError as e:
+        logger.exception("analyze: HTTP error fetching image %s", blob_url)
+        raise DetectionError(200, empty_result(blob_name, blob_url, f'failed to fetch image: {e}'))
+    except Exception as e:
+        logger.exception("analyze: failed to fetch image %s", e)
+        raise DetectionError(200, empty_result(blob_name, blob_url, 'failed to fetch image'))
+    return resp.content, resp.headers.get('Content-Type') or 'image/jpeg', resp.headers.get('ETag')
+
+
+def call_detector(img_bytes, content_type, key):
+    """POST image bytes to API Ninjas object detection; returns normalized detections."""
+    if not key:
+        raise DetectionError(500, {'error': 'API_NINJAS_KEY not configured on server'})
+    api_url = API_NINJAS_URL
+    files = {'image': ('image', img_bytes, content_type)}
+    headers = {'X-Api-Key': key}
+    r = None
+    try:
+        # pooled session; 429s are retried with backoff (Retry-After honored) by http_client
+        r = http_client.post(api_url, endpoint='detect', headers=headers, files=files)
+        logger.info("analyze: called API Ninjas %s (status=%s)", api_url, r.status_code)
+        if r.status_code == 429:
+            retry_after = r.headers.get('Retry-After')
+            logger.warning("analyze: rate limited by API Ninjas, Retry-After=%s", retry_after)
+            raise DetectionError(502, {'error': 'object detection rate limited', 'status': 429, 'retry_after': retry_after})
+        r.raise_for_status()
+        raw = r.json() if r.text else []
+        detections = normalize_detections(raw)
+        logger.info("analyze: API Ninjas responded status=%s detections=%d", r.status_code, len(detections) if isinstance(detections, list) else 0)
+        logger.debug("analyze: raw detections sample: %s", raw if isinstance(raw, list) else str(raw)[:200])
+        return detections
+    except DetectionError:
+        raise
+    except requests.HTTPError as e:
+        body = None
+        try:
+            body = r.text
+        except Exception:
+            pass
+        raise DetectionError(502, {'error': 'object detection API error', 'details': str(e), 'response': body})
+    except Exception as e:
+        logger.exception("analyze: object detection request failed: %s", e)
+        raise DetectionError(502, {'error': f'object detection request failed: {e}'})
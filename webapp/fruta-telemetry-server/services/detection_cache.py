@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Optional, Callable, Any
+
+from services import telemetry_store
+
+logger = logging.getLogger(__name__)
+
+# defaults to the telemetry DB so there is one file to back up/operate
+CACHE_PATH = os.getenv("DETECTION_CACHE_PATH") or None
+MAX_ENTRIES = int(os.getenv("DETECTION_CACHE_MAX_ENTRIES", "20000"))
+MAX_AGE_SEC = float(os.getenv("DETECTION_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+# evict at most every this many puts (eviction is a range delete, cheap but not free)
+EVICT_EVERY = 50
+
+
+def key_for_blob(blob_name: str, etag: str) -> str:
+    return f"blob:{blob_name}:{etag.strip(chr(34))}"
+
+
+def key_for_content(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+class DetectionCache:
+    """
+    Persistent detection result cache keyed by blob name + ETag (or content hash), with
+    age and entry-count eviction, plus single-flight coalescing: concurrent callers asking
+    for the same missing key share one upstream computation.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        self.db_path = db_path or CACHE_PATH or telemetry_store.DB_PATH
+        self.max_entries = MAX_ENTRIES if max_entries is None else max_entries
+        self.max_age = MAX_AGE_SEC if max_age is None else max_age
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # one long-lived connection; statements are tiny so callers just take turns
+        self._db_lock = threading.Lock()
+        self._puts = 0
+        parent = os.path.dirname(self.db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in telemetry_store.PRAGMAS:
+            self._db.execute(pragma)
+        self._init_db()
+
+    def _init_db(self):
+        conn = self._db
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS detection_cache (
+          key TEXT PRIMARY KEY,
+          created_at REAL NOT NULL,
+          last_access REAL NOT NULL,
+          result TEXT NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detection_cache_access ON detection_cache (last_access)")
+        conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._db_lock, self._db as conn:
+            row = conn.execute("SELECT result, created_at FROM detection_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                return None
+            conn.execute("UPDATE detection_cache SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self._db_lock, self._db as conn:
+            conn.execute("INSERT OR REPLACE INTO detection_cache (key, created_at, last_access, result) VALUES (?, ?, ?, ?)",
+                         (key, now, now, json.dumps(value)))
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % EVICT_EVERY == 1
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used beyond max_entries."""
+        with self._db_lock, self._db as conn:
+            conn.execute("DELETE FROM detection_cache WHERE created_at < ?", (time.time() - self.max_age,))
+            conn.execute("""
+            DELETE FROM detection_cache WHERE key IN (
+              SELECT key FROM detection_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+    def close(self):
+        with self._db_lock:
+            self._db.close()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, or run compute() once and cache its result.
+        Concurrent calls for the same key wait for the first one; exceptions propagate
+        to every waiter and are not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+        if not leader:
+            return fut.result()
+        try:
+            # a previous leader may have finished between our miss and taking the lock
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                try:
+                    self.put(key, value)
+                except Exception:
+                    logger.exception("detection cache: failed to store %s", key)
+            fut.set_result(value)
+            return value
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DetectionCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DetectionCache()
+        return _cache
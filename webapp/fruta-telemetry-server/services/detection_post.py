@@ -0,0 +1,117 @@
+import os
+import re
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+# Detection post-processing shared by every analyze path: shape normalization,
+# confidence threshold and fruit-keyword matching
+
+DEFAULT_FRUIT_KEYWORDS = {
+    'mango', 'fruit', 'apple', 'banana', 'orange', 'papaya', 'pear',
+    'peach', 'avocado', 'guava', 'plum', 'apricot', 'nectarine', 'tangerine'
+}
+
+# detections below this confidence are dropped when results are normalized (0 keeps all)
+MIN_CONFIDENCE = float(os.getenv("DETECTION_MIN_CONFIDENCE", "0"))
+# distinct labels whose verdict is remembered per matcher (detector vocabularies are small)
+MAX_LABELS = 10000
+
+
+def fruit_keywords(config=None):
+    """
+    Keywords treated as fruit matches: comma-separated FRUIT_KEYWORDS from env/app config,
+    falling back to a small list of common fruit names.
+    """
+    kw_env = os.getenv('FRUIT_KEYWORDS') or (config or {}).get('FRUIT_KEYWORDS')
+    if kw_env:
+        return parse_keywords(kw_env)
+    return set(DEFAULT_FRUIT_KEYWORDS)
+
+
+def parse_keywords(value) -> set:
+    """Keyword set from a comma-separated string or a list of strings."""
+    items = value.split(',') if isinstance(value, str) else value
+    return {str(k).strip().lower() for k in items or () if str(k).strip()}
+
+
+class KeywordMatcher:
+    """
+    Case-insensitive "label contains any keyword" test, compiled once into a single regex
+    alternation. Detectors emit a small label vocabulary, so each label's verdict is
+    computed once and then answered from a dict.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = frozenset(parse_keywords(list(keywords)))
+        # longest first, so the alternation never stops at a shorter overlapping keyword
+        alternatives = sorted((re.escape(k) for k in self.keywords), key=len, reverse=True)
+        self._search = re.compile("|".join(alternatives)).search if alternatives else None
+        self._verdicts = {}
+
+    def matches(self, label: str) -> bool:
+        verdict = self._verdicts.get(label)
+        if verdict is None:
+            verdict = self._search is not None and self._search(label.lower()) is not None
+            if len(self._verdicts) < MAX_LABELS:
+                self._verdicts[label] = verdict
+        return verdict
+
+    def summarize(self, detections: List[dict]) -> Tuple[List[dict], float]:
+        """(matching detections, highest matching confidence) for normalized detections."""
+        matches = [d for d in detections if self.matches(d.get('name') or '')]
+        return matches, max((float(d.get('confidence') or 0.0) for d in matches), default=0.0)
+
+
+def normalize(raw, min_confidence: Optional[float] = None) -> List[dict]:
+    """
+    Normalize provider shapes in one pass: 'name' from name/label/labelName, 'confidence'
+    as a float from confidence/score/confidenceScore, dropping detections below
+    min_confidence (default DETECTION_MIN_CONFIDENCE). Items are updated in place, so pass
+    freshly decoded results.
+    """
+    if not isinstance(raw, list):
+        return raw or []
+    threshold = MIN_CONFIDENCE if min_confidence is None else min_confidence
+    detections = []
+    for item in raw:
+        if not isinstance(item, dict):
+            continue
+        conf = item.get('confidence')
+        if conf is None:
+            conf = item.get('score') or item.get('confidenceScore') or 0.0
+        if type(conf) is not float:
+            try:
+                conf = float(conf)
+            except (TypeError, ValueError):
+                conf = 0.0
+        if conf < threshold:
+            continue
+        item['name'] = item.get('name') or item.get('label') or item.get('labelName') or ''
+        item['confidence'] = conf
+        detections.append(item)
+    return detections
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher(config=None) -> KeywordMatcher:
+    """Process-wide matcher, compiled on first use from env/config (see fruit_keywords)."""
+    global _matcher
+    matcher = _matcher
+    if matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = KeywordMatcher(fruit_keywords(config))
+            matcher = _matcher
+    return matcher
+
+
+def set_keywords(keywords) -> KeywordMatcher:
+    """Replace the keyword vocabulary (e.g. from /api/settings); recompiles the matcher."""
+    global _matcher
+    matcher = KeywordMatcher(parse_keywords(keywords))
+    with _matcher_lock:
+        _matcher = matcher
+    return matcher
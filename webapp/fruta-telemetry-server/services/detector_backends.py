@@ -0,0 +1,276 @@
+import os
+import io
+import ast
+import queue
+import time
+import threading
+import logging
+from concurrent.futures import Future
+from typing import List, Optional, Union
+
+from services import detection
+
+try:
+    import numpy as np
+    import onnxruntime as ort
+    from PIL import Image
+except ImportError:  # optional: pip install -r requirements-detector.txt
+    np = ort = Image = None
+
+logger = logging.getLogger(__name__)
+
+# 'api_ninjas' (hosted, default) or 'onnx' (local CPU model)
+BACKEND = os.getenv("DETECTOR_BACKEND", "api_ninjas").lower()
+MODEL_PATH = os.getenv("DETECTOR_MODEL_PATH") or None
+# one label per line; defaults to the class names stored in the model's metadata
+LABELS_PATH = os.getenv("DETECTOR_LABELS") or None
+INPUT_SIZE = int(os.getenv("DETECTOR_INPUT_SIZE", "640"))
+SCORE_THRESHOLD = float(os.getenv("DETECTOR_SCORE_THRESHOLD", "0.25"))
+IOU_THRESHOLD = float(os.getenv("DETECTOR_IOU_THRESHOLD", "0.45"))
+# images per inference call, and how long the first queued image waits for company
+BATCH_SIZE = int(os.getenv("DETECTOR_BATCH_SIZE", "8"))
+BATCH_WAIT_MS = int(os.getenv("DETECTOR_BATCH_WAIT_MS", "10"))
+# inference threads (0 = one per core)
+THREADS = int(os.getenv("DETECTOR_THREADS", "0"))
+
+
+class DetectorBackend:
+    """
+    Object detector used by every analyze path. detect() returns detections in the
+    normalize_detections shape ({'name', 'label', 'confidence', 'bounding_box'}) and raises
+    DetectionError on failure. rate_limited tells callers to pace calls to an upstream quota.
+    """
+
+    name = "base"
+    rate_limited = False
+
+    def detect(self, img_bytes: bytes, content_type: str, config=None) -> List[dict]:
+        raise NotImplementedError
+
+    def cache_key(self, key: str) -> str:
+        """Detection cache key for this backend (results of different models never mix)."""
+        return f"{self.name}:{key}"
+
+    def close(self):
+        pass
+
+
+class ApiNinjasBackend(DetectorBackend):
+    """Hosted API Ninjas object detection (one HTTP call per image)."""
+
+    name = "api_ninjas"
+    rate_limited = True
+
+    def detect(self, img_bytes, content_type, config=None):
+        return detection.call_detector(img_bytes, content_type, detection.api_key(config))
+
+    def cache_key(self, key):
+        # keys predate pluggable backends: keep existing cache entries valid
+        return key
+
+
+class BatchingDetector(DetectorBackend):
+    """
+    Runs a model's detect_many over images queued by concurrent callers: one inference
+    thread takes up to batch_size images (waiting at most batch_wait_ms after the first)
+    per call, so requests arriving together share a single forward pass.
+    """
+
+    def __init__(self, model, batch_size=None, batch_wait_ms=None):
+        self.model = model
+        self.name = model.name
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+        self.batch_wait = max(0, BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"detector-{self.name}", daemon=True)
+        self._thread.start()
+
+    def detect(self, img_bytes, content_type, config=None):
+        future = Future()
+        self._queue.put((img_bytes, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(5.0)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                results = self.model.detect_many([img for img, _ in batch])
+            except Exception as e:
+                logger.exception("detector: inference failed for a batch of %d", len(batch))
+                error = e if isinstance(e, detection.DetectionError) else \
+                    detection.DetectionError(502, {'error': f'local object detection failed: {e}'})
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), detections in zip(batch, results):
+                # an image that could not be decoded fails only its own caller
+                if isinstance(detections, Exception):
+                    future.set_exception(detections)
+                else:
+                    future.set_result(detections)
+
+
+class OnnxModel:
+    """
+    YOLO-style ONNX detector on ONNX Runtime (CPU): letterboxed RGB input of
+    input_size x input_size, output (batch, 4 + classes, anchors) with center/size boxes.
+    Models exported with a fixed batch of 1 are run image by image.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path, labels=None, input_size=None, score_threshold=None,
+                 iou_threshold=None, threads=None):
+        if ort is None:
+            raise RuntimeError("onnx detector needs numpy, onnxruntime and Pillow (requirements-detector.txt)")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = THREADS if threads is None else threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        self.input_size = input_size or INPUT_SIZE
+        self.score_threshold = SCORE_THRESHOLD if score_threshold is None else score_threshold
+        self.iou_threshold = IOU_THRESHOLD if iou_threshold is None else iou_threshold
+        self.labels = labels or self._metadata_labels()
+        self.name = "onnx-" + os.path.splitext(os.path.basename(model_path))[0]
+
+    def _metadata_labels(self):
+        names = self.session.get_modelmeta().custom_metadata_map.get("names")
+        if not names:
+            return []
+        try:
+            parsed = ast.literal_eval(names)
+        except (ValueError, SyntaxError):
+            return []
+        if isinstance(parsed, dict):
+            return [parsed[k] for k in sorted(parsed)]
+        return list(parsed)
+
+    def _prepare(self, img_bytes):
+        """Letterboxed CHW float array plus (scale, pad_x, pad_y, width, height) to map boxes back."""
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            img = img.convert("RGB")
+            width, height = img.size
+            scale = min(self.input_size / width, self.input_size / height)
+            resized = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+        canvas = Image.new("RGB", (self.input_size, self.input_size), (114, 114, 114))
+        pad_x, pad_y = (self.input_size - resized.width) // 2, (self.input_size - resized.height) // 2
+        canvas.paste(resized, (pad_x, pad_y))
+        array = np.asarray(canvas, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return array, (scale, pad_x, pad_y, width, height)
+
+    def detect_many(self, images: List[bytes]) -> List[Union[List[dict], Exception]]:
+        """
+        Detections per image, in order. An image that cannot be decoded gets a DetectionError
+        in its slot instead and the rest of the batch is still run.
+        """
+        results, prepared = [], []
+        for img_bytes in images:
+            try:
+                prepared.append(self._prepare(img_bytes))
+                results.append(None)
+            except Exception as e:
+                results.append(detection.DetectionError(502, {'error': f'could not decode image: {e}'}))
+        if prepared:
+            arrays = np.stack([array for array, _ in prepared])
+            if self.dynamic_batch:
+                outputs = self.session.run(None, {self.input_name: arrays})[0]
+            else:
+                outputs = np.concatenate([self.session.run(None, {self.input_name: a[None]})[0] for a in arrays])
+            decoded = iter([self._decode(output, geometry) for output, (_, geometry) in zip(outputs, prepared)])
+            results = [next(decoded) if r is None else r for r in results]
+        return results
+
+    def _decode(self, output, geometry):
+        scale, pad_x, pad_y, width, height = geometry
+        preds = output.T  # (anchors, 4 + classes)
+        scores = preds[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidence = scores[np.arange(len(scores)), classes]
+        keep = confidence >= self.score_threshold
+        if not keep.any():
+            return []
+        boxes, classes, confidence = preds[keep, :4], classes[keep], confidence[keep]
+        xy = (boxes[:, :2] - boxes[:, 2:] / 2 - (pad_x, pad_y)) / scale
+        wh = boxes[:, 2:] / scale
+        corners = np.concatenate([xy, xy + wh], axis=1)
+        corners[:, [0, 2]] = corners[:, [0, 2]].clip(0, width)
+        corners[:, [1, 3]] = corners[:, [1, 3]].clip(0, height)
+        detections = []
+        for i in _nms(corners, confidence, classes, self.iou_threshold):
+            label = self.labels[classes[i]] if classes[i] < len(self.labels) else str(int(classes[i]))
+            x1, y1, x2, y2 = (int(round(v)) for v in corners[i])
+            detections.append({'name': label, 'label': label, 'confidence': float(confidence[i]),
+                               'bounding_box': {'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2}})
+        return detections
+
+
+def _nms(boxes, scores, classes, iou_threshold):
+    """Indices kept by per-class non-maximum suppression, highest score first."""
+    # offset boxes per class so one pass never suppresses across classes
+    offset = boxes + (classes * (boxes.max() + 1))[:, None]
+    areas = (offset[:, 2] - offset[:, 0]) * (offset[:, 3] - offset[:, 1])
+    order = scores.argsort()[::-1]
+    kept = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        kept.append(int(i))
+        x1 = np.maximum(offset[i, 0], offset[rest, 0])
+        y1 = np.maximum(offset[i, 1], offset[rest, 1])
+        x2 = np.minimum(offset[i, 2], offset[rest, 2])
+        y2 = np.minimum(offset[i, 3], offset[rest, 3])
+        inter = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return kept
+
+
+def _read_labels(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def create_backend(name: Optional[str] = None) -> DetectorBackend:
+    name = (name or BACKEND).lower()
+    if name in ("api_ninjas", "apininjas", "api-ninjas"):
+        return ApiNinjasBackend()
+    if name == "onnx":
+        if not MODEL_PATH:
+            raise RuntimeError("DETECTOR_BACKEND=onnx needs DETECTOR_MODEL_PATH")
+        labels = _read_labels(LABELS_PATH) if LABELS_PATH else None
+        return BatchingDetector(OnnxModel(MODEL_PATH, labels=labels))
+    raise RuntimeError(f"unknown DETECTOR_BACKEND: {name}")
+
+
+_backend = None
+_backend_pid = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> DetectorBackend:
+    """Process-wide backend, loaded on first use (and again in a forked worker process)."""
+    global _backend, _backend_pid
+    with _backend_lock:
+        if _backend is None or _backend_pid != os.getpid():
+            _backend = create_backend()
+            _backend_pid = os.getpid()
+        return _backend
@@ -0,0 +1,243 @@
+import os
+import json
+import asyncio
+import time
+import queue
+import threading
+import logging
+
+from services import blob as sb
+from services import telemetry_store
+
+logger = logging.getLogger(__name__)
+
+POLL_SEC = float(os.getenv("EVENTS_POLL_SEC", "5"))
+KEEPALIVE_SEC = float(os.getenv("EVENTS_KEEPALIVE_SEC", "10"))
+QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+# larger changes are announced as a plain list refresh instead of embedding items
+MAX_EVENT_ITEMS = int(os.getenv("EVENTS_MAX_ITEMS", "50"))
+
+
+def _refresh_event(count=None):
+    ev = {"type": "list", "refresh": True, "timestamp": int(time.time())}
+    if count is not None:
+        ev["count"] = count
+    return ev
+
+
+class Subscription:
+    """Bounded per-client event queue. On overflow the backlog is replaced by one refresh event."""
+
+    def __init__(self, maxsize=None):
+        self._queue = queue.Queue(maxsize=maxsize or QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # slow client: drop what it has not read yet and tell it to resync
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._queue.put_nowait(_refresh_event())
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        """Next event, or None if nothing arrives within timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """
+    Subscription consumed from an asyncio event loop (ASGI mode). The watcher thread
+    hands events to the loop thread-safely, so a waiting client holds no thread.
+    """
+
+    def __init__(self, loop, maxsize=None):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=maxsize or QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # loop already closed: the client is gone
+            pass
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(_refresh_event())
+
+    async def get(self, timeout=None):
+        """Next event, or None if nothing arrives within timeout."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChangeHub:
+    """
+    Fan-out of change events to all /events subscribers.
+
+    A single watcher thread polls the shared blob listing index and the telemetry
+    store and publishes what changed, so server cost does not grow with the number
+    of connected clients. The watcher only polls while someone is subscribed.
+    """
+
+    def __init__(self, container_url=None, sas_token=None, poll_sec=None):
+        self.container_url = container_url
+        self.sas_token = sas_token
+        self.poll_sec = POLL_SEC if poll_sec is None else poll_sec
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._known = None  # name -> (etag, lastModified) of the last listing seen
+        self._last_message_id = None
+        self._telemetry_lock = threading.Lock()
+        self._blobs_lock = threading.Lock()
+
+    # -- subscribers -------------------------------------------------------
+
+    def subscribe(self, maxsize=None, sub=None):
+        """Register a subscriber (a new Subscription unless one is passed in) and return it."""
+        sub = sub or Subscription(maxsize)
+        # every new client starts by loading the current list
+        sub.put(_refresh_event(len(self._known) if self._known is not None else None))
+        with self._lock:
+            self._subs.add(sub)
+            self._ensure_thread()
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subs)
+
+    def publish(self, event):
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub.put(event)
+
+    # -- watcher -----------------------------------------------------------
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="events-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self.subscriber_count():
+                try:
+                    self.poll_once()
+                except Exception:
+                    logger.exception("events: watcher poll failed")
+                self._wake.wait(self.poll_sec)
+            else:
+                # idle until a client subscribes
+                self._wake.wait()
+            self._wake.clear()
+
+    def poll_once(self):
+        """Check blob listing and telemetry store once and publish any changes."""
+        self._poll_blobs()
+        self._poll_telemetry()
+
+    def _poll_blobs(self):
+        items = sb.list_blobs(container_url=self.container_url, sas_token=self.sas_token, max_age=self.poll_sec)
+        current = {it.get('name'): (it.get('etag'), it.get('lastModified')) for it in items}
+        with self._blobs_lock:
+            previous, self._known = self._known, current
+        if previous is None:
+            return
+        changed = [it for it in items if previous.get(it.get('name')) != current[it.get('name')]]
+        removed = len(previous.keys() - current.keys())
+        if not changed and not removed:
+            return
+        logger.info("events: %d new/changed blobs, %d removed", len(changed), removed)
+        if removed or len(changed) > MAX_EVENT_ITEMS:
+            self.publish(_refresh_event(len(items)))
+        else:
+            self.publish({"type": "blobs", "items": changed, "count": len(items), "timestamp": int(time.time())})
+
+    def notify_blobs(self, items):
+        """
+        Publish blobs written by this process (e.g. device uploads) now; they are remembered
+        as known so the next listing poll does not announce them again.
+        """
+        with self._blobs_lock:
+            if self._known is not None:
+                for it in items:
+                    self._known[it.get('name')] = (it.get('etag'), it.get('lastModified'))
+            count = len(self._known) if self._known is not None else None
+        self.publish({"type": "blobs", "items": list(items), "count": count, "timestamp": int(time.time())})
+
+    def notify_telemetry(self):
+        """
+        Publish newly committed telemetry now instead of at the next poll (called by in-process
+        producers such as the MQTT subscriber). Cheap when nobody is subscribed.
+        """
+        if self.subscriber_count():
+            self._poll_telemetry()
+
+    def _poll_telemetry(self):
+        # the watcher and notifying producers may race: announce each row once
+        with self._telemetry_lock:
+            latest = telemetry_store.latest_id()
+            previous, self._last_message_id = self._last_message_id, latest
+            if previous is None or latest <= previous:
+                return
+            # page forward so bursts larger than one event (bulk ingest, MQTT batches) are announced whole
+            while previous < latest:
+                rows, _ = telemetry_store.query_messages(limit=MAX_EVENT_ITEMS, after_id=previous,
+                                                         include_payload=False)
+                if not rows:
+                    break
+                previous = max(r['id'] for r in rows)
+                self.publish({"type": "telemetry", "rows": rows, "latest_id": latest, "timestamp": int(time.time())})
+            self._last_message_id = max(latest, previous)
+
+
+def format_sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+_hub_lock = threading.Lock()
+
+
+def get_hub(app):
+    """Return the app's ChangeHub, creating it from app config on first use."""
+    hub = app.extensions.get('fruta_events')
+    if hub is None:
+        with _hub_lock:
+            hub = app.extensions.get('fruta_events')
+            if hub is None:
+                hub = ChangeHub(
+                    container_url=app.config.get('AZURE_CONTAINER_URL') or app.config.get('CONTAINER_URL'),
+                    sas_token=app.config.get('SAS_TOKEN'))
+                app.extensions['fruta_events'] = hub
+    return hub
@@ -0,0 +1,154 @@
+import os
+import time
+import random
+import threading
+import logging
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared outbound HTTP layer: pooled keep-alive sessions per host, per-endpoint timeouts
+# and jittered exponential backoff that honors Retry-After.
+
+logger = logging.getLogger(__name__)
+
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+# a single wait longer than this is not slept through: the response is returned to the caller
+BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "10"))
+
+# (connect, read) seconds per endpoint; override with HTTP_TIMEOUT_<NAME>=<read seconds>
+TIMEOUTS = {
+    'default': (5, 30),
+    'blob_list': (5, 15),
+    'blob_head': (5, 10),
+    'blob_get': (5, 30),
+    'blob_put': (5, 60),
+    'image': (5, 20),
+    'detect': (5, 30),
+}
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# methods safe to resend after a connection error or 5xx; others only retry on 429
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def timeout(endpoint):
+    connect, read = TIMEOUTS.get(endpoint) or TIMEOUTS['default']
+    override = os.getenv(f"HTTP_TIMEOUT_{endpoint.upper()}")
+    if override:
+        try:
+            read = float(override)
+        except ValueError:
+            pass
+    return connect, read
+
+
+def get_session(url):
+    """Keep-alive session for url's scheme+host, shared by all threads."""
+    u = urlparse(url)
+    key = (u.scheme, u.netloc)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[key] = session
+    return session
+
+
+def close_all():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for s in sessions:
+        s.close()
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt, retry_after=None, base=None, cap=None):
+    """
+    Delay before retry number `attempt` (1-based): Retry-After when the server sent one,
+    else full-jitter exponential backoff, capped at `cap` seconds.
+    """
+    base = BACKOFF_BASE if base is None else base
+    cap = BACKOFF_MAX if cap is None else cap
+    server = parse_retry_after(retry_after)
+    if server is not None:
+        return server
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def request(method, url, endpoint='default', retries=None, **kwargs):
+    """
+    Send a request over the pooled session for url's host. Retries connection errors and
+    5xx (idempotent methods only) and 429 (any method) with backoff. When the server asks
+    for a longer wait than HTTP_BACKOFF_MAX, or retries run out, the last response is
+    returned as-is so the caller can surface it; connection errors are re-raised.
+    """
+    method = method.upper()
+    retries = MAX_RETRIES if retries is None else retries
+    kwargs.setdefault('timeout', timeout(endpoint))
+    session = get_session(url)
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            resp = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt > retries or method not in IDEMPOTENT_METHODS:
+                raise
+            delay = backoff_delay(attempt)
+            logger.info("http: %s %s failed (attempt %d), retrying in %.2fs", method, endpoint, attempt, delay)
+            time.sleep(delay)
+            continue
+        if resp.status_code not in RETRY_STATUSES or attempt > retries:
+            return resp
+        if resp.status_code != 429 and method not in IDEMPOTENT_METHODS:
+            return resp
+        delay = backoff_delay(attempt, resp.headers.get('Retry-After'))
+        if delay > BACKOFF_MAX:
+            return resp
+        logger.info("http: %s %s returned %d (attempt %d), retrying in %.2fs",
+                    method, endpoint, resp.status_code, attempt, delay)
+        resp.close()
+        time.sleep(delay)
+
+
+def get(url, endpoint='default', **kwargs):
+    return request('GET', url, endpoint=endpoint, **kwargs)
+
+
+def head(url, endpoint='default', **kwargs):
+    return request('HEAD', url, endpoint=endpoint, **kwargs)
+
+
+def post(url, endpoint='default', **kwargs):
+    return request('POST', url, endpoint=endpoint, **kwargs)
+
+
+def put(url, endpoint='default', **kwargs):
+    return request('PUT', url, endpoint=endpoint, **kwargs)
@@ -0,0 +1,177 @@
+import os
+import io
+import hashlib
+import mimetypes
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Callable
+
+from services import detection
+from services import telemetry_store
+
+try:
+    from PIL import Image
+except ImportError:  # optional: pip install -r requirements-images.txt
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# defaults to a directory next to the telemetry DB
+CACHE_DIR = os.getenv("IMAGE_CACHE_DIR") or None
+MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+THUMB_SIZES = (96, 160, 320)
+DEFAULT_THUMB_SIZE = 160
+THUMB_QUALITY = int(os.getenv("IMAGE_THUMB_QUALITY", "75"))
+
+
+def key_for_image(blob_name: str, etag: str) -> str:
+    return f"image:{blob_name}:{etag.strip(chr(34))}"
+
+
+def key_for_thumbnail(blob_name: str, etag: str, size: int) -> str:
+    return f"thumb{int(size)}:{blob_name}:{etag.strip(chr(34))}"
+
+
+class ImageCache:
+    """
+    On-disk byte cache (original images and thumbnails) keyed by blob name + ETag, so a
+    key never goes stale: a new upload gets a new ETag and the old entry ages out.
+    Total size is held under max_bytes by evicting least recently used files.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or CACHE_DIR or os.path.join(os.path.dirname(telemetry_store.DB_PATH), "image-cache")
+        self.max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, least recently used first
+        self._size = 0
+        self._inflight = {}
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU order from files left by a previous run (oldest access first)."""
+        found = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".bin"):
+                st = entry.stat()
+                found.append((st.st_atime, entry.name, st.st_size))
+            elif entry.is_file() and entry.name.endswith(".tmp"):
+                # interrupted write
+                os.unlink(entry.path)
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+        self._evict()
+
+    def _file(self, key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest() + ".bin"
+
+    def get(self, key: str) -> Optional[bytes]:
+        name = self._file(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            with open(os.path.join(self.cache_dir, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        name = self._file(key)
+        path = os.path.join(self.cache_dir, name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        # caller holds the lock (or is the constructor)
+        while self._size > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.unlink(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], bytes]) -> bytes:
+        """Cached bytes for key, or fetch() them once (concurrent callers share the fetch)."""
+        data = self.get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if not leader:
+            event.wait()
+            data = self.get(key)
+            if data is not None:
+                return data
+            # leader failed (or the entry was too large to keep): fetch ourselves
+            return fetch()
+        try:
+            data = fetch()
+            try:
+                self.put(key, data)
+            except OSError:
+                logger.exception("image cache: failed to store %s", key)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+
+def make_thumbnail(data: bytes, size: int) -> Optional[bytes]:
+    """JPEG preview fitting in size x size, or None when Pillow is not installed."""
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (size, size))  # JPEG: decode at reduced scale, much cheaper
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=THUMB_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def fetch_image(blob_url, blob_name=None, etag=None):
+    """
+    detection.fetch_image through the cache: returns (bytes, content_type, etag). Only
+    requests whose ETag is known up front can be served from the cache.
+    """
+    if not (blob_name and etag):
+        return detection.fetch_image(blob_url, blob_name)
+    data = get_cache().get_or_fetch(key_for_image(blob_name, etag),
+                                    lambda: detection.fetch_image(blob_url, blob_name)[0])
+    return data, mimetypes.guess_type(blob_name)[0] or "image/jpeg", etag
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ImageCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
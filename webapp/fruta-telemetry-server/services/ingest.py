@@ -0,0 +1,189 @@
+import os
+import time
+import threading
+import logging
+
+from services import blob as sb
+from services import telemetry_store
+from services.capture_decode import ChunkStream, iter_decoded
+
+logger = logging.getLogger(__name__)
+
+# capture blobs may live in their own container; defaults to the app's container
+CONTAINER_URL = os.getenv("INGEST_CONTAINER_URL") or None
+SAS_TOKEN = os.getenv("INGEST_SAS_TOKEN") or None
+PREFIX = os.getenv("INGEST_PREFIX", "")
+INTERVAL_SEC = float(os.getenv("INGEST_INTERVAL_SEC", "20"))
+# records committed per transaction (each commit also moves the blob's checkpoint)
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+SKIP_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class CaptureIngestor:
+    """
+    Background ingestion of IoT Hub capture / routing blobs straight into the telemetry store.
+
+    Each poll lists the container through the shared listing index, and for every blob whose
+    ETag differs from its checkpoint streams the file through the capture decoder and commits
+    decoded payloads with insert_many, in batches. Every batch commits the blob's checkpoint
+    (records consumed so far) in the same transaction, so a restart or a capture file that
+    grew since the last poll resumes exactly where ingestion stopped, without duplicates.
+    """
+
+    def __init__(self, container_url=None, sas_token=None, prefix=None, interval=None, batch_size=None):
+        self.container_url = container_url
+        self.sas_token = sas_token
+        self.prefix = PREFIX if prefix is None else prefix
+        self.interval = INTERVAL_SEC if interval is None else interval
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'polls': 0, 'blobs': 0, 'records': 0, 'rejected': 0, 'errors': 0,
+                      'last_poll': None, 'last_error': None, 'current_blob': None}
+
+    @property
+    def source(self):
+        """Checkpoint namespace: one per container + prefix."""
+        svc = sb.get_service(container_url=self.container_url, sas_token=self.sas_token)
+        return f"{svc.container_url or svc._container_name()}|{self.prefix}"
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="capture-ingest", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=10.0):
+        """Ask the worker to stop after the current batch; returns True once it has exited."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return dict(self.stats, running=self.running(), source=self.source, interval=self.interval)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                logger.exception("ingest: poll failed")
+            self._stop.wait(self.interval)
+
+    # -- ingestion ---------------------------------------------------------
+
+    def poll_once(self):
+        """Ingest every new or grown blob once, oldest first. Returns the number of records written."""
+        svc = sb.get_service(container_url=self.container_url, sas_token=self.sas_token)
+        if not svc._sdk and not svc.container_url:
+            return 0
+        source = self.source
+        checkpoints = telemetry_store.get_ingest_checkpoints(source)
+        items = sb.get_listing_index(svc, prefix=self.prefix or None).items(svc, max_age=self.interval)
+        written = 0
+        # the index is newest first; ingest in arrival order
+        for it in reversed(items):
+            if self._stop.is_set():
+                break
+            name = it.get('name')
+            if not name or name.lower().endswith(SKIP_EXTENSIONS):
+                continue
+            etag, done = checkpoints.get(name, (None, 0))
+            if etag is not None and etag == it.get('etag'):
+                continue
+            self.stats['current_blob'] = name
+            try:
+                written += self.ingest_blob(svc, source, name, skip=done)
+                self.stats['blobs'] += 1
+            except Exception as e:
+                # checkpoint stays at the last committed batch; retried next poll
+                self.stats['errors'] += 1
+                self.stats['last_error'] = f"{name}: {e}"
+                logger.exception("ingest: failed on %s", name)
+            finally:
+                self.stats['current_blob'] = None
+        self.stats['polls'] += 1
+        self.stats['last_poll'] = int(time.time())
+        return written
+
+    def ingest_blob(self, svc, source, name, skip=0):
+        """
+        Stream one blob into the store, skipping the first `skip` records (already ingested).
+        Returns the number of rows written.
+        """
+        stream = svc.open_blob(name)
+        if stream is None:
+            return 0
+        etag = stream.headers.get('ETag')
+        written, consumed, batch = 0, skip, []
+        try:
+            for index, envelope, decoded, error in iter_decoded(ChunkStream(stream)):
+                if index < skip:
+                    continue
+                consumed = index + 1
+                payload = _payload(envelope, decoded)
+                if payload is None:
+                    self.stats['rejected'] += 1
+                else:
+                    batch.append(payload)
+                if len(batch) >= self.batch_size:
+                    # partial progress is saved without an ETag so the blob is revisited
+                    written += self._commit(source, name, None, batch, consumed)
+                    batch = []
+                    if self._stop.is_set():
+                        return written
+            # final commit also records blobs that held nothing ingestible
+            written += self._commit(source, name, etag, batch, consumed)
+        finally:
+            stream.close()
+        return written
+
+    def _commit(self, source, name, etag, batch, consumed):
+        checkpoint = (telemetry_store.CHECKPOINT_SQL, (source, name, etag, consumed))
+        telemetry_store.insert_many(batch, extra=[checkpoint])
+        self.stats['records'] += len(batch)
+        return len(batch)
+
+
+def _payload(envelope, decoded):
+    """Telemetry payload for one decoded envelope (None if the body is not a JSON object)."""
+    if not decoded or not isinstance(decoded.get('payload'), dict):
+        return None
+    payload = decoded['payload']
+    if not payload.get('deviceId') and isinstance(envelope, dict):
+        # IoT Hub records the sending device in the envelope's system properties
+        system = envelope.get('SystemProperties') or {}
+        device = system.get('connectionDeviceId') or system.get('iothub-connection-device-id')
+        if device:
+            payload = dict(payload, deviceId=device)
+    return payload
+
+
+_ingestor_lock = threading.Lock()
+
+
+def get_ingestor(app):
+    """Return the app's CaptureIngestor, creating it from app config on first use."""
+    with _ingestor_lock:
+        ingestor = app.extensions.get('fruta_ingest')
+        if ingestor is None:
+            ingestor = CaptureIngestor(
+                container_url=CONTAINER_URL or app.config.get('AZURE_CONTAINER_URL') or app.config.get('CONTAINER_URL'),
+                sas_token=SAS_TOKEN or app.config.get('SAS_TOKEN'))
+            app.extensions['fruta_ingest'] = ingestor
+        return ingestor
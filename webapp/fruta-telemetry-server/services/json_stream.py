@@ -0,0 +1,186 @@
+import codecs
+import json
+from typing import Iterator, Tuple, Any, Optional
+
+CHUNK_SIZE = 64 * 1024
+
+_WS = ' \t\r\n'
+
+
+# largest record a multi-line NDJSON parse (or an array element) may span before giving up on it
+MAX_RECORD_CHARS = 16 * 1024 * 1024
+# a decode error this close to the end of the buffer may be a token cut at a chunk boundary
+# (longest JSON literal / partial escape)
+_CUT_TOKEN_CHARS = 8
+
+
+def iter_json_records(stream, chunk_size: int = CHUNK_SIZE, multiline: bool = False) -> Iterator[Tuple[int, Any, Optional[str]]]:
+    """
+    Incrementally parse a JSON array or NDJSON body from a binary file-like `stream`.
+
+    Yields (index, obj, error) per record; obj is None when error is set. The format is
+    detected from the first non-whitespace byte ('[' means a JSON array). Only one chunk
+    plus the record being decoded is held in memory. A malformed NDJSON line is reported
+    and skipped; a malformed array element ends the parse (the array cannot be resynced).
+    With multiline=True, NDJSON lines that do not parse on their own are joined with the
+    following lines, so pretty-printed objects (one or several) are accepted as well.
+    """
+    reader = _TextReader(stream, chunk_size)
+    first = reader.peek_non_ws()
+    if first is None:
+        return
+    if first == '[':
+        yield from _iter_array(reader)
+    else:
+        yield from _iter_lines(reader, multiline)
+
+
+class _TextReader:
+    """Buffered incremental UTF-8 decoder over a binary stream."""
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Append the next chunk to the buffer; False at end of stream."""
+        if self.eof:
+            return False
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self.decoder.decode(b'', final=True)
+            self.pos = 0
+            return False
+        # drop consumed text so the buffer does not grow with the body
+        self.buf = self.buf[self.pos:] + self.decoder.decode(data)
+        self.pos = 0
+        return True
+
+    def grow(self) -> bool:
+        """
+        Read until the unconsumed text has doubled (at least one chunk), so retrying a
+        decode from the same position costs O(total size) overall; False at end of stream.
+        """
+        target = len(self.buf) - self.pos + max(self.chunk_size, len(self.buf) - self.pos)
+        grew = False
+        while len(self.buf) - self.pos < target and self.fill():
+            grew = True
+        return grew
+
+    def skip_ws(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def peek_non_ws(self) -> Optional[str]:
+        self.skip_ws()
+        return self.buf[self.pos] if self.pos < len(self.buf) else None
+
+
+def _iter_lines(reader: _TextReader, multiline: bool = False):
+    index = 0
+    partial = ''
+    while True:
+        nl = reader.buf.find('\n', reader.pos)
+        while nl == -1 and reader.fill():
+            nl = reader.buf.find('\n', reader.pos)
+        if nl == -1:
+            line = reader.buf[reader.pos:]
+            reader.pos = len(reader.buf)
+        else:
+            line = reader.buf[reader.pos:nl]
+            reader.pos = nl + 1
+        line = line.strip()
+        if line and partial:
+            joined = partial + '\n' + line
+            try:
+                obj = json.loads(joined)
+            except ValueError as e:
+                try:
+                    # the current line is an object of its own: what came before was garbage
+                    obj = json.loads(line) if line.startswith('{') else None
+                    if not isinstance(obj, dict):
+                        raise ValueError
+                except ValueError:
+                    if nl != -1 and len(joined) < MAX_RECORD_CHARS:
+                        partial = joined
+                        continue
+                    yield index, None, f'invalid json: {e}'
+                else:
+                    yield index, None, 'invalid json: incomplete record'
+                    index += 1
+                    yield index, obj, None
+            else:
+                yield index, obj, None
+            partial = ''
+            index += 1
+        elif line:
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                if multiline and nl != -1:
+                    # may be the first line of a multi-line value: retry with the next line
+                    partial = line
+                    continue
+                yield index, None, f'invalid json: {e}'
+            else:
+                yield index, obj, None
+            index += 1
+        if nl == -1:
+            if partial:
+                yield index, None, 'invalid json: incomplete record'
+            return
+
+
+def _iter_array(reader: _TextReader):
+    decoder = json.JSONDecoder()
+    reader.pos += 1  # consume '['
+    index = 0
+    expect_value = True
+    while True:
+        c = reader.peek_non_ws()
+        if c is None:
+            yield index, None, 'unterminated array'
+            return
+        if c == ']':
+            reader.pos += 1
+            return
+        if c == ',' and not expect_value:
+            reader.pos += 1
+            expect_value = True
+            continue
+        if not expect_value:
+            yield index, None, "expected ',' or ']'"
+            return
+        while True:
+            try:
+                obj, end = decoder.raw_decode(reader.buf, reader.pos)
+            except ValueError as e:
+                # the value may be cut at the end of the buffer: read more and retry. An error
+                # inside the buffer is final, so a bad element never buffers the rest of the body.
+                if _maybe_truncated(e, reader) and len(reader.buf) - reader.pos < MAX_RECORD_CHARS and reader.grow():
+                    continue
+                yield index, None, f'invalid json: {e}'
+                return
+            if end == len(reader.buf) and reader.fill():
+                # a trailing number could continue in the next chunk
+                continue
+            break
+        reader.pos = end
+        yield index, obj, None
+        index += 1
+        expect_value = False
+
+
+def _maybe_truncated(error, reader: _TextReader) -> bool:
+    if not isinstance(error, json.JSONDecodeError):
+        return True
+    # an open string reports its start position, wherever the cut happened
+    return error.msg.startswith('Unterminated string') or error.pos >= len(reader.buf) - _CUT_TOKEN_CHARS
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import queue
+import threading
+import logging
+
+from services import telemetry_store
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # optional: pip install -r requirements-mqtt.txt
+    mqtt = None
+
+logger = logging.getLogger(__name__)
+
+# broker connection; the subscriber is only started when MQTT_HOST is set
+HOST = os.getenv("MQTT_HOST") or None
+PORT = int(os.getenv("MQTT_PORT", "1883"))
+USERNAME = os.getenv("MQTT_USERNAME") or None
+PASSWORD = os.getenv("MQTT_PASSWORD") or None
+TLS = os.getenv("MQTT_TLS", "0").lower() in ("1", "true", "yes")
+CLIENT_ID = os.getenv("MQTT_CLIENT_ID", "fruta-telemetry-server")
+# comma-separated; the firmware publishes to devices/<device id>/messages/events/<properties>
+TOPICS = os.getenv("MQTT_TOPICS", "devices/+/messages/events/#")
+QOS = int(os.getenv("MQTT_QOS", "1"))
+KEEPALIVE_SEC = int(os.getenv("MQTT_KEEPALIVE_SEC", "30"))
+# rows per transaction, and how long the first queued row waits for company
+BATCH_SIZE = int(os.getenv("MQTT_BATCH_SIZE", "200"))
+FLUSH_MS = int(os.getenv("MQTT_FLUSH_MS", "100"))
+# backlog of decoded messages; when full, delivery blocks up to MQTT_BLOCK_SEC, then drops
+QUEUE_SIZE = int(os.getenv("MQTT_QUEUE_SIZE", "10000"))
+BLOCK_SEC = float(os.getenv("MQTT_BLOCK_SEC", "5"))
+# a failed commit is retried (the batch kept) after RETRY_SEC, doubling up to RETRY_MAX_SEC
+RETRY_SEC = float(os.getenv("MQTT_RETRY_SEC", "0.5"))
+RETRY_MAX_SEC = float(os.getenv("MQTT_RETRY_MAX_SEC", "30"))
+
+
+def device_from_topic(topic):
+    """Device id of an IoT Hub style topic (devices/<id>/messages/events/...), else None."""
+    parts = topic.split("/")
+    if len(parts) > 2 and parts[0] == "devices" and parts[1]:
+        return parts[1]
+    return None
+
+
+def decode_message(topic, payload: bytes):
+    """Telemetry payloads (dicts) carried by one MQTT message: a JSON object, array or JSON lines."""
+    text = payload.decode("utf-8", errors="replace").strip()
+    if not text:
+        return []
+    try:
+        parsed = json.loads(text)
+        records = parsed if isinstance(parsed, list) else [parsed]
+    except ValueError:
+        records = []
+        for line in text.splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    device = device_from_topic(topic)
+    payloads = []
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        if device and not record.get("deviceId"):
+            record["deviceId"] = device
+        payloads.append(record)
+    return payloads
+
+
+class MqttIngestor:
+    """
+    Subscribes to device topics on an MQTT broker and streams telemetry into the store.
+
+    The paho network thread only decodes messages onto a bounded queue; a writer thread
+    commits them with insert_many in batches of up to batch_size (waiting at most flush_ms
+    for a batch to fill) and then tells the ChangeHub, so /events clients see new rows
+    right away. A failed commit keeps its batch and is retried with backoff until it
+    succeeds or the ingestor stops. When the writer falls behind (or is retrying), message
+    delivery blocks, which holds back QoS 1 acknowledgements and so throttles the broker.
+    A message whose records are not all queued within block_sec has the rest dropped (and
+    counted) so the connection's keepalive is not starved.
+    """
+
+    def __init__(self, hub=None, host=None, port=None, topics=None, username=None, password=None,
+                 tls=None, client_id=None, qos=None, batch_size=None, flush_ms=None, queue_size=None,
+                 block_sec=None):
+        self.hub = hub
+        self.host = host or HOST
+        self.port = port or PORT
+        topics = TOPICS if topics is None else topics
+        self.topics = [t.strip() for t in topics.split(",") if t.strip()] if isinstance(topics, str) else list(topics)
+        self.username = username or USERNAME
+        self.password = password or PASSWORD
+        self.tls = TLS if tls is None else tls
+        self.client_id = client_id or CLIENT_ID
+        self.qos = QOS if qos is None else qos
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+        self.flush_interval = max(0, FLUSH_MS if flush_ms is None else flush_ms) / 1000.0
+        self.block_sec = BLOCK_SEC if block_sec is None else block_sec
+        self._queue = queue.Queue(maxsize=queue_size or QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._client = None
+        self._writer = None
+        self.stats = {'received': 0, 'records': 0, 'rejected': 0, 'dropped': 0, 'batches': 0,
+                      'errors': 0, 'connected': False, 'last_error': None, 'last_message': None}
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        if mqtt is None:
+            raise RuntimeError("MQTT ingestion needs paho-mqtt (requirements-mqtt.txt)")
+        if not self.host:
+            raise RuntimeError("MQTT_HOST is not configured")
+        with self._lock:
+            if self._client is not None:
+                return False
+            if self._writer is not None and self._writer.is_alive():
+                # a stop() that timed out: its writer still drains the queue, and two must not
+                raise RuntimeError("the previous session is still committing its backlog, retry shortly")
+            self._start_writer()
+            client = self._make_client()
+            client.connect_async(self.host, self.port, keepalive=KEEPALIVE_SEC)
+            client.loop_start()
+            self._client = client
+            return True
+
+    def stop(self, timeout=10.0):
+        """Disconnect, then commit whatever is still queued."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.disconnect()
+            client.loop_stop()
+        self._stop.set()
+        writer = self._writer
+        if writer is not None:
+            writer.join(timeout)
+            return not writer.is_alive()
+        return True
+
+    def running(self):
+        return self._client is not None
+
+    def status(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, running=self.running(), host=self.host, port=self.port,
+                    topics=self.topics, queued=self._queue.qsize())
+
+    def _count(self, key, n=1):
+        # stats are updated from both the paho network thread and the writer
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _set(self, **values):
+        with self._stats_lock:
+            self.stats.update(values)
+
+    def _make_client(self):
+        if hasattr(mqtt, "CallbackAPIVersion"):  # paho-mqtt >= 2.0
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id)
+        else:
+            client = mqtt.Client(client_id=self.client_id)
+        if self.username:
+            client.username_pw_set(self.username, self.password)
+        if self.tls:
+            client.tls_set()
+        client.reconnect_delay_set(min_delay=1, max_delay=60)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+        return client
+
+    # -- paho callbacks (network thread) -----------------------------------
+
+    def _on_connect(self, client, userdata, flags, reason, *args):
+        if getattr(reason, "is_failure", reason != 0):
+            self._set(last_error=f"connect refused: {reason}")
+            logger.warning("mqtt: connection to %s:%s refused: %s", self.host, self.port, reason)
+            return
+        self._set(connected=True)
+        # (re)subscribe on every connect: a clean session forgets subscriptions
+        client.subscribe([(topic, self.qos) for topic in self.topics])
+        logger.info("mqtt: connected to %s:%s, subscribed to %s", self.host, self.port, ", ".join(self.topics))
+
+    def _on_disconnect(self, client, userdata, *args):
+        self._set(connected=False)
+
+    def _on_message(self, client, userdata, message):
+        self.handle_message(message.topic, message.payload)
+
+    def handle_message(self, topic, payload):
+        """Decode one message and queue its records (blocking up to block_sec in total when the backlog is full)."""
+        self._count('received')
+        self._set(last_message=int(time.time()))
+        try:
+            records = decode_message(topic, payload)
+        except Exception:
+            records = []
+        if not records:
+            self._count('rejected')
+            return
+        deadline = time.monotonic() + self.block_sec
+        for index, record in enumerate(records):
+            try:
+                self._queue.put(record, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                dropped = len(records) - index
+                self._count('dropped', dropped)
+                logger.warning("mqtt: backlog full, dropping %d records from %s", dropped, topic)
+                return
+
+    # -- writer ------------------------------------------------------------
+
+    def _start_writer(self):
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._run_writer, name="mqtt-writer", daemon=True)
+        self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        delay = RETRY_SEC
+        while True:
+            try:
+                telemetry_store.insert_many(batch)
+                break
+            except Exception as e:
+                self._count('errors')
+                self._set(last_error=str(e))
+                if self._stop.is_set():
+                    # stopping: one attempt per batch left, so stop() cannot hang on a dead store
+                    self._count('dropped', len(batch))
+                    logger.exception("mqtt: failed to commit %d records while stopping, dropping them", len(batch))
+                    return
+                logger.exception("mqtt: failed to commit %d records, retrying in %.1fs", len(batch), delay)
+                self._stop.wait(delay)
+                delay = min(delay * 2, RETRY_MAX_SEC)
+        self._count('records', len(batch))
+        self._count('batches')
+        if self.hub is not None:
+            try:
+                self.hub.notify_telemetry()
+            except Exception:
+                logger.exception("mqtt: failed to notify event subscribers")
+
+
+_ingestor_lock = threading.Lock()
+
+
+def get_ingestor(app):
+    """Return the app's MqttIngestor (configured from MQTT_* env vars), creating it on first use."""
+    from services import events as events_hub
+    with _ingestor_lock:
+        ingestor = app.extensions.get('fruta_mqtt')
+        if ingestor is None:
+            ingestor = MqttIngestor(hub=events_hub.get_hub(app))
+            app.extensions['fruta_mqtt'] = ingestor
+        return ingestor
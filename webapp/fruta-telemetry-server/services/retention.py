@@ -0,0 +1,224 @@
+import os
+import gzip
+import json
+import time
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from services import telemetry_store
+from services.telemetry_store import normalize_time, encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+# raw rows older than this are archived and removed from the hot DB (0 keeps them forever)
+RETENTION_DAYS = float(os.getenv("TELEMETRY_RETENTION_DAYS", "0"))
+# defaults to a directory next to the telemetry DB
+ARCHIVE_DIR = os.getenv("TELEMETRY_ARCHIVE_DIR") or None
+INTERVAL_SEC = float(os.getenv("TELEMETRY_RETENTION_INTERVAL_SEC", "3600"))
+# rows archived + deleted per transaction
+BATCH_SIZE = int(os.getenv("TELEMETRY_RETENTION_BATCH", "5000"))
+# free pages released per pass (0 = all)
+VACUUM_PAGES = int(os.getenv("TELEMETRY_VACUUM_PAGES", "0"))
+
+
+class RetentionManager:
+    """
+    Moves expired telemetry out of the hot database.
+
+    Each pass takes the oldest rows received before now - retention_days in batches, writes
+    them to gzip NDJSON partitions (<archive_dir>/YYYY/MM/DD/messages-<first id>-<last id>.ndjson.gz,
+    by received_at day), and only deletes them once the file is durably on disk. Freed pages
+    are then returned to the filesystem with an incremental vacuum. Archived rows stay
+    queryable through query_archive (the messages API with archive=1).
+
+    Batches are picked oldest first, so a pass interrupted between writing a file and the
+    delete rewrites the same file next time; readers also drop duplicate ids.
+    """
+
+    def __init__(self, store=None, retention_days=None, archive_dir=None, interval=None,
+                 batch_size=None, vacuum_pages=None):
+        self.store = store or telemetry_store.get_store()
+        self.retention_days = RETENTION_DAYS if retention_days is None else retention_days
+        self.archive_dir = archive_dir or default_archive_dir(self.store)
+        self.interval = INTERVAL_SEC if interval is None else interval
+        self.batch_size = max(1, batch_size or BATCH_SIZE)
+        self.vacuum_pages = VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self.stats = {'passes': 0, 'archived': 0, 'files': 0, 'vacuumed_pages': 0,
+                      'last_run': None, 'last_error': None}
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="telemetry-retention", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return dict(self.stats, running=self.running(), retention_days=self.retention_days,
+                    archive_dir=self.archive_dir, interval=self.interval)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                logger.exception("retention: pass failed")
+            self._stop.wait(self.interval)
+
+    # -- retention ---------------------------------------------------------
+
+    def cutoff(self, now=None) -> str:
+        now = time.time() if now is None else now
+        return normalize_time(now - self.retention_days * 86400)
+
+    def run_once(self, now=None) -> Dict:
+        """Archive and delete every expired row, then vacuum. Returns counts for this pass."""
+        if self.retention_days <= 0:
+            return {'archived': 0, 'files': 0, 'vacuumed_pages': 0}
+        with self._run_lock:
+            cutoff = self.cutoff(now)
+            archived = files = 0
+            while not self._stop.is_set():
+                rows = self.store.expired_messages(cutoff, self.batch_size)
+                if not rows:
+                    break
+                files += len(write_partitions(self.archive_dir, rows))
+                self.store.delete_messages([r['id'] for r in rows])
+                archived += len(rows)
+                self.stats['archived'] += len(rows)
+            vacuumed = self.store.vacuum(self.vacuum_pages) if archived else 0
+            self.stats['files'] += files
+            self.stats['vacuumed_pages'] += vacuumed
+            self.stats['passes'] += 1
+            self.stats['last_run'] = int(time.time())
+            if archived:
+                logger.info("retention: archived %d rows older than %s (%d files, %d pages freed)",
+                            archived, cutoff, files, vacuumed)
+            return {'archived': archived, 'files': files, 'vacuumed_pages': vacuumed}
+
+
+def default_archive_dir(store=None) -> str:
+    db_path = store.db_path if store is not None else telemetry_store.DB_PATH
+    return ARCHIVE_DIR or os.path.join(os.path.dirname(db_path), "archive")
+
+
+def _partition_dir(archive_dir: str, day: str) -> str:
+    return os.path.join(archive_dir, *day.split("-"))
+
+
+def write_partitions(archive_dir: str, rows: List[Dict]) -> List[str]:
+    """Write rows to one gzip NDJSON file per received_at day (fsynced); returns the paths."""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row['received_at'][:10], []).append(row)
+    paths = []
+    for day, day_rows in sorted(by_day.items()):
+        directory = _partition_dir(archive_dir, day)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"messages-{day_rows[0]['id']}-{day_rows[-1]['id']}.ndjson.gz")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                for row in day_rows:
+                    gz.write(json.dumps(row, separators=(",", ":")).encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+def _days(archive_dir: str) -> List[str]:
+    """Archived partition days ('YYYY-MM-DD'), newest first."""
+    days = []
+    for root, dirs, files in os.walk(archive_dir):
+        if any(f.endswith(".ndjson.gz") for f in files):
+            rel = os.path.relpath(root, archive_dir).split(os.sep)
+            if len(rel) == 3:
+                days.append("-".join(rel))
+    return sorted(days, reverse=True)
+
+
+def _read_day(archive_dir: str, day: str):
+    directory = _partition_dir(archive_dir, day)
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".ndjson.gz"):
+            continue
+        with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def query_archive(limit: int = 100, device: Optional[str] = None, event_type: Optional[str] = None,
+                  since=None, until=None, cursor: Optional[str] = None, include_payload: bool = True,
+                  archive_dir: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Archived rows, newest first, with the same filters, row shape and keyset cursor as
+    TelemetryStore.query_messages. Only partitions within [since, until] are opened, and
+    only one day's matching rows are held in memory at a time.
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    since = normalize_time(since) if since else None
+    until = normalize_time(until) if until else None
+    after = decode_cursor(cursor) if cursor else None
+    results, seen = [], set()
+    if not os.path.isdir(archive_dir):
+        return results, None
+    for day in _days(archive_dir):
+        if since and day < since[:10]:
+            break
+        if (until and day > until[:10]) or (after and day > after[0][:10]):
+            continue
+        matched = []
+        for row in _read_day(archive_dir, day):
+            key = (row['received_at'], row['id'])
+            if (device and row.get('deviceId') != device) or (event_type and row.get('eventType') != event_type):
+                continue
+            if (since and key[0] < since) or (until and key[0] > until) or (after and key >= tuple(after)):
+                continue
+            matched.append(row)
+        matched.sort(key=lambda r: (r['received_at'], r['id']), reverse=True)
+        for row in matched:
+            if row['id'] in seen:
+                continue
+            seen.add(row['id'])
+            if not include_payload:
+                row.pop('payload', None)
+            results.append(row)
+            if len(results) == limit:
+                return results, encode_cursor(row['received_at'], row['id'])
+    return results, None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> RetentionManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = RetentionManager()
+        return _manager
@@ -0,0 +1,941 @@
+import os
+import sqlite3
+import json
+import queue
+import threading
+import atexit
+import time
+import logging
+import base64
+import itertools
+from urllib.parse import urlparse, unquote
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("TELEMETRY_DB_PATH", "/var/lib/fruta/telemetry.db")
+# writer batching: flush when this many rows are queued or when the oldest queued row is this old
+FLUSH_SIZE = int(os.getenv("TELEMETRY_FLUSH_SIZE", "200"))
+FLUSH_INTERVAL_MS = int(os.getenv("TELEMETRY_FLUSH_MS", "50"))
+# max idle read connections kept open
+READ_POOL_SIZE = int(os.getenv("TELEMETRY_READ_POOL", "4"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# typed columns extracted from the firmware payload: (column, payload key, SQL type)
+TYPED_COLUMNS = (
+    ("eventType", "eventType", "TEXT"),
+    ("status", "status", "TEXT"),
+    ("timestamp", "timestamp", "INTEGER"),
+    ("freeHeap", "freeHeap", "INTEGER"),
+    ("wifiStrength", "wifiStrength", "INTEGER"),
+    ("imageWidth", "imageWidth", "INTEGER"),
+    ("imageHeight", "imageHeight", "INTEGER"),
+    ("imageSize", "imageSize", "INTEGER"),
+    ("blobUrl", "blobUrl", "TEXT"),
+)
+
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_messages_device_time ON messages (deviceId, received_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_event_time ON messages (eventType, received_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_time ON messages (received_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_image ON messages (imageFileName)",
+    "CREATE INDEX IF NOT EXISTS idx_rollups_fleet ON rollups (bucket, metric, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_analyses_time ON analyses (analyzed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_label ON detections (label, confidence)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_label_time ON detections (label, detected_at)",
+    "CREATE INDEX IF NOT EXISTS idx_detections_blob ON detections (blob_name, etag)",
+)
+
+INSERT_COLUMNS = ("deviceId", "imageFileName") + tuple(c for c, _, _ in TYPED_COLUMNS) + ("payload",)
+INSERT_SQL = "INSERT INTO messages ({}) VALUES ({})".format(
+    ", ".join(INSERT_COLUMNS), ", ".join("?" for _ in INSERT_COLUMNS))
+
+# rollup resolutions (name, seconds) and the numeric columns aggregated per device;
+# 'status' is rolled up as a message count plus the last status seen
+ROLLUP_BUCKETS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+ROLLUP_METRICS = ("freeHeap", "wifiStrength", "imageSize")
+ROLLUP_SQL = """
+INSERT INTO rollups (device, bucket, metric, ts, count, sum, min, max, last, last_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (device, bucket, metric, ts) DO UPDATE SET
+  count = count + excluded.count,
+  sum = CASE WHEN excluded.sum IS NULL THEN sum ELSE coalesce(sum, 0) + excluded.sum END,
+  min = min(coalesce(min, excluded.min), coalesce(excluded.min, min)),
+  max = max(coalesce(max, excluded.max), coalesce(excluded.max, max)),
+  last = CASE WHEN excluded.last_at >= last_at THEN excluded.last ELSE last END,
+  last_at = max(last_at, excluded.last_at)
+"""
+_ROLLUP_INDEX = {c: INSERT_COLUMNS.index(c) for c in ROLLUP_METRICS + ("status",)}
+
+DELETE_SQL = "DELETE FROM messages WHERE id = ?"
+ANALYSIS_SQL = "INSERT OR REPLACE INTO analyses (blob_name, etag, mango_likelihood, detections) VALUES (?, ?, ?, ?)"
+# UNIQUE (blob_name, etag) does not fold NULL etags, so versions are replaced explicitly
+ANALYSIS_DELETE_SQL = "DELETE FROM analyses WHERE blob_name = ? AND etag IS ?"
+# one row per detected object, replaced with the blob version's analysis
+DETECTIONS_DELETE_SQL = "DELETE FROM detections WHERE blob_name = ? AND etag IS ?"
+DETECTION_SQL = (
+    "INSERT INTO detections (blob_name, etag, label, confidence, x1, y1, x2, y2) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+CHECKPOINT_SQL = (
+    "INSERT OR REPLACE INTO ingest_checkpoints (source, blob_name, etag, records, updated_at) "
+    "VALUES (?, ?, ?, ?, datetime('now'))"
+)
+SELECT_COLUMNS = ("id", "received_at", "deviceId", "imageFileName") + tuple(c for c, _, _ in TYPED_COLUMNS)
+
+# queue markers understood by the writer thread
+_STOP = object()
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class _BulkWrite(_FlushRequest):
+    """Rows that must be committed together; the producer waits on `done`."""
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+
+class TelemetryStore:
+    """
+    Long-lived SQLite telemetry store.
+
+    Writes are queued and committed by a single background writer thread that groups
+    them into one transaction per batch. Reads use a small pool of persistent
+    connections (WAL mode lets them run alongside the writer).
+    """
+
+    def __init__(self, db_path: Optional[str] = None, flush_size: Optional[int] = None,
+                 flush_interval_ms: Optional[int] = None, read_pool_size: Optional[int] = None):
+        self.db_path = db_path or DB_PATH
+        self.flush_size = max(1, flush_size or FLUSH_SIZE)
+        self.flush_interval = max(0, FLUSH_INTERVAL_MS if flush_interval_ms is None else flush_interval_ms) / 1000.0
+        self.read_pool_size = READ_POOL_SIZE if read_pool_size is None else read_pool_size
+        self._queue = queue.Queue()
+        self._readers = queue.LifoQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._closed = False
+        # in-memory watermark of committed messages, kept by the writer: (max id, delete generation)
+        self._latest_id = None
+        self._deletes = 0
+
+    # -- connections -------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def _reader(self):
+        """Borrow a pooled read connection (created on demand)."""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if self._closed or self._readers.qsize() >= self.read_pool_size:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def init_db(self):
+        parent = os.path.dirname(self.db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        # only takes effect on a new database, and must precede the switch to WAL
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        try:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              received_at TEXT DEFAULT (datetime('now')),
+              deviceId TEXT,
+              imageFileName TEXT,
+              payload TEXT
+            )
+            """)
+            self._migrate_typed_columns(conn)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              analyzed_at TEXT DEFAULT (datetime('now')),
+              blob_name TEXT NOT NULL,
+              etag TEXT,
+              mango_likelihood REAL,
+              detections TEXT,
+              UNIQUE (blob_name, etag)
+            )
+            """)
+            has_rollups = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollups'").fetchone()
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS rollups (
+              device TEXT NOT NULL,
+              bucket TEXT NOT NULL,
+              metric TEXT NOT NULL,
+              ts INTEGER NOT NULL,
+              count INTEGER NOT NULL,
+              sum REAL,
+              min REAL,
+              max REAL,
+              last,
+              last_at REAL,
+              PRIMARY KEY (device, bucket, metric, ts)
+            ) WITHOUT ROWID
+            """)
+            if not has_rollups:
+                self._backfill_rollups(conn)
+            has_detections = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detections'").fetchone()
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+              id INTEGER PRIMARY KEY,
+              detected_at TEXT DEFAULT (datetime('now')),
+              blob_name TEXT NOT NULL,
+              etag TEXT,
+              label TEXT NOT NULL COLLATE NOCASE,
+              confidence REAL NOT NULL,
+              x1 REAL, y1 REAL, x2 REAL, y2 REAL
+            )
+            """)
+            if not has_detections:
+                self._backfill_detections(conn)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+              source TEXT NOT NULL,
+              blob_name TEXT NOT NULL,
+              etag TEXT,
+              records INTEGER NOT NULL DEFAULT 0,
+              updated_at TEXT DEFAULT (datetime('now')),
+              PRIMARY KEY (source, blob_name)
+            )
+            """)
+            for ddl in INDEXES:
+                conn.execute(ddl)
+            conn.commit()
+            self._latest_id = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+        finally:
+            conn.close()
+        self._ensure_writer()
+
+    @staticmethod
+    def _migrate_typed_columns(conn):
+        """Add typed columns to databases created before they existed and backfill them from payload."""
+        existing = {r[1] for r in conn.execute("PRAGMA table_info(messages)")}
+        added = []
+        for column, key, sql_type in TYPED_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {sql_type}")
+                added.append((column, key))
+        if added and existing:
+            assignments = ", ".join(f"{column} = json_extract(payload, '$.{key}')" for column, key in added)
+            try:
+                conn.execute(f"UPDATE messages SET {assignments} WHERE json_valid(payload)")
+            except sqlite3.OperationalError:
+                # SQLite built without JSON1: old rows keep NULL typed columns
+                logger.warning("telemetry store: JSON1 unavailable, typed columns not backfilled")
+
+    @staticmethod
+    def _backfill_rollups(conn, chunk=10000):
+        """Build rollups for rows stored before the rollups table existed (runs once)."""
+        columns = ", ".join(INSERT_COLUMNS[:-1])
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, CAST(strftime('%s', received_at) AS REAL), {columns} FROM messages "
+                "WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            conn.executemany(ROLLUP_SQL, _rollup_params((r[2:], r[1]) for r in rows))
+
+    @staticmethod
+    def _backfill_detections(conn):
+        """Explode detections of analyses stored before the detections table existed (runs once)."""
+        rows = conn.execute("SELECT blob_name, etag, detections, analyzed_at FROM analyses").fetchall()
+        for blob_name, etag, detections, analyzed_at in rows:
+            try:
+                parsed = json.loads(detections) if detections else []
+            except ValueError:
+                continue
+            conn.executemany(
+                "INSERT INTO detections (blob_name, etag, detected_at, label, confidence, x1, y1, x2, y2) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [p[:2] + (analyzed_at,) + p[2:] for p in _detection_params(blob_name, etag, parsed)])
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("telemetry store is closed")
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name="telemetry-writer", daemon=True)
+                self._writer.start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every row queued before this call is committed."""
+        if self._writer is None or not self._writer.is_alive():
+            return self._queue.empty()
+        req = _FlushRequest()
+        self._queue.put(req)
+        return req.done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """Flush pending rows, stop the writer and close pooled connections."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            writer = self._writer
+        if writer is not None and writer.is_alive():
+            self._queue.put(_STOP)
+            writer.join(timeout)
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # -- writer ------------------------------------------------------------
+
+    def _run_writer(self):
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                groups, markers = [], []
+                stop = self._collect(item, groups, markers)
+                if not stop and not markers:
+                    size = sum(len(g) for g, _ in groups)
+                    deadline = time.monotonic() + self.flush_interval
+                    while size < self.flush_size:
+                        remaining = deadline - time.monotonic()
+                        try:
+                            item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        count = len(groups)
+                        if self._collect(item, groups, markers):
+                            stop = True
+                            break
+                        size += sum(len(g) for g, _ in groups[count:])
+                        if markers:
+                            # a flush was requested: commit what we have now
+                            break
+                self._commit_groups(conn, groups, markers)
+                if stop:
+                    self._drain(conn)
+                    return
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _collect(item, groups, markers) -> bool:
+        # groups are (statements, owner): each producer's statements stay together so a
+        # failed batch can be retried producer by producer
+        if item is _STOP:
+            return True
+        if isinstance(item, _BulkWrite):
+            if item.rows:
+                groups.append((item.rows, item))
+            markers.append(item)
+        elif isinstance(item, list):
+            # statements that belong together, committed with the next batch
+            if item:
+                groups.append((item, None))
+        elif isinstance(item, _FlushRequest):
+            markers.append(item)
+        else:
+            groups.append(([item], None))
+        return False
+
+    def _drain(self, conn):
+        # commit anything queued after the stop marker (late producers during shutdown)
+        groups, markers = [], []
+        while True:
+            try:
+                self._collect(self._queue.get_nowait(), groups, markers)
+            except queue.Empty:
+                break
+        self._commit_groups(conn, groups, markers)
+
+    def _commit_groups(self, conn, groups, markers):
+        """
+        Commit all groups in one transaction. If that fails, commit each group on its own,
+        so only the producer whose statements fail loses them (and a waiting bulk writer
+        gets its own error); other producers' rows are kept.
+        """
+        error = self._write_batch(conn, [s for g, _ in groups for s in g], log=len(groups) <= 1) if groups else None
+        errors = {}
+        if error is not None and len(groups) > 1:
+            logger.warning("telemetry writer: batch of %d groups failed (%s); committing them one by one",
+                           len(groups), error)
+            for statements, owner in groups:
+                group_error = self._write_batch(conn, statements)
+                if owner is not None:
+                    errors[id(owner)] = group_error
+            error = None
+        for m in markers:
+            m.error = errors.get(id(m), error)
+            m.done.set()
+
+    def _write_batch(self, conn, batch, log=True):
+        """Commit (sql, params) items in one transaction; returns the exception on failure (rolled back)."""
+        try:
+            with conn:
+                for sql, group in itertools.groupby(batch, key=lambda item: item[0]):
+                    conn.executemany(sql, [params for _, params in group])
+                # keep rollups in step with inserted rows (same transaction)
+                now = time.time()
+                conn.executemany(ROLLUP_SQL, _rollup_params(
+                    (params, now) for sql, params in batch if sql == INSERT_SQL))
+                statements = {sql for sql, _ in batch}
+                latest = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] if INSERT_SQL in statements else None
+        except Exception as e:
+            if log:
+                logger.exception("telemetry writer: failed to commit batch of %d rows", len(batch))
+            return e
+        # published only once committed, so readers never see a watermark ahead of the data
+        if latest is not None:
+            self._latest_id = latest
+        if DELETE_SQL in statements:
+            self._deletes += 1
+        return None
+
+    # -- public API --------------------------------------------------------
+
+    def insert_message(self, payload: Dict):
+        """Queue a payload for the next batched commit."""
+        row = _row_from_payload(payload)
+        self._ensure_writer()
+        self._queue.put((INSERT_SQL, row))
+
+    def insert_many(self, payloads: List[Dict], timeout: Optional[float] = 30.0,
+                    extra: Optional[List[tuple]] = None) -> int:
+        """
+        Commit payloads in a single transaction and wait for it. Returns the number of rows
+        written; raises if the commit failed or did not finish within `timeout`. `extra`
+        (sql, params) statements, e.g. a checkpoint, are committed in the same transaction.
+        """
+        rows = [(INSERT_SQL, _row_from_payload(p)) for p in payloads]
+        self.write(rows + list(extra or ()), timeout)
+        return len(rows)
+
+    def write(self, statements: List[tuple], timeout: Optional[float] = 30.0):
+        """Commit (sql, params) statements in one writer transaction and wait for it."""
+        if not statements:
+            return
+        self._ensure_writer()
+        req = _BulkWrite(statements)
+        self._queue.put(req)
+        if not req.done.wait(timeout):
+            raise TimeoutError("telemetry bulk write timed out")
+        if req.error is not None:
+            raise req.error
+
+    def expired_messages(self, cutoff: str, limit: int = 5000) -> List[Dict]:
+        """
+        Up to `limit` rows received before cutoff, oldest first, with every column and the
+        decoded payload (the form written to archives).
+        """
+        columns = SELECT_COLUMNS + ("payload",)
+        sql = "SELECT {} FROM messages WHERE received_at < ? ORDER BY received_at, id LIMIT ?".format(", ".join(columns))
+        with self._reader() as conn:
+            rows = conn.execute(sql, (normalize_time(cutoff), limit)).fetchall()
+        results = []
+        for r in rows:
+            item = dict(zip(SELECT_COLUMNS, r))
+            try:
+                item["payload"] = json.loads(r[-1])
+            except Exception:
+                item["payload"] = r[-1]
+            results.append(item)
+        return results
+
+    def delete_messages(self, ids: List[int], timeout: Optional[float] = 30.0) -> int:
+        """Delete rows by id in one transaction (rollups are kept). Returns the number of ids."""
+        self.write([(DELETE_SQL, (int(i),)) for i in ids], timeout)
+        return len(ids)
+
+    def vacuum(self, max_pages: int = 0) -> int:
+        """
+        Return free pages to the filesystem with an incremental vacuum (at most max_pages,
+        0 = all) and report how many were released. Databases created before auto_vacuum
+        was enabled are converted first, which takes one full VACUUM.
+        """
+        conn = self._connect()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("telemetry store: converting %s to incremental auto_vacuum", self.db_path)
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # executescript steps the pragma to completion (execute frees a single page)
+            conn.executescript(f"PRAGMA incremental_vacuum({max(0, int(max_pages))})")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+
+    def get_ingest_checkpoints(self, source: str) -> Dict[str, tuple]:
+        """blob name -> (etag, records ingested) for an ingestion source."""
+        with self._reader() as conn:
+            rows = conn.execute("SELECT blob_name, etag, records FROM ingest_checkpoints WHERE source = ?", (source,)).fetchall()
+        return {name: (etag, records) for name, etag, records in rows}
+
+    def query_messages(self, limit: int = 100, device: Optional[str] = None, event_type: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None, cursor: Optional[str] = None,
+                       include_payload: bool = True, after_id: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Return (rows, next_cursor), newest first.
+
+        Filters map onto the (deviceId, received_at) / (eventType, received_at) indexes;
+        `cursor` is the opaque keyset token returned by the previous page. With `after_id`
+        the page is the `limit` rows inserted right after that id (so a caller catching up
+        never skips rows; next_cursor is None, resume from the highest id returned). The
+        JSON payload is only read and decoded when include_payload is set.
+        """
+        clauses, params = [], []
+        if after_id is not None:
+            clauses.append("id > ?")
+            params.append(int(after_id))
+        if device:
+            clauses.append("deviceId = ?")
+            params.append(device)
+        if event_type:
+            clauses.append("eventType = ?")
+            params.append(event_type)
+        if since:
+            clauses.append("received_at >= ?")
+            params.append(normalize_time(since))
+        if until:
+            clauses.append("received_at <= ?")
+            params.append(normalize_time(until))
+        if cursor:
+            clauses.append("(received_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        columns = SELECT_COLUMNS + (("payload",) if include_payload else ())
+        sql = "SELECT {} FROM messages".format(", ".join(columns))
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if after_id is not None:
+            sql += " ORDER BY id ASC LIMIT ?"
+        else:
+            sql += " ORDER BY received_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        with self._reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if after_id is not None:
+            rows.reverse()
+        results = []
+        for r in rows:
+            item = dict(zip(SELECT_COLUMNS, r))
+            if include_payload:
+                try:
+                    item["payload"] = json.loads(r[-1])
+                except Exception:
+                    item["payload"] = {}
+            results.append(item)
+        next_cursor = None
+        if len(rows) == limit and rows and after_id is None:
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return results, next_cursor
+
+    def get_messages(self, limit: int = 100) -> List[Dict]:
+        return self.query_messages(limit=limit)[0]
+
+    def record_analysis(self, blob_name: str, etag: Optional[str], mango_likelihood: float, detections: List[Dict]):
+        """
+        Queue a detection result for blob_name: one analyses row per blob version, plus one
+        detections row per detected object (replacing those of an earlier analysis).
+        """
+        self._ensure_writer()
+        self._queue.put(
+            [(ANALYSIS_DELETE_SQL, (blob_name, etag)),
+             (ANALYSIS_SQL, (blob_name, etag, float(mango_likelihood or 0.0), json.dumps(detections))),
+             (DETECTIONS_DELETE_SQL, (blob_name, etag))]
+            + [(DETECTION_SQL, p) for p in _detection_params(blob_name, etag, detections)])
+
+    def analysis_current(self, blob_name: str, etag: Optional[str], mango_likelihood: float,
+                         detections: List[Dict]) -> bool:
+        """True when the stored analysis of this blob version already holds this result."""
+        with self._reader() as conn:
+            row = conn.execute("SELECT mango_likelihood, detections FROM analyses WHERE blob_name = ? AND etag IS ?",
+                               (blob_name, etag)).fetchone()
+        return row is not None and row[0] == float(mango_likelihood or 0.0) and row[1] == json.dumps(detections)
+
+    def query_analyses(self, blob_names: Optional[List[str]] = None, min_likelihood: Optional[float] = None,
+                       limit: int = 100, include_detections: bool = True) -> List[Dict]:
+        """
+        Stored analyses, newest first, each linked to the first telemetry row that names
+        the blob (message_id / deviceId are None until such a row arrives).
+        """
+        clauses, params = [], []
+        if blob_names:
+            clauses.append("a.blob_name IN ({})".format(", ".join("?" for _ in blob_names)))
+            params.extend(blob_names)
+        if min_likelihood is not None:
+            clauses.append("a.mango_likelihood >= ?")
+            params.append(float(min_likelihood))
+        sql = """
+        SELECT a.id, a.analyzed_at, a.blob_name, a.etag, a.mango_likelihood, {detections}
+               m.id, m.deviceId
+        FROM analyses a
+        LEFT JOIN messages m ON m.id = (SELECT MIN(id) FROM messages WHERE imageFileName = a.blob_name)
+        """.format(detections="a.detections," if include_detections else "NULL,")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY a.analyzed_at DESC, a.id DESC LIMIT ?"
+        params.append(limit)
+        with self._reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        results = []
+        for r in rows:
+            item = {"id": r[0], "analyzed_at": r[1], "blobName": r[2], "etag": r[3],
+                    "mango_likelihood": r[4], "message_id": r[6], "deviceId": r[7]}
+            if include_detections:
+                try:
+                    item["detections"] = json.loads(r[5]) if r[5] else []
+                except Exception:
+                    item["detections"] = []
+            results.append(item)
+        return results
+
+    def query_detections(self, label: Optional[str] = None, min_confidence: Optional[float] = None,
+                         device: Optional[str] = None, since=None, until=None, limit: int = 100) -> List[Dict]:
+        """
+        Blobs with a detection matching label (case-insensitive) and min_confidence, newest
+        capture first. Each item carries the best matching detection (confidence, bbox), the
+        number of matches, and the telemetry row naming the blob (deviceId, message_id,
+        received_at; capture time falls back to the detection time until one arrives).
+        device / since / until filter on that telemetry row.
+        """
+        clauses, params = [], []
+        if label:
+            clauses.append("d.label = ?")
+            params.append(label)
+        if min_confidence is not None:
+            clauses.append("d.confidence >= ?")
+            params.append(float(min_confidence))
+        if device:
+            clauses.append("m.deviceId = ?")
+            params.append(device)
+        if since:
+            clauses.append("coalesce(m.received_at, d.detected_at) >= ?")
+            params.append(normalize_time(since))
+        if until:
+            clauses.append("coalesce(m.received_at, d.detected_at) <= ?")
+            params.append(normalize_time(until))
+        # MAX() is the only min/max aggregate, so the bare d.* columns come from the best row
+        sql = """
+        SELECT d.blob_name, d.etag, d.label, MAX(d.confidence), d.x1, d.y1, d.x2, d.y2, COUNT(*),
+               d.detected_at, m.id, m.deviceId, m.received_at
+        FROM detections d
+        LEFT JOIN messages m ON m.id = (SELECT MIN(id) FROM messages WHERE imageFileName = d.blob_name)
+        """
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += """
+        GROUP BY d.blob_name, d.etag
+        ORDER BY coalesce(m.received_at, d.detected_at) DESC, d.blob_name LIMIT ?
+        """
+        params.append(limit)
+        with self._reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [{"blobName": r[0], "etag": r[1], "label": r[2], "confidence": r[3],
+                 "bbox": None if r[4] is None else {"x1": r[4], "y1": r[5], "x2": r[6], "y2": r[7]},
+                 "matches": r[8], "detected_at": r[9], "message_id": r[10], "deviceId": r[11],
+                 "captured_at": r[12] or r[9]} for r in rows]
+
+    def query_metrics(self, device: Optional[str] = None, metrics: Optional[List[str]] = None,
+                      since=None, until=None, resolution: Optional[str] = None,
+                      max_points: int = 500) -> Tuple[str, Dict[str, List[Dict]]]:
+        """
+        Downsampled series from the rollups: returns (resolution, {metric: [point, ...]}) with
+        points {t, count, min, max, avg, last} per bucket, oldest first. Without a device the
+        series aggregate the whole fleet (no 'last'). resolution defaults to the finest bucket
+        giving at most max_points points over [since, until] (default: the last 24 hours).
+        """
+        buckets = dict(ROLLUP_BUCKETS)
+        end = _epoch(until) if until is not None else time.time()
+        start = _epoch(since) if since is not None else end - 86400
+        if resolution is None or resolution == "auto":
+            resolution = next((name for name, size in ROLLUP_BUCKETS if (end - start) / size <= max_points),
+                              ROLLUP_BUCKETS[-1][0])
+        if resolution not in buckets:
+            raise ValueError("resolution must be one of: " + ", ".join(buckets))
+        metrics = list(metrics or ROLLUP_METRICS + ("status",))
+        unknown = set(metrics) - set(_ROLLUP_INDEX)
+        if unknown:
+            raise ValueError("unknown metric: " + ", ".join(sorted(unknown)))
+        size = buckets[resolution]
+        params = [resolution, *metrics, int(start // size * size), int(end)]
+        metric_in = ", ".join("?" for _ in metrics)
+        if device is not None:
+            sql = ("SELECT metric, ts, count, sum, min, max, last FROM rollups "
+                   f"WHERE device = ? AND bucket = ? AND metric IN ({metric_in}) AND ts >= ? AND ts <= ? ORDER BY metric, ts")
+            params.insert(0, device)
+        else:
+            sql = ("SELECT metric, ts, SUM(count), SUM(sum), MIN(min), MAX(max), NULL FROM rollups "
+                   f"WHERE bucket = ? AND metric IN ({metric_in}) AND ts >= ? AND ts <= ? GROUP BY metric, ts ORDER BY metric, ts")
+        with self._reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        series = {m: [] for m in metrics}
+        for metric, ts, count, total, lo, hi, last in rows:
+            point = {"t": ts, "count": count, "min": lo, "max": hi,
+                     "avg": total / count if total is not None and count else None}
+            if device is not None:
+                point["last"] = last
+            series[metric].append(point)
+        return resolution, series
+
+    def latest_id(self) -> int:
+        """Highest committed message id (0 when empty), from memory once the writer has started."""
+        if self._latest_id is None:
+            with self._reader() as conn:
+                self._latest_id = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+        return self._latest_id
+
+    def messages_version(self) -> Tuple[int, int]:
+        """(latest id, delete generation): changes whenever committed messages do; no DB access."""
+        return self.latest_id(), self._deletes
+
+
+def _rollup_params(rows) -> List[tuple]:
+    """
+    Aggregate (insert-row params, epoch seconds) pairs into ROLLUP_SQL parameter tuples, one
+    per (device, bucket, metric, bucket start), so a batch costs a handful of upserts.
+    """
+    acc = {}
+    for row, at in rows:
+        if at is None:
+            continue
+        device = row[0] or ""
+        for metric, idx in _ROLLUP_INDEX.items():
+            value = row[idx]
+            if value is None:
+                continue
+            numeric = metric != "status"
+            for bucket, size in ROLLUP_BUCKETS:
+                key = (device, bucket, metric, int(at // size * size))
+                agg = acc.get(key)
+                if agg is None:
+                    acc[key] = [1, value, value, value, value, at] if numeric else [1, None, None, None, value, at]
+                    continue
+                agg[0] += 1
+                if numeric:
+                    agg[1] += value
+                    agg[2] = min(agg[2], value)
+                    agg[3] = max(agg[3], value)
+                if at >= agg[5]:
+                    agg[4], agg[5] = value, at
+    return [key + tuple(agg) for key, agg in acc.items()]
+
+
+def _detection_params(blob_name, etag, detections) -> List[tuple]:
+    """DETECTION_SQL parameters for normalized detections (bbox from bounding_box x1..y2)."""
+    params = []
+    for d in detections if isinstance(detections, list) else ():
+        if not isinstance(d, dict):
+            continue
+        label = d.get("name") or d.get("label")
+        if not label:
+            continue
+        box = d.get("bounding_box") if isinstance(d.get("bounding_box"), dict) else {}
+        params.append((blob_name, etag, str(label), _as_float(d.get("confidence")) or 0.0,
+                       *(_as_float(box.get(k)) for k in ("x1", "y1", "x2", "y2"))))
+    return params
+
+
+def _as_float(v):
+    if v is None or isinstance(v, bool):
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _epoch(value) -> float:
+    """Epoch seconds for an ISO-8601 string, date or epoch value (see normalize_time)."""
+    return datetime.strptime(normalize_time(value), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _as_int(v):
+    if v is None or isinstance(v, bool):
+        return None
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def blob_name_from_url(url: Optional[str]) -> Optional[str]:
+    """Blob name of a blob URL (https://<account>/<container>/<name>, SAS query ignored)."""
+    if not url:
+        return None
+    parts = urlparse(str(url)).path.split("/", 2)
+    return unquote(parts[2]) if len(parts) > 2 and parts[2] else None
+
+
+def _row_from_payload(payload: Dict) -> tuple:
+    # imageFileName holds the blob name so rows can be joined to blob-keyed data (e.g. analyses)
+    values = [payload.get("deviceId"), payload.get("imageFileName") or blob_name_from_url(payload.get("blobUrl"))]
+    for _, key, sql_type in TYPED_COLUMNS:
+        v = payload.get(key)
+        if sql_type == "INTEGER":
+            v = _as_int(v)
+        elif v is not None and not isinstance(v, str):
+            v = str(v)
+        values.append(v)
+    values.append(json.dumps(payload))
+    return tuple(values)
+
+
+def normalize_time(value) -> str:
+    """
+    Normalize an ISO-8601 string, date or epoch seconds to the received_at format
+    ('YYYY-MM-DD HH:MM:SS', UTC). Raises ValueError for unparseable input.
+    """
+    if isinstance(value, (int, float)):
+        dt = datetime.fromtimestamp(value, tz=timezone.utc)
+    else:
+        s = str(value).strip()
+        if _is_number(s):
+            dt = datetime.fromtimestamp(float(s), tz=timezone.utc)
+        else:
+            if s.endswith("Z"):
+                s = s[:-1] + "+00:00"
+            dt = datetime.fromisoformat(s)
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _is_number(s: str) -> bool:
+    try:
+        float(s)
+    except ValueError:
+        return False
+    return True
+
+
+def encode_cursor(received_at: str, row_id: int) -> str:
+    raw = f"{received_at}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError for malformed tokens."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        received_at, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return received_at, int(row_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+# Process-wide store used by the API blueprint
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> TelemetryStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TelemetryStore()
+            # guaranteed flush of queued rows on interpreter shutdown
+            atexit.register(_store.close)
+        return _store
+
+
+def init_db():
+    get_store().init_db()
+
+
+def insert_message(payload: Dict):
+    get_store().insert_message(payload)
+
+
+def get_messages(limit: int = 100) -> List[Dict]:
+    return get_store().get_messages(limit=limit)
+
+
+def insert_many(payloads: List[Dict], extra: Optional[List[tuple]] = None) -> int:
+    return get_store().insert_many(payloads, extra=extra)
+
+
+def expired_messages(cutoff: str, limit: int = 5000) -> List[Dict]:
+    return get_store().expired_messages(cutoff, limit)
+
+
+def delete_messages(ids: List[int]) -> int:
+    return get_store().delete_messages(ids)
+
+
+def vacuum(max_pages: int = 0) -> int:
+    return get_store().vacuum(max_pages)
+
+
+def get_ingest_checkpoints(source: str) -> Dict[str, tuple]:
+    return get_store().get_ingest_checkpoints(source)
+
+
+def query_messages(**kwargs) -> Tuple[List[Dict], Optional[str]]:
+    return get_store().query_messages(**kwargs)
+
+
+def latest_id() -> int:
+    return get_store().latest_id()
+
+
+def messages_version() -> Tuple[int, int]:
+    return get_store().messages_version()
+
+
+def record_analysis(blob_name: str, etag: Optional[str], mango_likelihood: float, detections: List[Dict]):
+    get_store().record_analysis(blob_name, etag, mango_likelihood, detections)
+
+
+def analysis_current(blob_name: str, etag: Optional[str], mango_likelihood: float, detections: List[Dict]) -> bool:
+    return get_store().analysis_current(blob_name, etag, mango_likelihood, detections)
+
+
+def query_analyses(**kwargs) -> List[Dict]:
+    return get_store().query_analyses(**kwargs)
+
+
+def query_detections(**kwargs) -> List[Dict]:
+    return get_store().query_detections(**kwargs)
+
+
+def query_metrics(**kwargs) -> Tuple[str, Dict[str, List[Dict]]]:
+    return get_store().query_metrics(**kwargs)
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    return get_store().flush(timeout)
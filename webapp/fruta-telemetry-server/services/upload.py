@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import logging
+from datetime import datetime, timezone
+
+from services import auto_analyze
+from services import blob as sb
+from services import events as events_hub
+from services import telemetry_store
+
+logger = logging.getLogger(__name__)
+
+# largest accepted image body; larger uploads are rejected (413) and nothing is committed
+MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+# size of reads from the request body (bytes are passed on to storage as they arrive)
+READ_CHUNK = int(os.getenv("UPLOAD_READ_CHUNK", str(64 * 1024)))
+# devices must send "Authorization: Bearer <token>"; unset disables /api/upload
+TOKEN = os.getenv("UPLOAD_TOKEN") or None
+
+# (extension, content type, leading bytes) of accepted images
+IMAGE_TYPES = (
+    ('.jpg', 'image/jpeg', b'\xff\xd8\xff'),
+    ('.jpeg', 'image/jpeg', b'\xff\xd8\xff'),
+    ('.png', 'image/png', b'\x89PNG\r\n\x1a\n'),
+)
+_NAME_RE = re.compile(r'^[A-Za-z0-9._-]+(/[A-Za-z0-9._-]+)*$')
+
+
+class UploadError(Exception):
+    """Rejected upload; carries the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def image_type(blob_name):
+    """(content type, magic bytes) for an image blob name; raises UploadError otherwise."""
+    if not blob_name or '..' in blob_name or not _NAME_RE.match(blob_name):
+        raise UploadError(400, 'invalid blob name')
+    lower = blob_name.lower()
+    for ext, content_type, magic in IMAGE_TYPES:
+        if lower.endswith(ext):
+            return content_type, magic
+    raise UploadError(415, 'only .jpg, .jpeg and .png uploads are accepted')
+
+
+def default_name(device_id=None, now=None):
+    """Blob name in the firmware's style: <device>-YYYYMMDD-HHMMSS-<ms>.jpg (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    device = re.sub(r'[^A-Za-z0-9_-]', '-', device_id or 'device')
+    return f"{device}-{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}.jpg"
+
+
+def read_chunks(stream, magic, max_bytes=None, chunk_size=None):
+    """
+    Yield the body of `stream` chunk by chunk, checking the image signature as soon as
+    enough bytes arrived and raising UploadError past max_bytes, so a bad or oversized
+    upload stops before its block list is committed.
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    chunk_size = chunk_size or READ_CHUNK
+    head = b''
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadError(413, f'image larger than {max_bytes} bytes')
+        if head is not None:
+            head += chunk
+            if len(head) < len(magic):
+                continue
+            if not head.startswith(magic):
+                raise UploadError(415, 'body is not the image type its name says')
+            chunk, head = head, None
+        yield chunk
+    if head is not None:
+        raise UploadError(400, 'empty or truncated image body')
+
+
+def store_upload(app, blob_name, stream, device_id=None, content_length=None, overwrite=False):
+    """
+    Write a device image through to the app's container and register it at once: the
+    listing index and /events subscribers see the blob, and a telemetry row ("image_uploaded")
+    links it to the device, without waiting for the next listing poll. An existing blob is
+    only replaced with overwrite. When the background detection pipeline runs (AUTO_ANALYZE)
+    it analyzes every upload; analysisQueued reports whether the image is queued there.
+    Returns the blob's listing item plus size, deviceId and analysisQueued; raises
+    UploadError for rejected uploads.
+    """
+    content_type, magic = image_type(blob_name)
+    if content_length is not None and content_length > MAX_BYTES:
+        raise UploadError(413, f'image larger than {MAX_BYTES} bytes')
+    config = app.config
+    container_url = config.get('AZURE_CONTAINER_URL') or config.get('CONTAINER_URL')
+    sas_token = config.get('SAS_TOKEN')
+    svc = sb.get_service(container_url=container_url, sas_token=sas_token)
+    if not svc._sdk and not svc.container_url:
+        raise UploadError(503, 'blob storage is not configured')
+
+    started = time.monotonic()
+    try:
+        stored = svc.upload_stream(blob_name, read_chunks(stream, magic), content_type=content_type,
+                                   overwrite=overwrite)
+    except FileExistsError:
+        raise UploadError(409, f'{blob_name} already exists (add ?overwrite=1 to replace it)')
+    item = {k: stored.get(k) for k in ('name', 'lastModified', 'etag', 'url')}
+    logger.info("upload: stored %s (%d bytes) in %.2fs", blob_name, stored['size'], time.monotonic() - started)
+
+    # registration is best effort: the blob is stored, and polling would find it anyway
+    hub = events_hub.get_hub(app)
+    try:
+        sb.get_listing_index(svc).merge([item])
+        hub.notify_blobs([item])
+    except Exception:
+        logger.exception("upload: failed to register %s in the listing index", blob_name)
+    record = {
+        'deviceId': device_id,
+        'eventType': 'image_uploaded',
+        'imageFileName': blob_name,
+        'imageSize': stored['size'],
+        'blobUrl': item['url'],
+        'timestamp': int(time.time() * 1000),
+    }
+    try:
+        telemetry_store.insert_many([record])
+        hub.notify_telemetry()
+    except Exception:
+        logger.exception("upload: failed to record telemetry for %s", blob_name)
+
+    queued = False
+    analyzer = auto_analyze.get_analyzer(app)
+    if analyzer is not None and analyzer.status()['running']:
+        try:
+            # the analyzer may already have picked the blob up from the events published above
+            queued = analyzer.enqueue(blob_name, item['url'], item['etag']) or analyzer.pending(blob_name)
+        except Exception:
+            logger.exception("upload: failed to queue detection for %s", blob_name)
+    return dict(item, size=stored['size'], deviceId=device_id, analysisQueued=queued)
@@ -9,6 +9,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const detectionBadge = document.getElementById('detectionBadge');
     const analyzeSelectedButton = document.getElementById('analyzeSelected');
 
+    // newest images requested per list load (server pages the rest via next_cursor)
+    const LIST_PAGE_LIMIT = 200;
     let currentItems = [];
     let selectedIndex = -1;
     let lastDrawnDetections = [];
@@ -194,7 +196,7 @@ document.addEventListener('DOMContentLoaded', () => {
     analyzeSelectedButton.addEventListener('click', analyzeSelected);
 
     function loadLatest() {
-        fetch('/api/load_latest')
+        fetch('/api/load_latest?limit=' + LIST_PAGE_LIMIT)
             .then(response => response.json())
             .then(data => {
                 currentItems = Array.isArray(data.items) ? data.items : [];
@@ -515,16 +517,35 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 120);
     });
 
-    // new: fetch and render recent messages
+    // fetch and render recent messages: since_id deltas, 304s while nothing changed
+    const MESSAGES_LIMIT = 50;
+    let messageRows = [];
+    let messagesEtag = null;
+    let messagesLatestId = null;
+
     async function fetchMessages() {
       try {
-        const res = await fetch('/api/messages?limit=50');
-        if (!res.ok) return;
+        let url = '/api/messages?limit=' + MESSAGES_LIMIT;
+        if (messagesLatestId !== null) url += '&since_id=' + messagesLatestId;
+        const res = await fetch(url, { headers: messagesEtag ? { 'If-None-Match': messagesEtag } : {}, cache: 'no-store' });
+        if (res.status === 304 || !res.ok) return;
+        if (res.headers.get('X-Truncated')) {
+          // more new rows than fit the list: reload the newest page instead of catching up
+          messagesLatestId = null;
+          messagesEtag = null;
+          return fetchMessages();
+        }
         const messages = await res.json();
+        const seen = new Set(messages.map(m => m.id));
+        const keep = messagesLatestId === null ? [] : messageRows.filter(m => !seen.has(m.id));
+        messageRows = messages.concat(keep).slice(0, MESSAGES_LIMIT);
+        messagesEtag = res.headers.get('ETag');
+        const latest = res.headers.get('X-Latest-Id');
+        messagesLatestId = latest !== null ? Number(latest) : null;
         const list = document.getElementById('telemetry-list');
         if (!list) return;
         list.innerHTML = '';
-        messages.forEach(m => {
+        messageRows.forEach(m => {
           const div = document.createElement('div');
           div.className = 'telemetry-item';
           div.style.borderBottom = '1px solid #eee';
@@ -539,7 +560,7 @@ document.addEventListener('DOMContentLoaded', () => {
       }
     }
 
-    // start polling messages
+    // start polling messages (unchanged polls are answered 304 from memory)
     setInterval(fetchMessages, 5000);
     document.addEventListener('DOMContentLoaded', fetchMessages);
 });
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# keep the app's telemetry DB out of /var/lib/fruta while testing
+os.environ.setdefault('TELEMETRY_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='fruta-test-'), 'telemetry.db'))
@@ -0,0 +1,83 @@
+import json
+import time
+import threading
+import pytest
+from app import app
+from services import analyze_batch, detection, detection_cache, image_cache, telemetry_store
+from services import blob as sb
+from services.detection_cache import DetectionCache
+
+
+@pytest.fixture
+def fakes(tmp_path, monkeypatch):
+    cache = DetectionCache(db_path=str(tmp_path / 'cache.db'))
+    monkeypatch.setattr(detection_cache, 'get_cache', lambda: cache)
+    monkeypatch.setattr(image_cache, 'fetch_image', lambda url, name=None, etag=None: (b'img-' + name.encode(), 'image/jpeg', etag))
+    monkeypatch.setattr(sb, 'fetch_blob_data', lambda container_url=None, blob_name=None, sas_token=None: (
+        None if blob_name == 'missing.jpg' else {'blob_url': 'https://x/' + blob_name, 'etag': '"' + blob_name + '"'}))
+    recorded = []
+    monkeypatch.setattr(telemetry_store, 'record_analysis', lambda *a: recorded.append(a))
+    return recorded
+
+
+def test_detector_calls_are_bounded(fakes, monkeypatch):
+    active, peak, lock = [0], [0], threading.Lock()
+    def detector(img, content_type, key):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return [{'name': 'Mango', 'confidence': 0.9 if img.endswith(b'3.jpg') else 0.2}]
+    monkeypatch.setattr(detection, 'call_detector', detector)
+    gate = analyze_batch.DetectorGate(concurrency=2, rate_per_min=0)
+    items = analyze_batch.parse_items([f'b{i}.jpg' for i in range(6)])
+    results = list(analyze_batch.iter_batch(items, config={'API_NINJAS_KEY': 'k'}, workers=6, gate=gate))
+    assert sorted(r['index'] for r in results) == list(range(6))
+    assert peak[0] == 2
+    assert next(r for r in results if r['index'] == 3)['mango_likelihood'] == 0.9
+    assert len(fakes) == 6
+
+
+def test_rate_limited_calls_retry_and_failures_are_per_item(fakes, monkeypatch):
+    responses = [detection.DetectionError(502, {'error': 'rate limited', 'status': 429, 'retry_after': '0'}), []]
+    def detector(*a):
+        r = responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+    monkeypatch.setattr(detection, 'call_detector', detector)
+    gate = analyze_batch.DetectorGate(concurrency=1, rate_per_min=0)
+    items = analyze_batch.parse_items(['a.jpg', 'missing.jpg'])
+    results = sorted(analyze_batch.iter_batch(items, config={'API_NINJAS_KEY': 'k'}, gate=gate), key=lambda r: r['index'])
+    assert results[0]['status'] == 200 and results[0]['detections'] == []
+    assert results[1]['prediction'] is None and fakes == [('a.jpg', '"a.jpg"', 0.0, [])]
+
+
+def test_batch_endpoint_streams_ndjson(fakes, monkeypatch):
+    monkeypatch.setattr(detection, 'call_detector', lambda *a: [{'name': 'apple', 'confidence': 0.5}])
+    client = app.test_client()
+    assert client.post('/api/analyze/batch', json={'items': [{}]}).status_code == 400
+    response = client.post('/api/analyze/batch', json={'items': ['c1.jpg', {'blobName': 'c2.jpg'}]})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(l) for l in response.get_data(as_text=True).splitlines()]
+    assert sorted(l['blobName'] for l in lines[:2]) == ['c1.jpg', 'c2.jpg']
+    assert lines[-1]['done'] and lines[-1]['count'] == 2 and lines[-1]['failed'] == 0
+
+
+def test_blob_url_results_are_stored_and_cache_hits_backfilled(fakes, monkeypatch):
+    url = 'https://acct.blob.core.windows.net/cams/2024/cam-9.jpg?sv=x'
+    monkeypatch.setattr(detection, 'fetch_image', lambda u, name=None: (b'img-9', 'image/jpeg', '"0x9"'))
+    calls = []
+    monkeypatch.setattr(detection, 'call_detector', lambda *a: calls.append(a) or [{'name': 'mango', 'confidence': 0.7}])
+    stored = set()
+    monkeypatch.setattr(telemetry_store, 'analysis_current', lambda name, etag, *a: (name, etag) in stored)
+    result, etag = analyze_batch.analyze_one(blob_url=url, config={'API_NINJAS_KEY': 'k'})
+    assert result['mango_likelihood'] == 0.7 and etag == '"0x9"'
+    assert fakes == [('2024/cam-9.jpg', '"0x9"', 0.7, [{'name': 'mango', 'confidence': 0.7}])]
+    # a cache hit whose row is missing (e.g. computed by another process) is stored too
+    analyze_batch.analyze_one(blob_url=url, config={'API_NINJAS_KEY': 'k'})
+    stored.add(('2024/cam-9.jpg', '"0x9"'))
+    analyze_batch.analyze_one(blob_url=url, config={'API_NINJAS_KEY': 'k'})
+    assert len(calls) == 1 and len(fakes) == 2
@@ -25,4 +25,80 @@ def test_fetch_blob(client):
 def test_analyze_image(client):
     response = client.post('/api/analyze', json={'blobName': 'test_blob.jpg'})
     assert response.status_code == 200
-    assert 'prediction' in response.get_json()  # Check if prediction is in the response
\ No newline at end of file
+    assert 'prediction' in response.get_json()  # Check if prediction is in the response
+
+
+def test_messages_rejects_bad_cursor(client):
+    response = client.get('/api/messages?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+
+def test_telemetry_bulk_ndjson(client):
+    body = '{"deviceId": "bulk-dev", "eventType": "fruit_detected"}\n[1]\n{"deviceId": "bulk-dev"}\n'
+    response = client.post('/api/telemetry/bulk', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert summary['accepted'] == 2 and summary['rejected'] == 1
+    assert summary['errors'][0]['index'] == 1
+    rows = client.get('/api/messages?device=bulk-dev&payload=0').get_json()
+    assert len(rows) == 2
+
+
+def test_load_latest_rejects_bad_limit(client):
+    response = client.get('/api/load_latest?limit=abc')
+    assert response.status_code == 400
+
+
+def test_thumbnail_served_from_cache_with_etag(client, monkeypatch, tmp_path):
+    from services import blob as sb, image_cache
+    cache = image_cache.ImageCache(cache_dir=str(tmp_path))
+    monkeypatch.setattr(image_cache, 'get_cache', lambda: cache)
+    monkeypatch.setattr(image_cache, 'make_thumbnail', lambda data, size: b'thumb')
+    monkeypatch.setattr(image_cache, 'Image', object())
+    fetched = []
+    monkeypatch.setattr(sb, 'fetch_blob_content', lambda **kw: fetched.append(kw['blob_name']) or b'full')
+    for _ in range(2):
+        response = client.get('/api/thumbnail?name=cam/1.jpg&etag=%220x1%22&size=100')
+        assert response.status_code == 200 and response.data == b'thumb'
+    assert fetched == ['cam/1.jpg']
+    response = client.get('/api/thumbnail?name=cam/1.jpg&etag=%220x1%22&size=100', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_metrics_endpoint(client):
+    response = client.get('/api/metrics?device=esp32-1&metric=freeHeap')
+    assert response.status_code == 200 and 'freeHeap' in response.get_json()['series']
+    assert client.get('/api/metrics?resolution=5m').status_code == 400
+
+
+def test_messages_etag_and_since_id(client):
+    first = client.get('/api/messages?limit=5&payload=0')
+    etag, latest = first.headers['ETag'], int(first.headers['X-Latest-Id'])
+    assert client.get('/api/messages?limit=5&payload=0', headers={'If-None-Match': etag}).status_code == 304
+    body = '{"deviceId": "delta-dev"}\n{"deviceId": "delta-dev"}\n'
+    client.post('/api/telemetry/bulk', data=body, content_type='application/x-ndjson')
+    response = client.get(f'/api/messages?since_id={latest}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [r['deviceId'] for r in response.get_json()] == ['delta-dev', 'delta-dev']
+    assert int(response.headers['X-Latest-Id']) == latest + 2
+    assert client.get(f'/api/messages?since_id={latest + 2}').get_json() == []
+
+
+def test_messages_since_id_truncated_delta_resumes_without_gap(client):
+    latest = int(client.get('/api/messages?limit=1&payload=0').headers['X-Latest-Id'])
+    body = ''.join('{"deviceId": "gap-dev", "seq": %d}\n' % i for i in range(3))
+    client.post('/api/telemetry/bulk', data=body, content_type='application/x-ndjson')
+    page = client.get(f'/api/messages?since_id={latest}&limit=2')
+    assert page.headers['X-Truncated'] == '1' and 'ETag' not in page.headers
+    assert [r['payload']['seq'] for r in page.get_json()] == [1, 0]
+    rest = client.get(f"/api/messages?since_id={page.headers['X-Latest-Id']}&limit=2")
+    assert [r['payload']['seq'] for r in rest.get_json()] == [2] and 'X-Truncated' not in rest.headers
+
+
+def test_telemetry_bulk_lists_a_bounded_number_of_errors(client, monkeypatch):
+    from api import routes
+    monkeypatch.setattr(routes, 'BULK_MAX_ERRORS', 2)
+    body = 'bad\n' * 5 + '{"deviceId": "bulk-cap"}\n'
+    summary = client.post('/api/telemetry/bulk', data=body, content_type='application/x-ndjson').get_json()
+    assert summary['accepted'] == 1 and summary['rejected'] == 5
+    assert [e['index'] for e in summary['errors']] == [0, 1]
@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('asgiref')
+
+from asgi import app as asgi_app
+
+def request(method, path, **kwargs):
+    async def run():
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(run())
+
+def test_asgi_analyze_requires_blob():
+    response = request('POST', '/api/analyze', json={})
+    assert response.status_code == 400
+
+def test_asgi_analyze_without_storage_returns_empty_detection():
+    response = request('POST', '/api/analyze', json={'blobName': 'test_blob.jpg'})
+    assert response.status_code == 200
+    assert response.json()['prediction'] is None
+
+def test_asgi_delegates_other_routes_to_flask():
+    response = request('GET', '/api/debug/key_present')
+    assert response.status_code == 200
+    assert 'api_ninjas_key_configured' in response.json()
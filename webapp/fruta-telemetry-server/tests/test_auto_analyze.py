@@ -0,0 +1,91 @@
+import time
+import pytest
+from services import auto_analyze, detection, detection_cache, telemetry_store
+from services.events import Subscription
+from services.detection_cache import DetectionCache
+
+
+class FakeHub:
+    def __init__(self):
+        self.sub = Subscription()
+
+    def subscribe(self):
+        return self.sub
+
+    def unsubscribe(self, sub):
+        pass
+
+
+def wait_for(cond, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    cache = DetectionCache(db_path=str(tmp_path / 'cache.db'))
+    monkeypatch.setattr(detection_cache, 'get_cache', lambda: cache)
+    monkeypatch.setattr(detection, 'fetch_image', lambda url, name=None: (b'img', 'image/jpeg', '"e1"'))
+    recorded = []
+    monkeypatch.setattr(telemetry_store, 'record_analysis', lambda *a: recorded.append(a))
+    monkeypatch.setattr(telemetry_store, 'analysis_current', lambda *a: False)
+    hub = FakeHub()
+    a = auto_analyze.AutoAnalyzer(hub, {'API_NINJAS_KEY': 'k'}, workers=2, rate_per_min=0)
+    a.recorded, a.cache = recorded, cache
+    a.start()
+    yield a
+    a.stop()
+
+
+def test_new_blob_events_are_analyzed_once_and_cached(analyzer, monkeypatch):
+    calls = []
+    monkeypatch.setattr(detection, 'call_detector', lambda *a: calls.append(1) or [{'name': 'Mango', 'confidence': 0.7}])
+    item = {'name': 'cam/1.jpg', 'url': 'https://x/cam/1.jpg', 'etag': '"e1"'}
+    analyzer.hub.sub.put({'type': 'blobs', 'items': [item, {'name': 'cam/1.json', 'url': 'u', 'etag': 'e'}]})
+    assert wait_for(lambda: analyzer.recorded)
+    assert analyzer.recorded[0][:3] == ('cam/1.jpg', '"e1"', 0.7)
+    # the interactive /api/analyze path now hits the cache
+    assert analyzer.cache.get(detection_cache.key_for_blob('cam/1.jpg', '"e1"'))[0]['name'] == 'Mango'
+    # a cache hit whose row is already stored does not rewrite it
+    monkeypatch.setattr(telemetry_store, 'analysis_current', lambda *a: True)
+    analyzer.hub.sub.put({'type': 'blobs', 'items': [item]})
+    assert wait_for(lambda: analyzer.status()['cached'] == 1 and not analyzer.status()['pending'])
+    assert calls == [1] and len(analyzer.recorded) == 1
+
+
+def test_rate_limited_detection_pauses_and_retries(analyzer, monkeypatch):
+    responses = [detection.DetectionError(502, {'error': 'rate limited', 'status': 429, 'retry_after': '0'}), []]
+    def detector(*a):
+        r = responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+    monkeypatch.setattr(detection, 'call_detector', detector)
+    assert analyzer.enqueue('cam/2.png', 'https://x/cam/2.png', '"e2"')
+    assert wait_for(lambda: analyzer.recorded, timeout=8)
+    assert analyzer.status()['rate_limited'] == 1 and analyzer.recorded[0][2] == 0.0
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = auto_analyze.RateLimiter(rate_per_min=600)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_list_refresh_events_enqueue_blobs_new_since_last_listing(analyzer, monkeypatch):
+    monkeypatch.setattr(detection, 'call_detector', lambda *a: [])
+    listing = [{'name': 'cam/old.jpg', 'url': 'https://x/cam/old.jpg', 'etag': '"1"'}]
+    monkeypatch.setattr(auto_analyze.sb, 'list_blobs', lambda **kw: list(listing))
+    analyzer.hub.sub.put({'type': 'list', 'refresh': True})
+    assert wait_for(lambda: analyzer._seen is not None)
+    listing.insert(0, {'name': 'cam/new.jpg', 'url': 'https://x/cam/new.jpg', 'etag': '"2"'})
+    analyzer.hub.sub.put({'type': 'list', 'refresh': True})
+    assert wait_for(lambda: analyzer.recorded)
+    time.sleep(0.1)
+    assert [r[0] for r in analyzer.recorded] == ['cam/new.jpg']
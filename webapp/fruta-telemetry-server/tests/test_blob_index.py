@@ -0,0 +1,78 @@
+from services import blob as sb
+from services.blob import BlobListingIndex
+
+class FakeService:
+    """Serves a name-ordered listing in fixed-size pages, with markers like the Azure API."""
+
+    def __init__(self, blobs, page_size=2):
+        self.blobs = dict(blobs)
+        self.page_size = page_size
+        self.listed = []
+
+    def list_pages(self, prefix=None, marker=None, page_size=None):
+        names = sorted(n for n in self.blobs if n.startswith(prefix or ''))
+        start = int(marker) if marker else 0
+        while True:
+            chunk = names[start:start + self.page_size]
+            self.listed.extend(chunk)
+            nxt = start + self.page_size if start + self.page_size < len(names) else None
+            items = [{'name': n, 'lastModified': self.blobs[n], 'etag': n + self.blobs[n], 'url': 'u/' + n} for n in chunk]
+            yield (str(start) if start else None), items, (str(nxt) if nxt else None)
+            if nxt is None:
+                return
+            start = nxt
+
+def lm(minute):
+    return f'Mon, 06 Jan 2025 10:{minute:02d}:00 GMT'
+
+def test_full_listing_sorted_newest_first():
+    svc = FakeService({'a.jpg': lm(1), 'b.jpg': lm(3), 'c.jpg': lm(2)})
+    index = BlobListingIndex(ttl=60, full_refresh=600)
+    assert [i['name'] for i in index.items(svc)] == ['b.jpg', 'c.jpg', 'a.jpg']
+
+def test_incremental_refresh_only_lists_tail():
+    svc = FakeService({f'cam-{i:03d}.jpg': lm(i) for i in range(6)})
+    index = BlobListingIndex(ttl=0, full_refresh=600)
+    index.items(svc)
+    svc.listed.clear()
+    svc.blobs['cam-006.jpg'] = lm(30)
+    items = index.items(svc)
+    assert items[0]['name'] == 'cam-006.jpg'
+    assert len(items) == 7
+    # only the last page (from its marker) and the new page were re-listed
+    assert svc.listed == ['cam-004.jpg', 'cam-005.jpg', 'cam-006.jpg']
+
+def test_snapshot_is_a_copy():
+    svc = FakeService({'a.jpg': lm(1)})
+    index = BlobListingIndex(ttl=60, full_refresh=600)
+    index.items(svc).clear()
+    assert len(index.items(svc)) == 1
+
+def test_keyset_pages_newest_first():
+    svc = FakeService({f'cam-{i:03d}.jpg': lm(i) for i in range(5)})
+    index = BlobListingIndex(ttl=60, full_refresh=600)
+    names, cursor = [], None
+    while True:
+        items, cursor = index.page(svc, 2, cursor=cursor)
+        names.extend(i['name'] for i in items)
+        if not cursor:
+            break
+    assert names == [f'cam-{i:03d}.jpg' for i in range(4, -1, -1)]
+
+def test_services_are_shared_per_container_and_sas():
+    a = sb.get_service(container_url='https://acct.blob.core.windows.net/c1', sas_token='sv=1')
+    assert sb.get_service(container_url='https://acct.blob.core.windows.net/c1', sas_token='sv=1') is a
+    assert sb.get_service(container_url='https://acct.blob.core.windows.net/c2', sas_token='sv=1') is not a
+    sb.close_services()
+    assert sb.get_service(container_url='https://acct.blob.core.windows.net/c1', sas_token='sv=1') is not a
+
+def test_evicted_services_stay_usable(monkeypatch):
+    sb.close_services()
+    monkeypatch.setattr(sb, 'SERVICE_MAX', 1)
+    closed = []
+    monkeypatch.setattr(sb.BlobService, 'close', lambda self: closed.append(self))
+    a = sb.get_service(container_url='https://acct.blob.core.windows.net/c1')
+    b = sb.get_service(container_url='https://acct.blob.core.windows.net/c2')
+    # another thread may still hold `a`, so eviction only forgets it
+    assert closed == [] and b is not a
+    assert sb.get_service(container_url='https://acct.blob.core.windows.net/c1') is not a
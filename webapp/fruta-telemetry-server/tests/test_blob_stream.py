@@ -0,0 +1,69 @@
+import pytest
+import app as app_module
+from services import blob as sb
+from services import http_client
+
+DATA = bytes(range(256)) * 4
+
+
+class FakeStreamResponse:
+    """requests-style streamed response for a 1 KiB blob, honoring Range / If-None-Match."""
+
+    def __init__(self, headers):
+        self.headers = {'ETag': '"0x1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT',
+                        'Content-Type': 'application/octet-stream'}
+        body = DATA
+        if headers.get('If-None-Match') == '"0x1"':
+            self.status_code, body = 304, b''
+        elif headers.get('Range'):
+            start, end = sb.parse_range(headers['Range'], len(DATA))
+            self.status_code, body = 206, DATA[start:end + 1]
+            self.headers['Content-Range'] = f'bytes {start}-{end}/{len(DATA)}'
+        else:
+            self.status_code = 200
+        self.headers['Content-Length'] = str(len(body))
+        self.body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    svc = sb.BlobService(container_url='https://acct.blob.core.windows.net/cams')
+    svc._sdk = None
+    monkeypatch.setattr(app_module, 'get_service', lambda: svc)
+    monkeypatch.setattr(sb, 'STREAM_CHUNK_SIZE', 100)
+    monkeypatch.setattr(http_client, 'get', lambda url, endpoint=None, headers=None, stream=False: FakeStreamResponse(headers or {}))
+    with app_module.app.test_client() as c:
+        yield c
+
+
+def test_streams_full_blob_with_validators(client):
+    r = client.get('/api/fetch_blob_content?name=cam/1.jpg')
+    assert r.status_code == 200 and r.data == DATA
+    assert r.headers['ETag'] == '"0x1"' and r.headers['Accept-Ranges'] == 'bytes'
+    assert r.mimetype == 'image/jpeg'
+
+
+def test_range_and_conditional_requests(client):
+    r = client.get('/api/fetch_blob_content?name=cam/1.jpg', headers={'Range': 'bytes=10-19'})
+    assert r.status_code == 206 and r.data == DATA[10:20]
+    assert r.headers['Content-Range'] == 'bytes 10-19/1024'
+    r = client.get('/api/fetch_blob_content?name=cam/1.jpg', headers={'If-None-Match': '"0x1"'})
+    assert r.status_code == 304 and r.data == b''
+
+
+def test_parse_range():
+    assert sb.parse_range('bytes=0-99', 50) == (0, 49)
+    assert sb.parse_range('bytes=-10', 50) == (40, 49)
+    assert sb.parse_range('bytes=0-1,5-6', 50) is None
+    assert sb.parse_range('items=0-1', 50) is None
+    with pytest.raises(ValueError):
+        sb.parse_range('bytes=60-', 50)
+    assert sb.etag_matches('W/"a", "b"', '"a"') and not sb.etag_matches('"c"', '"a"')
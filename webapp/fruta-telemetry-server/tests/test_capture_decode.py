@@ -0,0 +1,34 @@
+import base64
+import io
+import json
+import pytest
+from services.capture_decode import ChunkStream, iter_decoded, decode_body
+
+def b64(obj):
+    return base64.b64encode(json.dumps(obj).encode()).decode()
+
+def decode(data, chunk=5):
+    stream = ChunkStream(data[i:i + chunk] for i in range(0, len(data), chunk))
+    return list(iter_decoded(stream, chunk_size=8))
+
+def test_json_lines_and_pretty_printed_envelopes():
+    body = '{"Body": "%s"}\n{\n  "Body": "%s",\n  "Properties": {}\n}\n' % (b64({'seq': 1}), b64({'seq': 2}))
+    records = decode(body.encode())
+    assert [r[2]['payload'] for r in records] == [{'seq': 1}, {'seq': 2}]
+    assert all(r[3] is None for r in records)
+
+def test_body_variants():
+    assert decode_body({'Body': {'seq': 3}})['payload'] == {'seq': 3}
+    assert decode_body({'Body': b'{"seq": 4}'})['payload'] == {'seq': 4}
+    assert decode_body({'body': base64.b64encode(b'plain').decode()}) == {'text': 'plain'}
+    assert decode_body({'EnqueuedTimeUtc': 'x'}) is None
+
+def test_avro_capture_file():
+    fastavro = pytest.importorskip('fastavro')
+    schema = fastavro.parse_schema({'type': 'record', 'name': 'EventData', 'fields': [
+        {'name': 'EnqueuedTimeUtc', 'type': 'string'},
+        {'name': 'Body', 'type': ['null', 'bytes']}]})
+    buf = io.BytesIO()
+    fastavro.writer(buf, schema, [{'EnqueuedTimeUtc': 't%d' % i, 'Body': json.dumps({'seq': i}).encode()} for i in range(50)])
+    records = decode(buf.getvalue(), chunk=64)
+    assert [r[2]['payload']['seq'] for r in records] == list(range(50))
@@ -0,0 +1,42 @@
+import threading
+import time
+from services.detection_cache import DetectionCache, key_for_blob
+
+def test_get_or_compute_caches_and_persists(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = DetectionCache(db_path=path)
+    calls = []
+    compute = lambda: calls.append(1) or [{'name': 'mango', 'confidence': 0.9}]
+    key = key_for_blob('cam-1.jpg', '"0x8D"')
+    assert cache.get_or_compute(key, compute) == [{'name': 'mango', 'confidence': 0.9}]
+    assert cache.get_or_compute(key, compute)[0]['name'] == 'mango'
+    cache.close()
+    # survives a restart
+    assert DetectionCache(db_path=path).get(key) == [{'name': 'mango', 'confidence': 0.9}]
+    assert len(calls) == 1
+
+def test_concurrent_requests_coalesce(tmp_path):
+    cache = DetectionCache(db_path=str(tmp_path / 'cache.db'))
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return []
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [[]] * 5
+    assert len(calls) == 1
+
+def test_eviction_by_age_and_size(tmp_path):
+    cache = DetectionCache(db_path=str(tmp_path / 'cache.db'), max_entries=2, max_age=3600)
+    for i in range(4):
+        cache.put(f'k{i}', [i])
+        time.sleep(0.01)
+    cache.evict()
+    assert cache.get('k0') is None and cache.get('k3') == [3]
+    cache.max_age = 0
+    assert cache.get('k3') is None
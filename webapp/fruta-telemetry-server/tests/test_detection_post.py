@@ -0,0 +1,48 @@
+from services import detection, detection_post
+from services.detection_post import KeywordMatcher, normalize
+
+
+def test_normalize_shapes_and_threshold():
+    raw = [{'label': 'Mango', 'confidence': '0.82', 'bounding_box': {'x1': '1'}},
+           {'name': 'car', 'score': 0.4},
+           {'labelName': 'apple', 'confidenceScore': 0.05},
+           'junk']
+    detections = normalize(raw, min_confidence=0.1)
+    assert [(d['name'], d['confidence']) for d in detections] == [('Mango', 0.82), ('car', 0.4)]
+    assert detections[0]['bounding_box'] == {'x1': '1'}
+
+
+def test_matcher_is_substring_and_case_insensitive():
+    matcher = KeywordMatcher(['mango', ' Apple ', ''])
+    assert matcher.keywords == {'mango', 'apple'}
+    matches, likelihood = matcher.summarize([{'name': 'Green Mango', 'confidence': 0.6},
+                                             {'name': 'pineapple', 'confidence': 0.9},
+                                             {'name': 'person', 'confidence': 0.99}])
+    assert [m['name'] for m in matches] == ['Green Mango', 'pineapple'] and likelihood == 0.9
+    assert KeywordMatcher([]).summarize([{'name': 'mango', 'confidence': 1.0}]) == ([], 0.0)
+    # legacy call style with a plain keyword set
+    assert detection.match_fruit([{'name': 'banana', 'confidence': 0.3}], {'banana'})[1] == 0.3
+
+
+def test_settings_endpoint_recompiles_matcher(monkeypatch):
+    from app import app
+    from api import routes
+    monkeypatch.setattr(detection_post, '_matcher', None)
+    client = app.test_client()
+    assert client.post('/api/settings', json={'fruitKeywords': 'durian'}).status_code == 403
+    monkeypatch.setattr(routes, 'ADMIN_TOKEN', 's3cret')
+    assert client.post('/api/settings', json={'fruitKeywords': 'durian'},
+                       headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    auth = {'Authorization': 'Bearer s3cret'}
+    assert client.post('/api/settings', json={'fruitKeywords': []}, headers=auth).status_code == 400
+    response = client.post('/api/settings', json={'fruitKeywords': 'Durian, mango'}, headers=auth)
+    assert response.get_json()['fruitKeywords'] == ['durian', 'mango']
+    assert detection_post.get_matcher().matches('durian')
+    assert client.get('/api/settings').get_json()['fruitKeywords'] == ['durian', 'mango']
+    app.config.pop('FRUIT_KEYWORDS', None)
+
+
+def test_runtime_api_key_takes_precedence_over_env(monkeypatch):
+    monkeypatch.setenv('API_NINJAS_KEY', 'from-env')
+    assert detection.api_key({'API_NINJAS_KEY': 'from-settings'}) == 'from-settings'
+    assert detection.api_key({'API_NINJAS_KEY': None}) == 'from-env'
@@ -0,0 +1,90 @@
+import threading
+import pytest
+from services import detection, detector_backends
+from services.detector_backends import BatchingDetector
+
+
+class FakeModel:
+    name = 'fake'
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def detect_many(self, images):
+        self.release.wait(5)
+        self.batches.append(list(images))
+        if b'bad' in images:
+            raise ValueError('broken image')
+        return [[{'name': img.decode(), 'confidence': 1.0}] for img in images]
+
+
+def test_concurrent_images_share_inference_calls():
+    model = FakeModel()
+    backend = BatchingDetector(model, batch_size=4, batch_wait_ms=200)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.update({i: backend.detect(f'img{i}'.encode(), 'image/jpeg')}))
+               for i in range(4)]
+    for t in threads:
+        t.start()
+    model.release.set()
+    for t in threads:
+        t.join(5)
+    backend.close()
+    assert results[2][0]['name'] == 'img2'
+    assert sum(len(b) for b in model.batches) == 4 and len(model.batches) <= 2
+    assert backend.cache_key('blob:a:1') == 'fake:blob:a:1'
+
+
+def test_inference_failure_is_a_detection_error():
+    model = FakeModel()
+    model.release.set()
+    backend = BatchingDetector(model, batch_size=1, batch_wait_ms=0)
+    with pytest.raises(detection.DetectionError) as e:
+        backend.detect(b'bad', 'image/jpeg')
+    assert e.value.status == 502
+    assert backend.detect(b'ok', 'image/jpeg')[0]['name'] == 'ok'
+    backend.close()
+
+
+def test_undecodable_image_fails_only_its_own_caller():
+    class PerItemModel(FakeModel):
+        def detect_many(self, images):
+            self.batches.append(list(images))
+            return [detection.DetectionError(502, {'error': 'could not decode image'}) if img == b'bad'
+                    else [{'name': img.decode(), 'confidence': 1.0}] for img in images]
+    model = PerItemModel()
+    backend = BatchingDetector(model, batch_size=2, batch_wait_ms=500)
+    results = {}
+
+    def run(img):
+        try:
+            results[img] = backend.detect(img, 'image/jpeg')
+        except detection.DetectionError as e:
+            results[img] = e
+    threads = [threading.Thread(target=run, args=(img,)) for img in (b'bad', b'good')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    backend.close()
+    assert model.batches and len(model.batches[0]) == 2
+    assert isinstance(results[b'bad'], detection.DetectionError)
+    assert results[b'good'][0]['name'] == 'good'
+
+
+def test_default_backend_is_api_ninjas(monkeypatch):
+    backend = detector_backends.create_backend()
+    assert backend.rate_limited and backend.cache_key('blob:a:1') == 'blob:a:1'
+    monkeypatch.setattr(detection, 'call_detector', lambda img, ct, key: [{'name': 'mango', 'key': key}])
+    assert backend.detect(b'x', 'image/jpeg', {'API_NINJAS_KEY': 'k'})[0]['key'] in ('k', detection.api_key())
+    with pytest.raises(RuntimeError):
+        detector_backends.create_backend('onnx' if not detector_backends.MODEL_PATH else 'nope')
+
+
+def test_nms_keeps_best_box_per_class():
+    np = pytest.importorskip('numpy')
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [0, 0, 10, 10], [50, 50, 60, 60]], dtype=float)
+    scores = np.array([0.9, 0.8, 0.7, 0.6])
+    classes = np.array([0, 0, 1, 0])
+    assert detector_backends._nms(boxes, scores, classes, 0.5) == [0, 2, 3]
@@ -0,0 +1,46 @@
+from unittest import mock
+from services.events import ChangeHub, Subscription
+
+def blob(name, etag):
+    return {'name': name, 'etag': etag, 'lastModified': None, 'url': 'u/' + name}
+
+def test_hub_publishes_new_blobs_to_all_subscribers():
+    hub = ChangeHub(poll_sec=60)
+    listing = [blob('a.jpg', '1')]
+    with mock.patch('services.events.sb.list_blobs', side_effect=lambda **kw: list(listing)), \
+         mock.patch('services.events.telemetry_store.latest_id', return_value=0):
+        subs = [Subscription(), Subscription()]
+        for sub in subs:
+            hub._subs.add(sub)
+        hub.poll_once()
+        listing.insert(0, blob('b.jpg', '2'))
+        hub.poll_once()
+    for sub in subs:
+        event = sub.get(timeout=1)
+        assert event['type'] == 'blobs'
+        assert [i['name'] for i in event['items']] == ['b.jpg']
+        assert sub.get(timeout=0.01) is None
+
+def test_slow_subscriber_gets_resync_on_overflow():
+    sub = Subscription(maxsize=2)
+    for i in range(5):
+        sub.put({'type': 'blobs', 'items': [i]})
+    event = sub.get(timeout=1)
+    assert event['type'] == 'list' and event['refresh']
+
+def test_telemetry_bursts_are_announced_page_by_page():
+    rows = [{'id': i} for i in range(1, 8)]
+    def query(limit, after_id, include_payload):
+        return list(reversed([r for r in rows if r['id'] > after_id][:limit])), None
+    hub = ChangeHub(poll_sec=60)
+    hub._last_message_id = 0
+    sub = Subscription()
+    hub._subs.add(sub)
+    with mock.patch('services.events.MAX_EVENT_ITEMS', 3), \
+         mock.patch('services.events.telemetry_store.latest_id', return_value=7), \
+         mock.patch('services.events.telemetry_store.query_messages', side_effect=query):
+        hub.notify_telemetry()
+    announced = []
+    while (event := sub.get(timeout=0.01)) is not None:
+        announced += [r['id'] for r in event['rows']]
+    assert sorted(announced) == list(range(1, 8)) and hub._last_message_id == 7
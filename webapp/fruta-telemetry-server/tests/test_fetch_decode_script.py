@@ -0,0 +1,90 @@
+import base64
+import importlib.util
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+
+_spec = importlib.util.spec_from_file_location(
+    'fetch_decode_latest_blob', os.path.join(os.path.dirname(__file__), '..', 'scripts', 'fetch_decode_latest_blob.py'))
+script = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(script)
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def envelope(payload):
+    return json.dumps({'Body': base64.b64encode(json.dumps(payload).encode()).decode()})
+
+
+class FakeContainer:
+    def __init__(self, blobs, fail=()):
+        self.blobs = blobs  # name -> (last_modified, payload)
+        self.fail = set(fail)
+        self.listed = []
+
+    def list_blobs(self, name_starts_with=None):
+        self.listed.append(name_starts_with)
+        return [SimpleNamespace(name=n, last_modified=lm) for n, (lm, _) in self.blobs.items()
+                if n.startswith(name_starts_with or '')]
+
+    def download_blob(self, name):
+        if name in self.fail:
+            raise IOError('boom')
+        data = envelope(self.blobs[name][1]).encode()
+        return SimpleNamespace(chunks=lambda: iter([data[:5], data[5:]]))
+
+
+class Batcher:
+    def __init__(self):
+        self.sent = []
+
+    def add(self, payload):
+        self.sent.append(payload['seq'])
+
+    def flush(self):
+        pass
+
+
+def test_ordered_checkpoint_never_skips_failed_blob(tmp_path):
+    state = str(tmp_path / 'state.json')
+    blobs = {f'hub/0/b{i}': (T0 + timedelta(minutes=i), {'seq': i}) for i in range(6)}
+    container, batcher = FakeContainer(blobs, fail={'hub/0/b2'}), Batcher()
+    assert script.process_new_blobs(container, batcher, state, workers=3) == 5
+    assert batcher.sent == [0, 1, 3, 4, 5]
+    watermark, done = script.read_state(state)
+    assert watermark[1] == 'hub/0/b1' and sorted(done) == ['hub/0/b3', 'hub/0/b4', 'hub/0/b5']
+    # next poll retries only the failed blob, then the watermark catches up
+    container.fail.clear()
+    assert script.process_new_blobs(container, batcher, state, workers=3) == 1
+    assert batcher.sent[-1] == 2
+    watermark, done = script.read_state(state)
+    assert watermark[1] == 'hub/0/b5' and done == {}
+
+
+def test_legacy_state_and_date_prefixes(tmp_path):
+    state = tmp_path / 'state.json'
+    state.write_text(json.dumps({'last_processed': T0.isoformat()}))
+    blobs = {'a': (T0, {'seq': 1}), 'b': (T0 + timedelta(seconds=1), {'seq': 2})}
+    batcher = Batcher()
+    script.process_new_blobs(FakeContainer(blobs), batcher, str(state), workers=2)
+    assert batcher.sent == [2]
+    prefixes = script.listing_prefixes(['hub/0/'], '%Y/%m/%d/', T0.isoformat(), now=T0 + timedelta(days=1))
+    assert prefixes == ['hub/0/2024/04/30/', 'hub/0/2024/05/01/', 'hub/0/2024/05/02/']
+
+
+def test_blob_whose_bulk_post_fails_is_not_checkpointed(tmp_path):
+    state = str(tmp_path / 'state.json')
+    blobs = {f'hub/0/b{i}': (T0 + timedelta(minutes=i), {'seq': i}) for i in range(3)}
+    batcher = script.TelemetryBatcher(bulk_url='http://server/api/telemetry/bulk')
+    posted, statuses = [], [200, 500, 200]
+
+    def post(url, data=None, **kw):
+        posted.append([json.loads(line)['seq'] for line in data.decode().splitlines()])
+        return SimpleNamespace(status_code=statuses.pop(0), text='boom', json=lambda: {})
+    batcher.session.post = post
+    assert script.process_new_blobs(FakeContainer(blobs), batcher, state, workers=2) == 2
+    assert posted == [[0], [1], [2]]
+    watermark, done = script.read_state(state)
+    assert watermark[1] == 'hub/0/b0' and list(done) == ['hub/0/b2']
@@ -0,0 +1,71 @@
+import pytest
+import requests
+from services import http_client
+
+
+class FakeResponse:
+    def __init__(self, status, headers=None):
+        self.status_code = status
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, kwargs.get('timeout')))
+        out = self.outcomes.pop(0)
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    slept = []
+    monkeypatch.setattr(http_client.time, 'sleep', slept.append)
+    return slept
+
+
+def use(monkeypatch, session):
+    monkeypatch.setattr(http_client, 'get_session', lambda url: session)
+    return session
+
+
+def test_sessions_are_pooled_per_host():
+    a = http_client.get_session('https://acct.blob.core.windows.net/c/a.jpg')
+    assert a is http_client.get_session('https://acct.blob.core.windows.net/c/b.jpg?sv=1')
+    assert a is not http_client.get_session('https://api.api-ninjas.com/v1/objectdetection')
+
+
+def test_429_retried_honoring_retry_after(monkeypatch, no_sleep):
+    s = use(monkeypatch, FakeSession([FakeResponse(429, {'Retry-After': '2'}), FakeResponse(200)]))
+    resp = http_client.post('https://api.example/x', endpoint='detect', files={})
+    assert resp.status_code == 200 and no_sleep == [2.0]
+    assert s.calls[0] == ('POST', http_client.timeout('detect'))
+
+
+def test_long_retry_after_is_returned_not_slept(monkeypatch, no_sleep):
+    use(monkeypatch, FakeSession([FakeResponse(429, {'Retry-After': '3600'})]))
+    assert http_client.post('https://api.example/x').status_code == 429
+    assert no_sleep == []
+
+
+def test_post_not_resent_after_server_error_or_connection_error(monkeypatch, no_sleep):
+    use(monkeypatch, FakeSession([FakeResponse(503)]))
+    assert http_client.post('https://api.example/x').status_code == 503
+    use(monkeypatch, FakeSession([requests.ConnectionError('reset')]))
+    with pytest.raises(requests.ConnectionError):
+        http_client.post('https://api.example/x')
+
+
+def test_get_retries_connection_errors_with_backoff(monkeypatch, no_sleep):
+    s = use(monkeypatch, FakeSession([requests.ConnectionError('reset'), FakeResponse(502), FakeResponse(200)]))
+    assert http_client.get('https://acct/c/a.jpg', endpoint='blob_get').status_code == 200
+    assert len(s.calls) == 3 and len(no_sleep) == 2
+    assert all(0 <= d <= http_client.BACKOFF_MAX for d in no_sleep)
@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+import pytest
+from services import image_cache
+from services.image_cache import ImageCache, key_for_image
+
+def test_lru_eviction_respects_byte_budget(tmp_path):
+    cache = ImageCache(cache_dir=str(tmp_path), max_bytes=250)
+    for i in range(3):
+        cache.put(key_for_image(f'cam/{i}.jpg', '"e"'), bytes(100))
+    assert cache.size() <= 250
+    assert cache.get(key_for_image('cam/0.jpg', '"e"')) is None
+    assert cache.get(key_for_image('cam/2.jpg', '"e"')) == bytes(100)
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.bin')]) == 2
+
+def test_entries_survive_restart_and_new_etag_misses(tmp_path):
+    ImageCache(cache_dir=str(tmp_path)).put(key_for_image('cam/1.jpg', '"e1"'), b'jpeg')
+    cache = ImageCache(cache_dir=str(tmp_path))
+    assert cache.get(key_for_image('cam/1.jpg', '"e1"')) == b'jpeg'
+    assert cache.get(key_for_image('cam/1.jpg', '"e2"')) is None
+
+def test_concurrent_fetches_share_one_download(tmp_path):
+    cache = ImageCache(cache_dir=str(tmp_path))
+    calls = []
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return b'img'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch('k', fetch))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [b'img'] * 4 and calls == [1]
+
+def test_make_thumbnail_fits_requested_size():
+    Image = pytest.importorskip('PIL.Image')
+    import io
+    buf = io.BytesIO()
+    Image.new('RGB', (800, 600), 'orange').save(buf, 'JPEG')
+    thumb = image_cache.make_thumbnail(buf.getvalue(), 160)
+    with Image.open(io.BytesIO(thumb)) as img:
+        assert max(img.size) <= 160
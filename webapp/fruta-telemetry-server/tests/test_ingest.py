@@ -0,0 +1,80 @@
+import base64
+import json
+import pytest
+from services import blob as sb
+from services import ingest, telemetry_store
+from services.telemetry_store import TelemetryStore
+
+
+def capture(*payloads):
+    lines = [json.dumps({'Body': base64.b64encode(json.dumps(p).encode()).decode(),
+                         'SystemProperties': {'connectionDeviceId': 'esp32-9'}}) for p in payloads]
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class FakeService:
+    _sdk = None
+    container_url = 'https://acct.blob.core.windows.net/capture'
+
+    def __init__(self):
+        self.blobs = {}  # name -> (etag, bytes)
+        self.opened = []
+
+    def open_blob(self, name):
+        self.opened.append(name)
+        etag, data = self.blobs[name]
+        return sb.BlobStream(200, {'ETag': etag}, iter([data[:7], data[7:]]))
+
+
+class FakeIndex:
+    def __init__(self, svc):
+        self.svc = svc
+
+    def items(self, svc, max_age=None):
+        # newest first, like the listing index
+        return [{'name': n, 'etag': e} for n, (e, _) in reversed(list(self.svc.blobs.items()))]
+
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch):
+    store = TelemetryStore(db_path=str(tmp_path / 'telemetry.db'), flush_interval_ms=10)
+    store.init_db()
+    svc = FakeService()
+    monkeypatch.setattr(telemetry_store, 'get_store', lambda: store)
+    monkeypatch.setattr(sb, 'get_service', lambda **kw: svc)
+    monkeypatch.setattr(sb, 'get_listing_index', lambda s, prefix=None: FakeIndex(svc))
+    yield store, svc, ingest.CaptureIngestor(batch_size=2)
+    store.close()
+
+
+def test_ingests_new_blobs_once_with_device_from_envelope(setup):
+    store, svc, ingestor = setup
+    svc.blobs['hub/0/a'] = ('"1"', capture({'seq': 1}, {'seq': 2}, {'seq': 3}))
+    svc.blobs['hub/0/b.jpg'] = ('"1"', b'jpeg')
+    assert ingestor.poll_once() == 3
+    assert ingestor.poll_once() == 0
+    assert svc.opened == ['hub/0/a']
+    msgs = store.get_messages(limit=10)
+    assert sorted(m['payload']['seq'] for m in msgs) == [1, 2, 3]
+    assert {m['deviceId'] for m in msgs} == {'esp32-9'}
+
+
+def test_grown_blob_resumes_after_checkpoint(setup):
+    store, svc, ingestor = setup
+    svc.blobs['hub/0/a'] = ('"1"', capture({'seq': 1}))
+    ingestor.poll_once()
+    svc.blobs['hub/0/a'] = ('"2"', capture({'seq': 1}, {'seq': 2}))
+    assert ingestor.poll_once() == 1
+    assert sorted(m['payload']['seq'] for m in store.get_messages(limit=10)) == [1, 2]
+    assert store.get_ingest_checkpoints(ingestor.source) == {'hub/0/a': ('"2"', 2)}
+
+
+def test_control_endpoints_require_admin_token(monkeypatch):
+    from app import app
+    from api import routes
+    client = app.test_client()
+    monkeypatch.setattr(routes, 'ADMIN_TOKEN', None)
+    assert client.post('/api/ingest/start').status_code == 403
+    monkeypatch.setattr(routes, 'ADMIN_TOKEN', 's3cret')
+    assert client.post('/api/ingest/stop', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    assert client.post('/api/ingest/stop', headers={'Authorization': 'Bearer s3cret'}).get_json()['stopped']
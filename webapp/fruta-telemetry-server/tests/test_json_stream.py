@@ -0,0 +1,31 @@
+import io
+from services.json_stream import iter_json_records
+
+def parse(body, chunk_size=7):
+    return list(iter_json_records(io.BytesIO(body.encode('utf-8')), chunk_size=chunk_size))
+
+def test_parses_array_across_chunk_boundaries():
+    records = parse('[ {"deviceId": "esp32-1", "freeHeap": 123456}, {"deviceId": "é"} , 42 ]')
+    assert [r[1] for r in records] == [{'deviceId': 'esp32-1', 'freeHeap': 123456}, {'deviceId': 'é'}, 42]
+    assert all(r[2] is None for r in records)
+
+def test_ndjson_skips_bad_lines():
+    records = parse('{"a": 1}\n\nnot json\n{"b": 2}')
+    assert [(i, obj) for i, obj, err in records if err is None] == [(0, {'a': 1}), (2, {'b': 2})]
+    assert records[1][0] == 1 and records[1][2].startswith('invalid json')
+
+def test_truncated_array_reports_error():
+    records = parse('[{"a": 1}, {"b": ')
+    assert records[0] == (0, {'a': 1}, None)
+    assert records[1][0] == 1 and records[1][2]
+
+def test_malformed_array_element_stops_without_reading_the_rest():
+    body = io.BytesIO(('[{"a": 1}, {"b": nope}, ' + '{"c": "' + 'x' * 1000 + '"}, ' * 200 + ']').encode('utf-8'))
+    records = list(iter_json_records(body, chunk_size=64))
+    assert records[0] == (0, {'a': 1}, None)
+    assert records[1][0] == 1 and records[1][2].startswith('invalid json')
+    assert body.tell() <= 128
+
+def test_long_string_split_across_many_chunks():
+    records = parse('[{"s": "' + 'y' * 5000 + '"}]')
+    assert records == [(0, {'s': 'y' * 5000}, None)]
@@ -0,0 +1,111 @@
+import json
+import time
+import threading
+import pytest
+from services import mqtt_ingest, telemetry_store
+from services.events import ChangeHub, Subscription
+from services.telemetry_store import TelemetryStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = TelemetryStore(db_path=str(tmp_path / 'telemetry.db'), flush_interval_ms=10)
+    store.init_db()
+    monkeypatch.setattr(telemetry_store, 'get_store', lambda: store)
+    yield store
+    store.close()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_decode_message_fills_device_from_topic():
+    topic = 'devices/esp32-1/messages/events/%24.ct=application%2Fjson'
+    assert mqtt_ingest.decode_message(topic, b'{"seq": 1}') == [{'seq': 1, 'deviceId': 'esp32-1'}]
+    assert mqtt_ingest.decode_message(topic, b'[{"seq": 1, "deviceId": "x"}, 3]') == [{'seq': 1, 'deviceId': 'x'}]
+    assert mqtt_ingest.decode_message('sensors/t', b'{"a": 1}\nbad\n{"a": 2}') == [{'a': 1}, {'a': 2}]
+    assert mqtt_ingest.decode_message(topic, b'not json') == []
+
+
+def test_messages_committed_in_batches_and_announced(store):
+    hub = ChangeHub(poll_sec=60)
+    hub._last_message_id = 0
+    sub = Subscription()
+    hub._subs.add(sub)
+    ingestor = mqtt_ingest.MqttIngestor(hub=hub, host='localhost', batch_size=3, flush_ms=50)
+    ingestor._start_writer()
+    try:
+        for seq in range(5):
+            ingestor.handle_message('devices/esp32-7/messages/events/', json.dumps({'seq': seq}).encode())
+        ingestor.handle_message('devices/esp32-7/messages/events/', b'garbage')
+        wait_for(lambda: ingestor.stats['records'] == 5)
+    finally:
+        assert ingestor.stop()
+    assert ingestor.stats['batches'] == 2 and ingestor.stats['rejected'] == 1
+    msgs = store.get_messages(limit=10)
+    assert sorted(m['payload']['seq'] for m in msgs) == [0, 1, 2, 3, 4]
+    assert {m['deviceId'] for m in msgs} == {'esp32-7'}
+    announced = []
+    while (event := sub.get(timeout=0.01)) is not None:
+        announced += event['rows']
+    assert len(announced) == 5
+
+
+def test_failed_commit_is_retried_not_discarded(store, monkeypatch):
+    monkeypatch.setattr(mqtt_ingest, 'RETRY_SEC', 0.01)
+    insert_many, calls = telemetry_store.insert_many, []
+    def flaky(payloads):
+        calls.append(len(payloads))
+        if len(calls) == 1:
+            raise RuntimeError('database is locked')
+        return insert_many(payloads)
+    monkeypatch.setattr(telemetry_store, 'insert_many', flaky)
+    ingestor = mqtt_ingest.MqttIngestor(host='localhost', batch_size=10, flush_ms=50)
+    ingestor._start_writer()
+    try:
+        ingestor.handle_message('devices/a/messages/events/', b'[{"seq": 1}, {"seq": 2}]')
+        wait_for(lambda: ingestor.stats['records'] == 2)
+    finally:
+        assert ingestor.stop()
+    assert calls == [2, 2] and ingestor.stats['errors'] == 1 and ingestor.stats['dropped'] == 0
+    assert sorted(m['payload']['seq'] for m in store.get_messages(limit=10)) == [1, 2]
+
+
+def test_full_backlog_blocks_then_drops(store):
+    ingestor = mqtt_ingest.MqttIngestor(host='localhost', queue_size=1, block_sec=0.1)
+    ingestor.handle_message('devices/a/messages/events/', b'{"seq": 1}')
+    ingestor.handle_message('devices/a/messages/events/', b'{"seq": 2}')
+    assert ingestor.stats['dropped'] == 1
+    assert ingestor.status()['queued'] == 1
+    # one deadline per message, not per record
+    started = time.monotonic()
+    ingestor.handle_message('devices/a/messages/events/', b'[{"seq": 3}, {"seq": 4}, {"seq": 5}]')
+    assert ingestor.stats['dropped'] == 4 and time.monotonic() - started < 0.25
+
+
+def test_restart_refused_while_old_writer_drains(monkeypatch):
+    monkeypatch.setattr(mqtt_ingest, 'mqtt', object())  # start() fails before touching the client
+    ingestor = mqtt_ingest.MqttIngestor(host='localhost')
+    release = threading.Event()
+    ingestor._writer = threading.Thread(target=release.wait)
+    ingestor._writer.start()
+    try:
+        with pytest.raises(RuntimeError):
+            ingestor.start()
+    finally:
+        release.set()
+        ingestor._writer.join()
+
+
+def test_control_endpoints_require_admin_token(monkeypatch):
+    from app import app
+    from api import routes
+    client = app.test_client()
+    monkeypatch.setattr(routes, 'ADMIN_TOKEN', None)
+    assert client.post('/api/mqtt/stop').status_code == 403
+    monkeypatch.setattr(routes, 'ADMIN_TOKEN', 's3cret')
+    assert client.post('/api/mqtt/start', headers={'Authorization': 'Bearer nope'}).status_code == 401
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import pytest
+from services.telemetry_store import TelemetryStore
+
+@pytest.fixture
+def store(tmp_path):
+    s = TelemetryStore(db_path=str(tmp_path / 'telemetry.db'), flush_size=10, flush_interval_ms=20)
+    s.init_db()
+    yield s
+    s.close()
+
+def test_insert_and_get_messages(store):
+    for i in range(25):
+        store.insert_message({'deviceId': 'esp32-1', 'imageFileName': f'img-{i}.jpg', 'seq': i})
+    assert store.flush(timeout=5)
+    msgs = store.get_messages(limit=5)
+    assert [m['payload']['seq'] for m in msgs] == [24, 23, 22, 21, 20]
+    assert msgs[0]['deviceId'] == 'esp32-1'
+    assert msgs[0]['imageFileName'] == 'img-24.jpg'
+
+def test_close_flushes_pending_rows(tmp_path):
+    path = str(tmp_path / 'telemetry.db')
+    s = TelemetryStore(db_path=path, flush_size=1000, flush_interval_ms=60000)
+    s.init_db()
+    for i in range(3):
+        s.insert_message({'deviceId': 'esp32-1', 'seq': i})
+    s.close()
+    reopened = TelemetryStore(db_path=path)
+    assert len(reopened.get_messages(limit=10)) == 3
+    reopened.close()
+
+def test_wal_mode_enabled(store):
+    with store._reader() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+def test_typed_columns_and_filters(store):
+    store.insert_message({'deviceId': 'esp32-1', 'eventType': 'fruit_detected', 'imageWidth': 800,
+                          'imageHeight': 600, 'imageSize': 12345, 'blobUrl': 'https://x/b.jpg'})
+    store.insert_message({'deviceId': 'esp32-2', 'freeHeap': '1024', 'wifiStrength': -61, 'status': 'active'})
+    assert store.flush(timeout=5)
+    rows, _ = store.query_messages(device='esp32-1', include_payload=False)
+    assert len(rows) == 1
+    assert 'payload' not in rows[0]
+    assert rows[0]['imageWidth'] == 800 and rows[0]['blobUrl'] == 'https://x/b.jpg'
+    rows, _ = store.query_messages(event_type='fruit_detected')
+    assert [r['deviceId'] for r in rows] == ['esp32-1']
+    rows, _ = store.query_messages(device='esp32-2')
+    assert rows[0]['freeHeap'] == 1024 and rows[0]['wifiStrength'] == -61
+    assert store.query_messages(since='2999-01-01')[0] == []
+    assert len(store.query_messages(until='2999-01-01T00:00:00Z')[0]) == 2
+
+def test_keyset_cursor_pagination(store):
+    for i in range(7):
+        store.insert_message({'deviceId': 'esp32-1', 'seq': i})
+    assert store.flush(timeout=5)
+    seen, cursor = [], None
+    while True:
+        rows, cursor = store.query_messages(limit=3, cursor=cursor)
+        seen.extend(r['payload']['seq'] for r in rows)
+        if not cursor:
+            break
+    assert seen == [6, 5, 4, 3, 2, 1, 0]
+
+def test_migrates_legacy_schema(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, received_at TEXT DEFAULT (datetime('now')), "
+                 "deviceId TEXT, imageFileName TEXT, payload TEXT)")
+    conn.execute("INSERT INTO messages (deviceId, payload) VALUES (?, ?)",
+                 ('esp32-1', json.dumps({'deviceId': 'esp32-1', 'eventType': 'fruit_detected', 'freeHeap': 99})))
+    conn.commit()
+    conn.close()
+    s = TelemetryStore(db_path=path)
+    s.init_db()
+    rows, _ = s.query_messages(event_type='fruit_detected', include_payload=False)
+    assert rows[0]['freeHeap'] == 99
+    s.close()
+
+def test_analyses_link_to_telemetry_by_blob_name(store):
+    store.insert_message({'deviceId': 'esp32-2', 'blobUrl': 'https://acct.blob.core.windows.net/cams/2024/cam-1.jpg?sv=x'})
+    store.record_analysis('2024/cam-1.jpg', '"0x1"', 0.8, [{'name': 'mango', 'confidence': 0.8}])
+    store.record_analysis('2024/cam-2.jpg', '"0x2"', 0.1, [])
+    assert store.flush(timeout=5)
+    rows = store.query_analyses(min_likelihood=0.5)
+    assert [r['blobName'] for r in rows] == ['2024/cam-1.jpg']
+    assert rows[0]['deviceId'] == 'esp32-2' and rows[0]['detections'][0]['name'] == 'mango'
+    unlinked = store.query_analyses(blob_names=['2024/cam-2.jpg'], include_detections=False)
+    assert unlinked[0]['message_id'] is None and 'detections' not in unlinked[0]
+    assert store.analysis_current('2024/cam-2.jpg', '"0x2"', 0.1, [])
+    assert not store.analysis_current('2024/cam-2.jpg', '"0x2"', 0.3, [])
+    # a version without an ETag is replaced like any other
+    store.record_analysis('2024/cam-3.jpg', None, 0.2, [])
+    store.record_analysis('2024/cam-3.jpg', None, 0.6, [])
+    assert store.flush(timeout=5)
+    assert [r['mango_likelihood'] for r in store.query_analyses(blob_names=['2024/cam-3.jpg'])] == [0.6]
+
+def test_rollups_follow_inserts_and_downsample(store):
+    for heap in (100, 300, 200):
+        store.insert_message({'deviceId': 'esp32-1', 'freeHeap': heap, 'status': 'active'})
+    store.insert_message({'deviceId': 'esp32-2', 'freeHeap': 1000})
+    assert store.flush(timeout=5)
+    resolution, series = store.query_metrics(device='esp32-1', metrics=['freeHeap', 'status'])
+    assert resolution == '1h'
+    point = series['freeHeap'][-1]
+    assert (point['count'], point['min'], point['max'], point['avg'], point['last']) == (3, 100, 300, 200, 200)
+    assert series['status'][-1]['last'] == 'active' and series['status'][-1]['avg'] is None
+    _, fleet = store.query_metrics(metrics=['freeHeap'], resolution='1d')
+    assert fleet['freeHeap'][-1]['count'] == 4 and fleet['freeHeap'][-1]['max'] == 1000
+    with pytest.raises(ValueError):
+        store.query_metrics(metrics=['bogus'])
+
+def test_rollups_backfilled_for_existing_rows(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, received_at TEXT DEFAULT (datetime('now')), deviceId TEXT, imageFileName TEXT, payload TEXT)")
+    conn.execute("INSERT INTO messages (deviceId, payload) VALUES ('esp32-1', ?)", (json.dumps({'freeHeap': 42}),))
+    conn.commit()
+    conn.close()
+    s = TelemetryStore(db_path=path)
+    s.init_db()
+    _, series = s.query_metrics(device='esp32-1', metrics=['freeHeap'], resolution='1m')
+    s.close()
+    assert series['freeHeap'][-1]['last'] == 42
+
+def test_messages_version_tracks_commits(store):
+    assert store.messages_version() == (0, 0)
+    store.insert_many([{'deviceId': 'a'}, {'deviceId': 'b'}])
+    assert store.messages_version() == (2, 0)
+    store.delete_messages([1])
+    assert store.messages_version() == (2, 1)
+
+def test_detections_searchable_by_label(store):
+    store.insert_message({'deviceId': 'esp32-1', 'imageFileName': 'cam/1.jpg'})
+    store.record_analysis('cam/1.jpg', '"e1"', 0.9, [
+        {'name': 'Mango', 'confidence': 0.9, 'bounding_box': {'x1': '1', 'y1': '2', 'x2': '30', 'y2': '40'}},
+        {'name': 'mango', 'confidence': 0.75}, {'name': 'person', 'confidence': 0.99}])
+    store.record_analysis('cam/2.jpg', '"e2"', 0.4, [{'name': 'mango', 'confidence': 0.4}])
+    assert store.flush(timeout=5)
+    items = store.query_detections(label='MANGO', min_confidence=0.7)
+    assert [(i['blobName'], i['matches'], i['deviceId']) for i in items] == [('cam/1.jpg', 2, 'esp32-1')]
+    assert items[0]['confidence'] == 0.9 and items[0]['bbox'] == {'x1': 1.0, 'y1': 2.0, 'x2': 30.0, 'y2': 40.0}
+    assert [i['blobName'] for i in store.query_detections(label='mango', device='esp32-2')] == []
+    assert {i['blobName'] for i in store.query_detections(label='mango')} == {'cam/1.jpg', 'cam/2.jpg'}
+    # re-analysis of the same blob version replaces its detections
+    store.record_analysis('cam/1.jpg', '"e1"', 0.0, [{'name': 'leaf', 'confidence': 0.5}])
+    assert store.flush(timeout=5)
+    assert store.query_detections(label='mango', min_confidence=0.7) == []
+    with store._reader() as conn:
+        plan = ' '.join(r[-1] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM detections WHERE label = 'mango' AND confidence >= 0.7"))
+    assert 'idx_detections_label' in plan
+
+def test_failed_statement_only_drops_its_own_group(tmp_path):
+    s = TelemetryStore(db_path=str(tmp_path / 'telemetry.db'), flush_size=100, flush_interval_ms=200)
+    s.init_db()
+    s.insert_message({'deviceId': 'a'})
+    s._queue.put(('INSERT INTO no_such_table VALUES (?)', (1,)))
+    s.insert_message({'deviceId': 'b'})
+    assert s.flush(timeout=5)
+    with pytest.raises(sqlite3.OperationalError):
+        s.write([('INSERT INTO no_such_table VALUES (?)', (1,))])
+    devices = sorted(m['deviceId'] for m in s.get_messages(limit=10))
+    s.close()
+    assert devices == ['a', 'b']
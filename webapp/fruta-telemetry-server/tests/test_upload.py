@@ -0,0 +1,129 @@
+import io
+import pytest
+from app import app
+from services import blob as sb
+from services import events as events_hub
+from services import http_client, telemetry_store, upload
+from services.events import Subscription
+from services.telemetry_store import TelemetryStore
+
+JPEG = b'\xff\xd8\xff\xe0' + bytes(range(256)) * 4
+
+
+class FakeResponse:
+    def __init__(self, n, status_code=201):
+        self.status_code = status_code
+        self.headers = {'ETag': f'"0x{n}"', 'Last-Modified': 'Fri, 16 Oct 2026 10:00:00 GMT'}
+
+    def raise_for_status(self):
+        pass
+
+
+class PickedUpAnalyzer:
+    def status(self):
+        return {'running': True}
+
+    def enqueue(self, blob_name, blob_url=None, etag=None):
+        return False
+
+    def pending(self, blob_name):
+        return True
+
+
+@pytest.fixture
+def puts(monkeypatch):
+    calls = []
+
+    def put(url, endpoint=None, data=None, headers=None):
+        calls.append((url, data, headers or {}))
+        return FakeResponse(len(calls))
+    monkeypatch.setattr(http_client, 'put', put)
+    return calls
+
+
+def test_rest_upload_stages_blocks_then_commits(puts):
+    svc = sb.BlobService(container_url='https://acct.blob.core.windows.net/c', sas_token='sig=x')
+    svc._sdk = None
+    stored = svc.upload_stream('dev/a.jpg', iter([JPEG[:100], JPEG[100:700], JPEG[700:]]),
+                               content_type='image/jpeg', block_size=400)
+    assert stored['size'] == len(JPEG) and stored['etag'] == '"0x4"'
+    blocks = [c for c in puts if 'comp=block&' in c[0]]
+    assert b''.join(data for _, data, _ in blocks) == JPEG
+    assert [len(data) for _, data, _ in blocks] == [400, 400, 228]
+    url, body, headers = puts[-1]
+    assert 'comp=blocklist' in url and url.endswith('&sig=x')
+    assert body.count(b'<Latest>') == 3 and headers['x-ms-blob-content-type'] == 'image/jpeg'
+    assert headers['If-None-Match'] == '*'
+
+
+def test_small_upload_is_a_single_put(puts):
+    svc = sb.BlobService(container_url='https://acct.blob.core.windows.net/c')
+    svc._sdk = None
+    stored = svc.upload_stream('a.jpg', iter([JPEG]), content_type='image/jpeg', block_size=4096)
+    assert len(puts) == 1 and puts[0][2]['x-ms-blob-type'] == 'BlockBlob'
+    assert stored['url'] == 'https://acct.blob.core.windows.net/c/a.jpg'
+    svc.upload_stream('a.jpg', iter([JPEG]), content_type='image/jpeg', overwrite=True)
+    assert 'If-None-Match' not in puts[1][2]
+
+
+def test_existing_blob_is_not_overwritten(monkeypatch):
+    monkeypatch.setattr(http_client, 'put', lambda url, endpoint=None, data=None, headers=None: FakeResponse(1, 409))
+    svc = sb.BlobService(container_url='https://acct.blob.core.windows.net/c')
+    svc._sdk = None
+    with pytest.raises(FileExistsError):
+        svc.upload_stream('a.jpg', iter([JPEG]), content_type='image/jpeg')
+
+
+def test_read_chunks_rejects_wrong_type_and_oversize():
+    with pytest.raises(upload.UploadError) as e:
+        list(upload.read_chunks(io.BytesIO(b'GIF89a...'), b'\xff\xd8\xff'))
+    assert e.value.status == 415
+    with pytest.raises(upload.UploadError) as e:
+        list(upload.read_chunks(io.BytesIO(JPEG), b'\xff\xd8\xff', max_bytes=100, chunk_size=64))
+    assert e.value.status == 413
+
+
+def test_upload_endpoint_requires_token(monkeypatch):
+    monkeypatch.setattr(upload, 'TOKEN', None)
+    with app.test_client() as client:
+        assert client.put('/api/upload/a.jpg', data=JPEG).status_code == 403
+        monkeypatch.setattr(upload, 'TOKEN', 'device-secret')
+        assert client.put('/api/upload/a.jpg', data=JPEG, headers={'Authorization': 'Bearer nope'}).status_code == 401
+
+
+def test_upload_endpoint_registers_blob_and_telemetry(tmp_path, monkeypatch, puts):
+    monkeypatch.setattr(upload, 'TOKEN', 'device-secret')
+    auth = {'Authorization': 'Bearer device-secret'}
+    monkeypatch.delitem(app.extensions, 'fruta_auto_analyze', raising=False)
+    store = TelemetryStore(db_path=str(tmp_path / 'telemetry.db'), flush_interval_ms=10)
+    store.init_db()
+    monkeypatch.setattr(telemetry_store, 'get_store', lambda: store)
+    svc = sb.BlobService(container_url='https://acct.blob.core.windows.net/c')
+    svc._sdk = None
+    index = sb.BlobListingIndex()
+    monkeypatch.setattr(sb, 'get_service', lambda **kw: svc)
+    monkeypatch.setattr(sb, 'get_listing_index', lambda s, prefix=None: index)
+    hub = events_hub.get_hub(app)
+    sub = Subscription()
+    monkeypatch.setattr(hub, '_subs', {sub})
+    try:
+        with app.test_client() as client:
+            resp = client.put('/api/upload/esp32-1-00001.jpg?deviceId=esp32-1', data=JPEG,
+                              content_type='image/jpeg', headers=auth)
+            assert resp.status_code == 201
+            body = resp.get_json()
+            # uploads never start the analyzer
+            assert body['size'] == len(JPEG) and body['analysisQueued'] is False
+            assert 'fruta_auto_analyze' not in app.extensions
+            # an analyzer that already took the blob from the upload's events still reports it queued
+            monkeypatch.setitem(app.extensions, 'fruta_auto_analyze', PickedUpAnalyzer())
+            resp = client.put('/api/upload/esp32-1-00002.jpg', data=JPEG, headers=auth)
+            assert resp.get_json()['analysisQueued'] is True
+            assert client.put('/api/upload/x.gif', data=b'GIF89a', headers=auth).status_code == 415
+    finally:
+        store.close()
+    assert sorted(it['name'] for it in index._sorted) == ['esp32-1-00001.jpg', 'esp32-1-00002.jpg']
+    event = sub.get(timeout=1)
+    assert event['type'] == 'blobs' and event['items'][0]['etag'] == body['etag']
+    msgs = store.get_messages(limit=5)
+    assert msgs[-1]['deviceId'] == 'esp32-1' and msgs[-1]['imageFileName'] == 'esp32-1-00001.jpg'